@@ -0,0 +1,124 @@
+"""Per-route admission control and load shedding.
+
+When the database slows down, requests for expensive pages pile up in
+every worker thread and take cheap routes down with them. Instead, each
+group of endpoints (timelines, auth, writes, static) may run at most a
+configured number of requests at once in this process. A request over
+the limit waits up to the group's queue timeout for a slot; if none
+frees up, it is answered at once with 503 and Retry-After rather than
+joining the pile-up.
+
+Limits are per process, so they only bite with threaded workers. Long-
+lived responses (the /stream SSE feed) are exempt, since they would hold
+a slot for as long as the tab is open.
+"""
+
+import threading
+import time
+
+from flask import Response, current_app, g, request
+
+from metrics import metrics
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class Gate:
+    """A semaphore for one group, reporting its in-flight and queued counts."""
+
+    def __init__(self, group, limit, queue_timeout):
+        self.group = group
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def _report(self):
+        metrics.set('warbler_admission_in_flight', self.in_flight, group=self.group)
+        metrics.set('warbler_admission_queue_depth', self.waiting, group=self.group)
+
+    def acquire(self):
+        """Take a slot, waiting up to queue_timeout; return whether we got one."""
+
+        admitted = self._slots.acquire(blocking=False)
+        if not admitted:
+            with self._lock:
+                self.waiting += 1
+                self._report()
+
+            start = time.perf_counter()
+            try:
+                admitted = self._slots.acquire(timeout=self.queue_timeout)
+            finally:
+                metrics.observe('warbler_admission_wait_seconds',
+                                time.perf_counter() - start, group=self.group)
+                with self._lock:
+                    self.waiting -= 1
+
+        with self._lock:
+            if admitted:
+                self.in_flight += 1
+            self._report()
+        return admitted
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._report()
+        self._slots.release()
+
+
+class AdmissionControl:
+    """Flask extension holding a Gate per ADMISSION_LIMITS group."""
+
+    def __init__(self):
+        self.gates = {}
+
+    def init_app(self, app):
+        self.gates = {group: Gate(group, limit, queue_timeout)
+                      for group, (limit, queue_timeout)
+                      in app.config['ADMISSION_LIMITS'].items()}
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def group_of(self, endpoint, method):
+        """The group `endpoint` belongs to for `method`, or None if unlimited.
+
+        Endpoints listed in ADMISSION_GROUPS keep their group; any other
+        unsafe method counts as a write.
+        """
+
+        config = current_app.config
+        if endpoint is None or endpoint in config['ADMISSION_EXEMPT']:
+            return None
+        group = config['ADMISSION_GROUPS'].get(endpoint)
+        if group is None and method not in SAFE_METHODS:
+            group = 'writes'
+        return group
+
+    def _before_request(self):
+        if not current_app.config['ADMISSION_ENABLED']:
+            return None
+
+        gate = self.gates.get(self.group_of(request.endpoint, request.method))
+        if gate is None:
+            return None
+
+        if not gate.acquire():
+            metrics.inc('warbler_admission_shed_total', group=gate.group)
+            return Response(
+                "The site is busy. Please try again shortly.",
+                status=503,
+                headers={'Retry-After': str(current_app.config['ADMISSION_RETRY_AFTER'])})
+
+        g.admission_gate = gate
+        return None
+
+    def _teardown_request(self, exc):
+        gate = g.pop('admission_gate', None)
+        if gate is not None:
+            gate.release()
+
+
+admission = AdmissionControl()
@@ -1,50 +1,144 @@
+import json
 import os
+from datetime import datetime, timedelta
 
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for
-from flask_debugtoolbar import DebugToolbarExtension
+import click
+
+from flask import Flask, Blueprint, render_template, request, flash, redirect, session, g, url_for
+from flask import Response, abort, current_app, jsonify, stream_with_context
 from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from config import profiles
 from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm
-from models import db, connect_db, User, Message
-
-import pdb
-import bcrypt
+from models import db, connect_db, User, Message, AccountDeletion
+from models import ArchivedMessage, MessageDeletion
+from pubsub import timeline_events
+from tasks import tasks
+from profiler import profiler
+from slowlog import slowlog
+from ratelimit import limiter
+from metrics import metrics
+from assets import assets
+from compression import compressor
+from admission import admission
+from timeline_cache import timeline_cache
+import read_models
+from tagging import backfill, index_messages, linkify
+from notifications import notifications, cursor, parse_cursor
+from prewarm import prewarmer
+from page_cache import page_cache
+from sharding import shards
+from availability import FIELDS, availability
+from deletion import resume_deletions, schedule_user_deletion
+from archive import archive_messages
+from export import MIMETYPES, SECTIONS, export_chunks
+from ingest import ingest
+from snowflake import id_at
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+bp = Blueprint('warbler', __name__, cli_group=None)
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-# app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+def create_app(profile=None):
+    """Create the Warbler app for `profile` (defaults to $FLASK_ENV).
 
-app.config['DEBUG'] = True
+    Production WSGI servers should use:
 
-toolbar = DebugToolbarExtension(app)
+        FLASK_ENV=production gunicorn app:app
+    """
 
-connect_db(app)
+    profile = profile or os.environ.get('FLASK_ENV', 'development')
+
+    app = Flask(__name__)
+    app.config.from_object(profiles[profile])
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use the profile's local db.
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', app.config['SQLALCHEMY_DATABASE_URI']))
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', app.config['SECRET_KEY'])
+    if not app.config['SECRET_KEY']:
+        raise RuntimeError(f"Set SECRET_KEY in the environment for the {profile} profile.")
+    for key in ('PROFILER_TOKEN', 'RATELIMIT_STORAGE_URL', 'PAGE_CACHE_STORAGE_URL'):
+        app.config[key] = os.environ.get(key, app.config[key])
+    if 'SHARD_DATABASE_URLS' in os.environ:
+        app.config['SHARD_DATABASE_URLS'] = os.environ['SHARD_DATABASE_URLS'].split()
+    if 'PROXY_COUNT' in os.environ:
+        app.config['PROXY_COUNT'] = int(os.environ['PROXY_COUNT'])
+
+    trust_proxies(app)
+
+    # registered first so it runs last; see Compressor.init_app
+    compressor.init_app(app)
+    # its before_request hook runs ahead of the others, so shed requests
+    # cost no database work
+    admission.init_app(app)
+
+    if app.config['DEBUG_TOOLBAR']:
+        # imported here: the toolbar is slow to import and hooks every
+        # request and query, so production never loads it
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    connect_db(app)
+    tasks.init_app(app)
+    profiler.init_app(app)
+    slowlog.init_app(app)
+    limiter.init_app(app)
+    assets.init_app(app)
+    timeline_cache.init_app(app)
+    notifications.init_app(app)
+    prewarmer.init_app(app)
+    page_cache.init_app(app)
+    shards.init_app(app)
+    availability.init_app(app)
+
+    app.add_template_filter(linkify)
+    app.register_blueprint(bp)
+
+    return app
+
+
+def trust_proxies(app):
+    """Take the client address and scheme from the X-Forwarded headers set
+    by app.config['PROXY_COUNT'] proxies."""
+
+    count = app.config['PROXY_COUNT']
+    if count:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=count, x_proto=count)
 
 
 ##############################################################################
 # User signup/login/logout
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
         g.user = User.query.get(session[CURR_USER_KEY])
 
+        if g.user and g.user.deleted_at:
+            g.user = None
+
     else:
         g.user = None
 
 
+def read_store():
+    """read_models, or the shard router if SHARD_DATABASE_URLS is set."""
+
+    return shards if shards.enabled else read_models
+
+
+def current_following_ids():
+    """IDs of the users the logged-in user follows (empty if logged out)."""
+
+    return read_store().following_ids(g.user.id) if g.user else set()
+
+
 def do_login(user):
     """Log in user."""
 
@@ -58,7 +152,8 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@bp.route('/signup', methods=["GET", "POST"])
+@limiter.limit('auth')
 def signup():
     """Handle user signup.
 
@@ -74,6 +169,12 @@ def signup():
 
     # does what form.validate_on_submit would, but bypasses extra_validators argument, which was throwing errors
     if form.is_submitted() and form.validate():
+        # skip the bcrypt work (and the failed INSERT) for names we know are taken
+        taken = taken_message(form.username.data, form.email.data)
+        if taken:
+            flash(taken, 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -84,10 +185,19 @@ def signup():
             db.session.commit()
 
         except IntegrityError:
-            flash("Username already taken", 'danger')
+            # another worker took one of them; find out which, and remember it
+            db.session.rollback()
+            availability.learn(form.username.data, form.email.data)
+            flash(taken_message(form.username.data, form.email.data)
+                  or "Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        availability.add(user.username, user.email)
+        if shards.enabled:
+            shards.save_user(user)
+
         do_login(user)
+        prewarmer.warm(user.id)
 
         return redirect("/")
 
@@ -95,7 +205,36 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+def taken_message(username, email):
+    """The error to show if `username` or `email` is in use, else None."""
+
+    if availability.is_taken('username', username):
+        return "Username already taken"
+    if availability.is_taken('email', email):
+        return "E-mail already registered"
+    return None
+
+
+@bp.route('/api/availability')
+@limiter.limit('availability', methods=('GET',))
+def check_availability():
+    """Is the ?username= given free to sign up with?
+
+    Answers {"username": true} (true meaning available) for the signup
+    form as the user types. Emails aren't checked here, so this can't be
+    used to find out who has an account; signup itself still says if an
+    email is registered, behind the auth rate limit.
+    """
+
+    username = request.args.get('username')
+    if not username:
+        return jsonify(error="Give a username."), 400
+
+    return jsonify(username=not availability.is_taken('username', username))
+
+
+@bp.route('/login', methods=["GET", "POST"])
+@limiter.limit('auth')
 def login():
     """Handle user login."""
 
@@ -107,6 +246,7 @@ def login():
 
         if user:
             do_login(user)
+            prewarmer.warm(user.id)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
 
@@ -115,7 +255,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -127,7 +267,7 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users')
+@bp.route('/users')
 def list_users():
     """Page with listing of users.
 
@@ -136,33 +276,30 @@ def list_users():
 
     search = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    users = read_store().user_cards(search)
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users,
+                           following_ids=current_following_ids())
 
 
-@app.route('/users/<int:user_id>')
+@bp.route('/users/<int:user_id>')
+@page_cache.cached
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    store = read_store()
+    user = store.user_profile(user_id) or abort(404)
+    page_cache.tag(f"user:{user_id}")
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
+    messages = store.timeline_cards([user_id], window=timeline_window())
 
-    return render_template('users/show.html', user=user, messages=messages)
+    return render_template('users/show.html', user=user, messages=messages,
+                           following_ids=current_following_ids())
 
 
-@app.route('/users/<int:user_id>/following')
+@bp.route('/users/<int:user_id>/following')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -170,11 +307,14 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = read_store().user_profile(user_id) or abort(404)
+    users = read_store().following_cards(user_id)
+
+    return render_template('users/following.html', user=user, users=users,
+                           following_ids=current_following_ids())
 
 
-@app.route('/users/<int:user_id>/followers')
+@bp.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -182,11 +322,14 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = read_store().user_profile(user_id) or abort(404)
+    users = read_store().follower_cards(user_id)
+
+    return render_template('users/followers.html', user=user, users=users,
+                           following_ids=current_following_ids())
 
 
-@app.route('/users/follow/<int:follow_id>', methods=['POST'])
+@bp.route('/users/follow/<int:follow_id>', methods=['POST'])
 def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
@@ -195,13 +338,21 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    if shards.enabled:
+        shards.follow(g.user.id, followed_user.id)
+    else:
+        g.user.following.append(followed_user)
+    notifications.notify(followed_user.id, 'follow', followed_user.id, g.user.id)
     db.session.commit()
 
+    prewarmer.discard(g.user.id, followed_user.id)
+    page_cache.purge(f"user:{g.user.id}", f"user:{followed_user.id}")
+    prewarmer.warm(g.user.id)
+
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
+@bp.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
@@ -210,13 +361,21 @@ def stop_following(follow_id):
         return redirect("/")
 
     followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    if shards.enabled:
+        shards.unfollow(g.user.id, followed_user.id)
+    else:
+        g.user.following.remove(followed_user)
+    notifications.retract(followed_user.id, 'follow', followed_user.id, g.user.id)
     db.session.commit()
 
+    prewarmer.discard(g.user.id, followed_user.id)
+    page_cache.purge(f"user:{g.user.id}", f"user:{followed_user.id}")
+
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
+@limiter.limit('auth', by_user=True)
 def profile():
     """Update profile for current user."""
 
@@ -229,16 +388,38 @@ def profile():
 
     if form.is_submitted() and form.validate():
         if User.authenticate(user.username, form.password.data):
+            old = {field: getattr(user, field) for field in FIELDS}
+            changed = {field: form[field].data for field in FIELDS
+                       if form[field].data != old[field]}
+            taken = taken_message(changed.get('username'), changed.get('email'))
+            if taken:
+                flash(taken, "danger")
+                return render_template('users/edit.html', form=form, user_id=user.id)
+
             form.populate_obj(user)
-            db.session.commit()
-            return redirect(url_for('users_show', user_id=user.id))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # taken on another worker since this one built its filters
+                db.session.rollback()
+                availability.learn(changed.get('username'), changed.get('email'))
+                flash(taken_message(changed.get('username'), changed.get('email'))
+                      or "Username already taken", "danger")
+                return render_template('users/edit.html', form=form, user_id=user.id)
+
+            availability.add(**changed)
+            if shards.enabled:
+                shards.save_user(user)
+            prewarmer.discard(user.id)
+            page_cache.purge(f"user:{user.id}")
+            return redirect(url_for('.users_show', user_id=user.id))
         else:
             flash("Password incorrect.", "danger")
             return render_template('users/edit.html', form=form, user_id=user.id)
     return render_template('users/edit.html', form=form, user_id=user.id)
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -248,13 +429,93 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
-    db.session.commit()
+    user_id = g.user.id
+    schedule_user_deletion(g.user)
+    page_cache.purge(f"user:{user_id}")
 
+    flash("Your account has been deleted.", "success")
     return redirect("/signup")
 
 
-@app.route('/users/toggle_like/<int:msg_id>', methods=['POST'])
+@bp.route('/admin/deletions')
+def admin_deletions():
+    """Show progress of recent account deletions (admins only)."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    deletions = (AccountDeletion
+                 .query
+                 .order_by(AccountDeletion.requested_at.desc())
+                 .limit(100)
+                 .all())
+
+    return render_template('admin/deletions.html', deletions=deletions)
+
+
+@bp.cli.command('resume-deletions')
+def resume_deletions_command():
+    """Finish account purges that failed or were cut short by a restart."""
+
+    count = resume_deletions()
+    failed = AccountDeletion.query.filter_by(status='failed').count()
+    click.echo(f"Resumed {count} account deletions, {failed} still failing.")
+    if failed:
+        raise click.ClickException("See /admin/deletions for the errors.")
+
+
+@bp.route('/admin/graph')
+def admin_graph():
+    """Show the most influential accounts by follow graph (admins only)."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    users = read_store().influential_users(limit=50)
+
+    return render_template('admin/graph.html', users=users)
+
+
+@bp.route('/admin/slow-queries')
+def admin_slow_queries():
+    """Show the newest entries of the slow-query log (admins only)."""
+
+    if not g.user or not g.user.is_admin:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    return render_template('admin/slow_queries.html', queries=slowlog.recent(100))
+
+
+@bp.cli.command('graph-analytics')
+@click.option('--batch-size', type=int, default=100_000,
+              help="Follows fetched per round trip.")
+@click.option('--chunk-size', type=int, default=1_000_000,
+              help="Edges processed per vectorized step.")
+def graph_analytics_command(batch_size, chunk_size):
+    """Recompute follow-graph metrics for every user."""
+
+    # imported here so the web app never pays for loading NumPy
+    import graph_analytics
+
+    count = graph_analytics.run(batch_size, chunk_size)
+    click.echo(f"Computed graph metrics for {count} users.")
+
+
+@bp.cli.command('create-shards')
+def create_shards_command():
+    """Create the sharded tables in every SHARD_DATABASE_URLS database."""
+
+    if not shards.enabled:
+        raise click.ClickException("SHARD_DATABASE_URLS is not set.")
+
+    shards.create_all()
+    click.echo(f"Created tables on {len(shards.engines)} shards.")
+
+
+@bp.route('/users/toggle_like/<int:msg_id>', methods=['POST'])
 def toggle_like(msg_id):
     """Toggle like for currently logged in user"""
 
@@ -262,26 +523,38 @@ def toggle_like(msg_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    liked_msg = Message.query.get_or_404(msg_id)
+    if shards.enabled:
+        liked_msg = shards.message(msg_id) or abort(404)
+    else:
+        liked_msg = Message.query.get_or_404(msg_id)
 
     if liked_msg.user_id == g.user.id:
         flash('Sorry, you may not like your own message.')
         return redirect('/')
-    
-    user_likes = g.user.likes
 
-    if liked_msg in user_likes:
-        g.user.likes = [like for like in user_likes if like != liked_msg]
+    if shards.enabled:
+        liked = shards.toggle_like(g.user.id, liked_msg.id)
+    else:
+        user_likes = g.user.likes
+        liked = liked_msg not in user_likes
+        if liked:
+            g.user.likes.append(liked_msg)
+        else:
+            g.user.likes = [like for like in user_likes if like != liked_msg]
 
+    if liked:
+        notifications.notify(liked_msg.user_id, 'like', liked_msg.id, g.user.id)
     else:
-        g.user.likes.append(liked_msg)
+        notifications.retract(liked_msg.user_id, 'like', liked_msg.id, g.user.id)
 
     db.session.commit()
+    prewarmer.discard(g.user.id)
+    page_cache.purge(f"user:{g.user.id}")
 
     return redirect('/')
 
 
-@app.route('/users/<int:user_id>/likes')
+@bp.route('/users/<int:user_id>/likes')
 def show_likes(user_id):
     """Show a user's likes"""
 
@@ -289,15 +562,17 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = read_store().user_profile(user_id) or abort(404)
+    likes = read_store().liked_cards(user_id)
 
-    return render_template('users/likes.html', user=user, likes=user.likes)
+    return render_template('users/likes.html', user=user, likes=likes,
+                           following_ids=current_following_ids())
 
 
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def messages_add():
     """Add a message:
 
@@ -311,24 +586,40 @@ def messages_add():
     form = MessageForm()
 
     if form.is_submitted() and form.validate():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
-        db.session.commit()
+        if shards.enabled:
+            # tags and mentions index the main database's messages only
+            msg = shards.add_message(g.user.id, form.text.data)
+        else:
+            msg = Message(text=form.text.data)
+            g.user.messages.append(msg)
+            db.session.flush()
+            index_messages([msg])
+            db.session.commit()
+
+        messages_posted(g.user.id, [msg])
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
-@app.route('/messages/<int:message_id>', methods=["GET"])
+@bp.route('/messages/<int:message_id>', methods=["GET"])
+@page_cache.cached
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = shards.message(message_id) if shards.enabled else Message.query.get(message_id)
+
+    if msg is None:
+        msg = ArchivedMessage.query.get_or_404(message_id)
 
+    page_cache.tag(f"message:{message_id}", f"user:{msg.user_id}")
 
-@app.route('/messages/<int:message_id>/delete', methods=["POST"])
+    return render_template('messages/show.html', message=msg,
+                           following_ids=current_following_ids())
+
+
+@bp.route('/messages/<int:message_id>/delete', methods=["POST"])
 def messages_destroy(message_id):
     """Delete a message."""
 
@@ -336,22 +627,364 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get(message_id)
+    msg = shards.message(message_id) if shards.enabled else Message.query.get(message_id)
+
+    if msg is None:
+        msg = ArchivedMessage.query.get_or_404(message_id)
 
-    if msg.user.id != g.user.id:
+    if msg.user_id != g.user.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    db.session.delete(msg)
+    if isinstance(msg, Message):
+        message_deleted(msg)
+
+    if shards.enabled and isinstance(msg, Message):
+        shards.delete_message(msg)
+    else:
+        db.session.delete(msg)
     db.session.commit()
+    page_cache.purge(f"message:{message_id}", f"user:{g.user.id}")
 
     return redirect(f"/users/{g.user.id}")
 
 
+@bp.route('/api/messages/bulk', methods=["POST"])
+def messages_bulk():
+    """Post many messages as the logged-in user from an NDJSON body.
+
+    Each line is {"text": "..."}. Valid lines are posted and invalid ones
+    reported, as JSON: {"ids": [...], "errors": [{"line": n, "error": ...}]}.
+    IDs are strings, as elsewhere in the API.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    # not a form-encodable type, so a cross-site form can't post here
+    if request.mimetype != 'application/x-ndjson':
+        return jsonify(error="Expected Content-Type: application/x-ndjson."), 415
+
+    config = current_app.config
+    user_id = g.user.id
+    result = ingest(user_id, request.stream,
+                    batch_size=config['INGEST_BATCH_SIZE'],
+                    max_rows=config['INGEST_MAX_ROWS'],
+                    on_commit=lambda batch: messages_posted(user_id, batch))
+
+    return jsonify(ids=[str(msg_id) for msg_id in result.ids],
+                   errors=[{'line': line, 'error': error}
+                           for line, error in result.errors])
+
+
+@bp.cli.command('ingest-messages')
+@click.argument('username')
+@click.argument('input', type=click.File('rb'), default='-')
+def ingest_messages_command(username, input):
+    """Post each NDJSON line of INPUT (stdin by default) as USERNAME."""
+
+    user = User.query.filter_by(username=username, deleted_at=None).first()
+    if user is None:
+        raise click.ClickException(f"No user {username}.")
+
+    result = ingest(user.id, input,
+                    batch_size=current_app.config['INGEST_BATCH_SIZE'],
+                    on_commit=lambda batch: messages_posted(user.id, batch))
+
+    for line, error in result.errors:
+        click.echo(f"line {line}: {error}", err=True)
+    click.echo(f"Posted {len(result.ids)} messages, skipped {len(result.errors)} lines.")
+
+
+def messages_posted(user_id, messages):
+    """Update live streams and caches after `user_id`'s new `messages` are
+    committed."""
+
+    follower_ids = read_store().follower_ids(user_id)
+
+    timeline_cache.add(*messages)
+    # their followers' warmed homepages lack these now
+    prewarmer.discard(user_id, *follower_ids)
+    page_cache.purge(f"user:{user_id}")
+    publish_messages(user_id, messages, follower_ids)
+
+
+def message_deleted(msg):
+    """Update caches, notifications and tombstones for a message about to be
+    deleted."""
+
+    timeline_cache.remove(msg)
+    notifications.forget_message(msg)
+    db.session.add(MessageDeletion(message_id=msg.id, user_id=msg.user_id))
+    prewarmer.discard(msg.user_id, *read_store().follower_ids(msg.user_id))
+
+
+##############################################################################
+# Notifications
+
+@bp.route('/notifications')
+def show_notifications():
+    """Show the logged-in user's notifications, most recent first.
+
+    Takes a 'before' cursor in the querystring for older pages. Viewing the
+    first page marks everything read.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    before = request.args.get('before')
+    if before is not None:
+        before = parse_cursor(before) or abort(400)
+
+    limit = current_app.config['NOTIFICATIONS_PAGE_SIZE']
+    cards = read_models.notification_cards(g.user.id, before=before, limit=limit)
+
+    if before is None:
+        notifications.mark_read(g.user.id)
+        db.session.commit()
+
+    return render_template('users/notifications.html', notifications=cards,
+                           before=cursor(cards[-1]) if len(cards) == limit else None)
+
+
+##############################################################################
+# Tags and mentions
+
+@bp.route('/tags/<tag>')
+def tag_timeline(tag):
+    """Show messages with a #tag, newest first.
+
+    Takes a 'before' message ID in the querystring for older pages.
+    """
+
+    limit = current_app.config['TAG_PAGE_SIZE']
+    messages = read_models.tag_cards(tag.lower(),
+                                     before=request.args.get('before', type=int),
+                                     limit=limit)
+
+    return render_template('messages/list.html', title=f"#{tag.lower()}",
+                           messages=messages,
+                           before=messages[-1].id if len(messages) == limit else None)
+
+
+@bp.route('/users/<int:user_id>/mentions')
+def show_mentions(user_id):
+    """Show messages that @mention a user, newest first."""
+
+    user = read_models.user_profile(user_id) or abort(404)
+
+    limit = current_app.config['TAG_PAGE_SIZE']
+    messages = read_models.mention_cards(user_id,
+                                         before=request.args.get('before', type=int),
+                                         limit=limit)
+
+    return render_template('messages/list.html', title=f"Mentions of @{user.username}",
+                           messages=messages,
+                           before=messages[-1].id if len(messages) == limit else None)
+
+
+@bp.cli.command('backfill-tags')
+@click.option('--batch-size', type=int, default=1000)
+def backfill_tags_command(batch_size):
+    """Index #tags and @mentions in existing messages."""
+
+    count = backfill(batch_size)
+    click.echo(f"Indexed {count} messages.")
+
+
+##############################################################################
+# Live timeline updates (server-sent events)
+
+def publish_messages(user_id, messages, follower_ids):
+    """Tell the author and their connected followers about new messages."""
+
+    channels = list(follower_ids) + [user_id]
+
+    for msg in messages:
+        timeline_events.publish(channels, {"id": msg.id, "user_id": user_id})
+
+
+@bp.route('/stream')
+def timeline_stream():
+    """Stream IDs of new messages for the logged-in user's timeline."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    sub = timeline_events.subscribe(g.user.id)
+    keepalive = current_app.config['STREAM_KEEPALIVE']
+
+    # don't pin a pooled DB connection for the lifetime of the stream
+    db.session.close()
+
+    def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                payload = sub.get(timeout=keepalive)
+                if payload is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: message\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            sub.close()
+
+    return Response(stream_with_context(events()),
+                    mimetype='text/event-stream',
+                    headers={'X-Accel-Buffering': 'no'})
+
+
+##############################################################################
+# Timeline deltas
+
+def delta_cursor():
+    """A cursor for deltas that starts now.
+
+    It trails the clock by TIMELINE_DELTA_LAG seconds: message IDs are
+    taken before commit, so a message may become visible after a newer
+    one, and a cursor right at the newest ID could skip it.
+    """
+
+    lag = timedelta(seconds=current_app.config['TIMELINE_DELTA_LAG'])
+    return id_at(datetime.utcnow() - lag)
+
+
+@bp.route('/api/timeline/since')
+def timeline_since():
+    """Changes to the logged-in user's home timeline since ?cursor=, as JSON.
+
+    Returns messages newer than the cursor, the IDs of messages deleted
+    since it, and the cursor for the next call. Messages near the cursor
+    can be sent twice, so clients should skip IDs they already have. With
+    "reset": true the gap is too large to fill; reload the timeline.
+    IDs are strings, since snowflakes don't fit in a JavaScript number.
+    """
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
+
+    since = request.args.get('cursor', type=int)
+    if since is None:
+        abort(400)
+
+    config = current_app.config
+    next_cursor = max(since, delta_cursor())
+    retention = timedelta(days=config['TIMELINE_DELTA_RETENTION_DAYS'])
+
+    # tombstones older than this may have been pruned
+    if since < id_at(datetime.utcnow() - retention):
+        return jsonify(reset=True, cursor=str(next_cursor), messages=[], deleted=[])
+
+    store = read_store()
+    author_ids = list(store.following_ids(g.user.id)) + [g.user.id]
+    limit = config['TIMELINE_DELTA_LIMIT']
+    messages = store.cards_since(author_ids, since, limit)
+    deleted = store.deleted_since(author_ids, since)
+
+    return jsonify(
+        reset=len(messages) == limit,
+        cursor=str(next_cursor),
+        messages=[{'id': str(msg.id),
+                   'text': msg.text,
+                   'timestamp': msg.timestamp.isoformat(),
+                   'user': msg.user._asdict()}
+                  for msg in messages],
+        deleted=[str(msg_id) for msg_id in deleted])
+
+
+@bp.cli.command('prune-deletions')
+def prune_deletions_command():
+    """Delete message tombstones older than TIMELINE_DELTA_RETENTION_DAYS."""
+
+    days = current_app.config['TIMELINE_DELTA_RETENTION_DAYS']
+    before = id_at(datetime.utcnow() - timedelta(days=days))
+
+    count = (MessageDeletion.query
+             .filter(MessageDeletion.id < before)
+             .delete(synchronize_session=False))
+    db.session.commit()
+    click.echo(f"Pruned {count} message tombstones.")
+
+
+##############################################################################
+# Data export
+
+@bp.route('/users/<int:user_id>/export')
+def export_user(user_id):
+    """Download a user's data (themselves or admins only).
+
+    ?format=ndjson (default) has every section; ?format=csv&section=...
+    has one of profile, messages, archived_messages, likes, following
+    or followers.
+    """
+
+    if not g.user or (g.user.id != user_id and not g.user.is_admin):
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user = db.session.get(User, user_id) or abort(404)
+    format = request.args.get('format', 'ndjson')
+    section = request.args.get('section', 'messages')
+    if format not in MIMETYPES or section not in SECTIONS:
+        abort(400)
+
+    filename = f"warbler-{user.username}" + (
+        f"-{section}.csv" if format == 'csv' else ".ndjson")
+    chunks = export_chunks(user_id, format, section,
+                           current_app.config['EXPORT_BATCH_SIZE'])
+
+    return Response(stream_with_context(chunks),
+                    mimetype=MIMETYPES[format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@bp.cli.command('export-user')
+@click.argument('user_id', type=int)
+@click.option('--format', type=click.Choice(sorted(MIMETYPES)), default='ndjson')
+@click.option('--section', type=click.Choice(list(SECTIONS)), default='messages',
+              help="Section to export as CSV.")
+@click.option('--output', type=click.File('w'), default='-')
+def export_user_command(user_id, format, section, output):
+    """Write a user's data to --output (stdout by default)."""
+
+    if db.session.get(User, user_id) is None:
+        raise click.ClickException(f"No user {user_id}.")
+
+    for chunk in export_chunks(user_id, format, section,
+                               current_app.config['EXPORT_BATCH_SIZE']):
+        output.write(chunk)
+
+
+##############################################################################
+# Message archiving
+
+def timeline_window():
+    """How far back timeline queries look before scanning all history."""
+
+    return timedelta(days=current_app.config['TIMELINE_WINDOW_DAYS'])
+
+
+@bp.cli.command('archive-messages')
+@click.option('--days', type=int, default=None,
+              help="Archive messages older than this many days.")
+def archive_messages_command(days):
+    """Move old messages into compressed cold storage."""
+
+    days = days if days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    before = datetime.utcnow() - timedelta(days=days)
+
+    count = archive_messages(before, current_app.config['ARCHIVE_BATCH_SIZE'])
+    click.echo(f"Archived {count} messages older than {before:%Y-%m-%d}.")
+
+
 ##############################################################################
 # Homepage and error pages
 
-@app.route('/')
+@bp.route('/')
+@page_cache.cached
 def homepage():
     """Show homepage:
 
@@ -360,22 +993,43 @@ def homepage():
     """
 
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
+        page = prewarmer.take(g.user.id) or home_page(g.user.id)
+
+        return render_template('home.html', **page)
+
+    else:
+        return render_template('home-anon.html')
 
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        
-        likes = [like.id for like in g.user.likes]
+@prewarmer.loader
+def home_page(user_id):
+    """The homepage's template context for `user_id`."""
 
-        return render_template('home.html', messages=messages, likes=likes)
+    store = read_store()
+    following_ids = list(store.following_ids(user_id)) + [user_id]
 
+    if current_app.config['TIMELINE_READ_PATH'] == 'cache' and not shards.enabled:
+        messages = timeline_cache.timeline(following_ids)
     else:
-        return render_template('home-anon.html')
+        messages = store.timeline_cards(following_ids, window=timeline_window())
+
+    return dict(messages=messages,
+                cursor=delta_cursor(),
+                likes=store.liked_ids(user_id),
+                profile=store.user_profile(user_id))
+
+
+##############################################################################
+# Operational endpoints
+
+@bp.route('/metrics')
+def show_metrics():
+    """Expose counters in Prometheus text format to allowed scrapers."""
+
+    if request.remote_addr not in current_app.config['METRICS_ALLOWED_IPS']:
+        abort(404)
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 ##############################################################################
@@ -385,12 +1039,27 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(req):
     """Add non-caching headers on every request."""
 
+    # fingerprinted assets never change, so leave their caching alone
+    if req.cache_control.immutable:
+        return req
+
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
     req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
\ No newline at end of file
+    return req
+
+
+def __getattr__(name):
+    # The default app is created on first use of `app.app`, not at import,
+    # so scripts (benchmarks.py) can import create_app and build their own
+    # without also configuring and connecting a development one.
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,90 @@
+"""Move old messages into compressed cold storage.
+
+Timeline reads only look at recent messages, so everything older than
+ARCHIVE_AFTER_DAYS is moved from `messages` to `archived_messages` in
+batches. Run it from cron:
+
+    flask archive-messages --days 365
+
+With sharding on, each shard's messages are archived into the main
+database. Each batch is committed there before it's deleted from its
+shard, so an interruption leaves messages in both places, never neither,
+and the next run finishes the job.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import delete, select
+
+from models import db, ArchivedMessage, Likes, Message
+from sharding import shards
+from snowflake import id_at
+
+
+def archive_messages(before, batch_size=1000):
+    """Archive messages posted before the datetime `before`.
+
+    Returns the number of messages archived.
+    """
+
+    if not shards.enabled:
+        return _archive(db.session, before, batch_size)
+
+    total = 0
+    for shard in range(len(shards.engines)):
+        with shards.session(shard) as session:
+            total += _archive(session, before, batch_size)
+    return total
+
+
+def _likes_of(session, ids):
+    """(message_id, user_id) likes of `ids`; from every shard if sharded."""
+
+    stmt = select(Likes.message_id, Likes.user_id).where(Likes.message_id.in_(ids))
+    if session is db.session:
+        return session.execute(stmt).all()
+    return [like for likes in shards.gather(
+                lambda shard_session, shard: shard_session.execute(stmt).all())
+            for like in likes]
+
+
+def _archive(session, before, batch_size):
+    """Archive `session`'s messages before `before` into the main database."""
+
+    total = 0
+
+    while True:
+        rows = session.execute(
+            select(Message.id, Message.text, Message.timestamp, Message.user_id)
+            # the ID bound keeps this a primary key range scan; pre-snowflake
+            # IDs are all below it, so the timestamp check still applies
+            .where(Message.id < id_at(before), Message.timestamp < before)
+            .order_by(Message.id)
+            .limit(batch_size)).all()
+
+        if not rows:
+            return total
+
+        ids = [row.id for row in rows]
+
+        liked_by = defaultdict(list)
+        for like in _likes_of(session, ids):
+            liked_by[like.message_id].append(like.user_id)
+
+        archived = [ArchivedMessage.from_message(row, liked_by[row.id]) for row in rows]
+
+        if session is db.session:
+            db.session.add_all(archived)
+            # the likes rows themselves go with the message via ondelete='cascade'
+        else:
+            # merged, in case an interrupted run archived them already
+            for msg in archived:
+                db.session.merge(msg)
+            db.session.commit()
+            shards.delete_likes_of(ids)
+
+        session.execute(delete(Message).where(Message.id.in_(ids)),
+                        execution_options={'synchronize_session': False})
+        session.commit()
+
+        total += len(rows)
@@ -0,0 +1,79 @@
+"""Serve fingerprinted, precompressed static assets built by build_assets.py.
+
+Templates pass static URLs through the `asset` filter:
+
+    <link rel="stylesheet" href="{{ '/static/stylesheets/style.css' | asset }}">
+
+which returns /static/dist/<hashed name> once the assets are built, and the
+plain URL otherwise (e.g. in development). Hashed files are served with
+the best precompressed variant the client accepts and are cached forever.
+"""
+
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+from jinja2 import pass_context
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+class Assets:
+    """Flask extension for the asset manifest and /static/dist/."""
+
+    def init_app(self, app):
+        self.dist_dir = os.path.join(app.static_folder, 'dist')
+        self.manifest = {}
+
+        manifest_path = os.path.join(self.dist_dir, 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+
+        app.add_template_filter(self._filter, 'asset')
+        app.add_url_rule('/static/dist/<path:filename>', 'asset',
+                         self.serve)
+
+    def url(self, url):
+        """Hashed URL for a /static/... URL, if it has been built."""
+
+        if url and url.startswith('/static/'):
+            hashed = self.manifest.get(url[len('/static/'):])
+            if hashed:
+                return f"/static/dist/{hashed}"
+        return url
+
+    @pass_context
+    def _filter(self, context, url):
+        # Taking the context stops Jinja from folding `'/static/x' | asset`
+        # into the compiled template, which would pin the manifest that was
+        # loaded when the template was first compiled.
+        return self.url(url)
+
+    def serve(self, filename):
+        """Send `filename`, precompressed if the client accepts it."""
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accepted = request.accept_encodings
+
+        for encoding, suffix in ENCODINGS:
+            if (accepted[encoding]
+                    and os.path.isfile(os.path.join(self.dist_dir, filename + suffix))):
+                response = send_from_directory(self.dist_dir, filename + suffix,
+                                               mimetype=mimetype, max_age=ONE_YEAR)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.dist_dir, filename,
+                                           mimetype=mimetype, max_age=ONE_YEAR)
+
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+assets = Assets()
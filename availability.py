@@ -0,0 +1,177 @@
+"""In-memory pre-checks for taken usernames and emails.
+
+signup() used to find duplicates by hashing the password, attempting the
+insert and catching the IntegrityError. Now it first asks
+availability.is_taken(), which consults a counting Bloom filter per
+field and only queries the database when the filter says "maybe": a
+filter miss means the value is certainly not in the filter, so new names
+never cost a query.
+
+The filters are loaded from the users table on first use in each process
+and rebuilt from it every AVAILABILITY_REFRESH seconds. In between, values
+this process commits are added, but nothing is ever removed: a value
+freed by a rename or purge stays a "maybe" (costing a query) until the
+next rebuild, since decrementing counters for a value this process never
+added (say, a user who signed up on another worker) would corrupt the
+filter into missing values that are still taken. Signups and renames on
+other workers aren't seen until the rebuild, or until this one learns of
+them from an IntegrityError, so a miss is only as current as the last
+rebuild and the unique constraints remain the final word.
+"""
+
+import math
+import threading
+import time
+from hashlib import blake2b
+
+from sqlalchemy import select
+
+from metrics import metrics
+from models import db, User
+
+FIELDS = ('username', 'email')
+
+
+class CountingBloomFilter:
+    """A Bloom filter with 8-bit counters, so items can be removed."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.counters = bytearray(self.size)
+
+    def _positions(self, item):
+        # double hashing: k positions from two 64-bit halves of one digest
+        digest = blake2b(item.encode('UTF-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            if self.counters[pos] < 255:
+                self.counters[pos] += 1
+
+    def remove(self, item):
+        """Undo one add() of `item`. Removing anything never added corrupts
+        the filter."""
+
+        for pos in self._positions(item):
+            # a saturated counter no longer knows its count; leave it
+            if 0 < self.counters[pos] < 255:
+                self.counters[pos] -= 1
+
+    def __contains__(self, item):
+        return all(self.counters[pos] for pos in self._positions(item))
+
+
+class Availability:
+    """Flask extension holding a filter of taken values per User field."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+        self._filters = None
+        self._loaded_at = None
+        self._added = None      # values add()ed while a rebuild is loading
+
+    def init_app(self, app):
+        self.app = app
+        with self._lock:
+            self._filters = None
+
+    def _load(self):
+        config = self.app.config
+        count = db.session.scalar(select(db.func.count(User.id))) or 0
+        capacity = max(config['AVAILABILITY_CAPACITY'], 2 * count)
+        filters = {field: CountingBloomFilter(capacity, config['AVAILABILITY_ERROR_RATE'])
+                   for field in FIELDS}
+
+        result = db.session.execute(select(User.username, User.email),
+                                    execution_options={'yield_per': 10_000})
+        for username, email in result:
+            filters['username'].add(username)
+            filters['email'].add(email)
+
+        return filters
+
+    def _fresh(self):
+        return (self._filters is not None and time.monotonic() - self._loaded_at
+                < self.app.config['AVAILABILITY_REFRESH'])
+
+    def filters(self):
+        """The filters, loading them if this process hasn't yet, or if they
+        are older than AVAILABILITY_REFRESH seconds.
+
+        While one thread rebuilds them, others keep using the old ones.
+        """
+
+        with self._lock:
+            if self._fresh():
+                return self._filters
+            stale = self._filters
+
+        if not self._loading.acquire(blocking=stale is None):
+            return stale
+
+        try:
+            with self._lock:
+                if self._fresh():
+                    return self._filters
+                self._added = []
+
+            filters = self._load()
+
+            with self._lock:
+                # committed after the load read the table, perhaps
+                for field, value in self._added:
+                    filters[field].add(value)
+                self._filters = filters
+                self._loaded_at = time.monotonic()
+                return filters
+        finally:
+            with self._lock:
+                self._added = None
+            self._loading.release()
+
+    def is_taken(self, field, value):
+        """Whether a user already has `value` as their `field`."""
+
+        if not value:
+            return False
+        if value not in self.filters()[field]:
+            metrics.inc('warbler_availability_checks_total', result='filtered')
+            return False
+
+        taken = db.session.scalar(
+            select(User.id).where(getattr(User, field) == value).limit(1)) is not None
+        metrics.inc('warbler_availability_checks_total',
+                    result='taken' if taken else 'false_positive')
+        return taken
+
+    def add(self, username=None, email=None):
+        """Record a committed username and/or email."""
+
+        with self._lock:
+            for field, value in (('username', username), ('email', email)):
+                if not value:
+                    continue
+                if self._added is not None:
+                    self._added.append((field, value))
+                if self._filters is not None:
+                    self._filters[field].add(value)
+
+    def learn(self, username=None, email=None):
+        """Record whichever of these the database has, skipping the filter.
+
+        For after an IntegrityError, when another worker took one of them.
+        """
+
+        taken = {field: value for field, value in (('username', username), ('email', email))
+                 if value and db.session.scalar(
+                     select(User.id).where(getattr(User, field) == value).limit(1))}
+        self.add(**taken)
+
+
+availability = Availability()
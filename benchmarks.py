@@ -0,0 +1,403 @@
+"""Micro-benchmarks for model methods and timeline query builders.
+
+Builds a synthetic dataset at one or more scales in a local database, times
+each operation, and prints one JSON object per benchmark per scale:
+
+    python benchmarks.py --scale small --scale medium > main.jsonl
+    git checkout my-branch
+    python benchmarks.py --scale small --scale medium > branch.jsonl
+    python benchmarks.py --compare main.jsonl branch.jsonl
+
+The database (--database, default $BENCH_DATABASE_URL or
+postgresql:///warbler-bench) is dropped and recreated for every scale.
+To compare the embedded SQLite mode against PostgreSQL under a concurrent
+mix of page views, likes and posts:
+
+    python benchmarks.py --threads 8 --database postgresql:///warbler-bench > pg.jsonl
+    python benchmarks.py --threads 8 --database sqlite:////tmp/bench.db > sqlite.jsonl
+    python benchmarks.py --compare pg.jsonl sqlite.jsonl
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from snowflake import MAX_SEQUENCE, SEQUENCE_BITS, WORKER_BITS, id_at
+
+SCALES = {
+    # users, follows per user, messages per user, likes per user
+    'small': dict(users=200, followers=20, messages=20, likes=10),
+    'medium': dict(users=2_000, followers=200, messages=50, likes=25),
+    'large': dict(users=10_000, followers=1_000, messages=100, likes=50),
+}
+
+BATCH = 5_000
+
+PASSWORD = "benchmark-password"
+
+# message timestamps are spread over this many minutes up to now, so the
+# newest fall inside TIMELINE_WINDOW_DAYS as live data would
+SPREAD_MINUTES = 500_000
+START = datetime.utcnow() - timedelta(minutes=SPREAD_MINUTES)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def insert_batched(table, rows):
+    from models import db
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            db.session.execute(insert(table), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(table), batch)
+
+
+def message_timestamp(user_id, m):
+    return START + timedelta(minutes=(user_id * 7919 + m * 104729) % SPREAD_MINUTES)
+
+
+def message_id(user_id, m, messages):
+    """The ID build_dataset() gives user `user_id`'s `m`th message.
+
+    It's the snowflake for the message's timestamp, like the app assigns,
+    so timeline windows and delta cursors treat it as they would real data;
+    the worker and sequence bits hold the message's index, keeping IDs
+    unique.
+    """
+
+    n = (user_id - 1) * messages + m
+    return id_at(message_timestamp(user_id, m), n >> SEQUENCE_BITS, n & MAX_SEQUENCE)
+
+
+def build_dataset(users, followers, messages, likes):
+    """Fill the database: every user follows the next `followers` users,
+    posts `messages` messages and likes `likes` of the next user's messages.
+    """
+
+    from models import db, bcrypt, Follows, Likes, Message, User
+
+    if users * messages > 1 << (WORKER_BITS + SEQUENCE_BITS):
+        raise ValueError("Too many messages for unique benchmark IDs.")
+
+    db.drop_all()
+    db.create_all()
+
+    # one hash for everyone; hashing per user would dominate setup time
+    password = bcrypt.generate_password_hash(PASSWORD).decode('UTF-8')
+
+    insert_batched(User.__table__, (
+        dict(id=u, username=f"user{u}", email=f"user{u}@example.com",
+             password=password, image_url=User.image_url.default.arg,
+             header_image_url=User.header_image_url.default.arg,
+             is_admin=False)
+        for u in range(1, users + 1)))
+
+    insert_batched(Message.__table__, (
+        dict(id=message_id(u, m, messages), user_id=u, text=f"message {m} by {u}",
+             timestamp=message_timestamp(u, m))
+        for u in range(1, users + 1) for m in range(messages)))
+
+    insert_batched(Follows.__table__, (
+        dict(user_following_id=u, user_being_followed_id=(u + k - 1) % users + 1)
+        for u in range(1, users + 1) for k in range(1, min(followers, users - 1) + 1)))
+
+    # each user likes the first `likes` messages of the next user
+    insert_batched(Likes.__table__, (
+        dict(user_id=u, message_id=message_id(u % users + 1, m, messages))
+        for u in range(1, users + 1) for m in range(min(likes, messages))))
+
+    db.session.commit()
+
+
+def measure(fn, repeat, setup=None, teardown=None):
+    """Run `fn` `repeat` times; return per-call timings in microseconds."""
+
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1e6)
+        if teardown:
+            teardown()
+    return timings
+
+
+def logged_in_client(app, user_id):
+    from app import CURR_USER_KEY
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session[CURR_USER_KEY] = user_id
+    return client
+
+
+def request(client, method, path, **kwargs):
+    response = client.open(path, method=method, **kwargs)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {path}: {response.status}")
+    response.close()
+
+
+def route_mix(user_id, other_id, msg_id):
+    """One round of the mixed workload: mostly page views, some writes."""
+
+    return [
+        ('GET', '/', {}),
+        ('GET', f'/users/{other_id}', {}),
+        ('GET', f'/messages/{msg_id}', {}),
+        ('POST', f'/users/toggle_like/{msg_id}', {}),
+        ('GET', '/', {}),
+        ('GET', '/users', {}),
+        ('POST', f'/users/toggle_like/{msg_id}', {}),
+        ('POST', '/messages/new', {'data': {'text': f"benchmark post by {user_id}"}}),
+    ]
+
+
+def benchmarks(scale):
+    """(name, fn, repeat, setup, teardown) for every benchmark."""
+
+    from flask import current_app
+
+    from models import db, User
+    import read_models
+
+    subject_id = 1
+    other_id = scale['users'] // 2
+    counter = iter(range(10**9))
+
+    def fresh_users():
+        """Expire the identity map so relationship loads aren't cached."""
+        db.session.expire_all()
+        return db.session.get(User, subject_id), db.session.get(User, other_id)
+
+    def signup():
+        n = next(counter)
+        User.signup(f"bench{n}", f"bench{n}@example.com", PASSWORD, None)
+        db.session.flush()
+
+    def is_following():
+        user, other = fresh_users()
+        user.is_following(other)
+
+    def is_followed_by():
+        user, other = fresh_users()
+        user.is_followed_by(other)
+
+    def homepage_query():
+        ids = list(read_models.following_ids(subject_id)) + [subject_id]
+        read_models.timeline_cards(ids)
+        read_models.liked_ids(subject_id)
+        read_models.user_profile(subject_id)
+
+    def users_show_query():
+        read_models.user_profile(subject_id)
+        read_models.timeline_cards([subject_id])
+
+    client = logged_in_client(current_app, subject_id)
+    # a message by the next user, which the subject follows
+    liked_id = message_id(subject_id % scale['users'] + 1, 0, scale['messages'])
+
+    def route(method, path, **kwargs):
+        return lambda: request(client, method, path, **kwargs)
+
+    return [
+        ('User.signup', signup, 5, None, db.session.rollback),
+        ('User.authenticate', lambda: User.authenticate("user1", PASSWORD), 5,
+         None, None),
+        ('User.is_following', is_following, 50, None, None),
+        ('User.is_followed_by', is_followed_by, 50, None, None),
+        ('homepage queries', homepage_query, 50, None, None),
+        ('users_show queries', users_show_query, 50, None, None),
+        ('GET /', route('GET', '/'), 20, None, None),
+        ('GET /users/<id>', route('GET', f'/users/{other_id}'), 20, None, None),
+        ('GET /messages/<id>', route('GET', f'/messages/{liked_id}'), 20,
+         None, None),
+        ('GET /users', route('GET', '/users'), 20, None, None),
+        ('POST toggle_like', route('POST', f'/users/toggle_like/{liked_id}'), 20,
+         None, None),
+        ('POST /messages/new',
+         route('POST', '/messages/new', data={'text': "benchmark post"}), 20,
+         None, None),
+    ]
+
+
+def mixed_routes(scale, threads, rounds):
+    """Latencies of route_mix() rounds run by `threads` users at once.
+
+    Returns (per-request timings in microseconds, requests per second).
+    """
+
+    from flask import current_app
+
+    app = current_app._get_current_object()
+    users = scale['users']
+    barrier = threading.Barrier(threads + 1)
+    timings = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(user_id):
+        client = logged_in_client(app, user_id)
+        mix = route_mix(user_id, user_id % users + 1,
+                        message_id(user_id % users + 1, 0, scale['messages']))
+        mine = []
+        barrier.wait()
+        try:
+            for _ in range(rounds):
+                for method, path, kwargs in mix:
+                    started = time.perf_counter()
+                    request(client, method, path, **kwargs)
+                    mine.append((time.perf_counter() - started) * 1e6)
+        except Exception as exc:
+            errors.append(exc)
+        with lock:
+            timings.extend(mine)
+
+    workers = [threading.Thread(target=worker, args=(t % users + 1,))
+               for t in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if errors:
+        raise errors[0]
+    return timings, len(timings) / elapsed
+
+
+def summarize(timings):
+    return dict(runs=len(timings),
+                min_us=round(min(timings), 1),
+                median_us=round(statistics.median(timings), 1),
+                mean_us=round(statistics.fmean(timings), 1),
+                stdev_us=round(statistics.stdev(timings), 1) if len(timings) > 1 else 0)
+
+
+def run(scale_name, scale, repeat_factor, threads=0):
+    from models import db
+
+    build_started = time.perf_counter()
+    build_dataset(**scale)
+    build_seconds = time.perf_counter() - build_started
+
+    meta = dict(scale=scale_name, **scale,
+                dialect=db.engine.dialect.name,
+                git=git_revision(),
+                python=platform.python_version(),
+                build_seconds=round(build_seconds, 2))
+
+    for name, fn, repeat, setup, teardown in benchmarks(scale):
+        fn()  # warm up caches and compiled statements
+        if teardown:
+            teardown()
+
+        timings = measure(fn, max(1, int(repeat * repeat_factor)), setup, teardown)
+        yield dict(meta, benchmark=name, **summarize(timings))
+
+    if threads:
+        db.session.commit()
+        timings, throughput = mixed_routes(scale, threads,
+                                           max(1, int(5 * repeat_factor)))
+        yield dict(meta, benchmark=f'mixed routes x{threads}', threads=threads,
+                   requests_per_s=round(throughput, 1), **summarize(timings))
+
+
+def compare(base_path, new_path):
+    """Print median timings of two result files side by side."""
+
+    def load(path):
+        with open(path) as f:
+            return {(r['scale'], r['benchmark']): r for r in map(json.loads, f)}
+
+    base, new = load(base_path), load(new_path)
+
+    print(f"{'scale':8} {'benchmark':22} {'base us':>12} {'new us':>12} {'change':>8}")
+    for key in sorted(base.keys() & new.keys()):
+        b, n = base[key]['median_us'], new[key]['median_us']
+        print(f"{key[0]:8} {key[1]:22} {b:12.1f} {n:12.1f} {(n - b) / b:+8.1%}")
+        if 'requests_per_s' in base[key] and 'requests_per_s' in new[key]:
+            b, n = base[key]['requests_per_s'], new[key]['requests_per_s']
+            print(f"{'':8} {'  requests/s':22} {b:12.1f} {n:12.1f} {(n - b) / b:+8.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', action='append', choices=sorted(SCALES),
+                        help="Dataset size to run at (repeatable).")
+    parser.add_argument('--users', type=int, help="Custom scale: number of users.")
+    parser.add_argument('--followers', type=int, help="Custom scale: follows per user.")
+    parser.add_argument('--messages', type=int, help="Custom scale: messages per user.")
+    parser.add_argument('--likes', type=int, help="Custom scale: likes per user.")
+    parser.add_argument('--repeat-factor', type=float, default=1.0,
+                        help="Multiply every benchmark's run count.")
+    parser.add_argument('--database',
+                        default=os.environ.get('BENCH_DATABASE_URL',
+                                               'postgresql:///warbler-bench'))
+    parser.add_argument('--threads', type=int, default=0,
+                        help="Also run the mixed route workload with this many "
+                             "concurrent users.")
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout,
+                        help="Write JSON lines here instead of stdout.")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+                        help="Compare two result files instead of running.")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scales = {name: SCALES[name] for name in args.scale or []}
+    if args.users:
+        scales['custom'] = dict(users=args.users,
+                                followers=args.followers or 0,
+                                messages=args.messages or 0,
+                                likes=args.likes or 0)
+    if not scales:
+        scales['small'] = SCALES['small']
+
+    os.environ['DATABASE_URL'] = args.database
+    # production refuses the default key; sessions here are throwaway
+    os.environ.setdefault('SECRET_KEY', os.urandom(16).hex())
+    # app.py builds its default app lazily, so this creates only ours
+    from app import create_app
+
+    app = create_app('production')
+    app.config['RATELIMIT_ENABLED'] = False
+    app.config['ADMISSION_ENABLED'] = False
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        for name, scale in scales.items():
+            for result in run(name, scale, args.repeat_factor, args.threads):
+                args.output.write(json.dumps(result) + "\n")
+                args.output.flush()
+
+
+if __name__ == '__main__':
+    main()
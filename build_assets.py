@@ -0,0 +1,103 @@
+"""Fingerprint and precompress everything under static/.
+
+Run before deploying:
+
+    python build_assets.py
+
+Each file is copied to static/dist/ with a content hash in its name
+(style.css -> style.3f2a9c1b0d.css), so it can be cached forever, and
+compressible files also get .gz and .br siblings. CSS url(/static/...)
+references are rewritten to the hashed names. static/dist/manifest.json
+maps original paths to hashed ones; see assets.py.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+
+# already-compressed formats gain nothing from gzip/brotli
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.txt', '.json', '.html'}
+
+CSS_URL = re.compile(r"""url\(\s*(['"]?)/static/([^'")]+)\1\s*\)""")
+
+
+def fingerprint(rel_path, content):
+    """`rel_path` with a short hash of `content` before the extension."""
+
+    base, ext = os.path.splitext(rel_path)
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    return f"{base}.{digest}{ext}"
+
+
+def write_variants(path, content):
+    """Write `content` to `path`, plus .gz/.br variants when worthwhile."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    if os.path.splitext(path)[1] not in COMPRESSIBLE:
+        return
+
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+
+def source_files():
+    """Paths under static/, relative to it, with CSS last."""
+
+    paths = []
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != DIST_DIR]
+        for name in files:
+            paths.append(os.path.relpath(os.path.join(root, name), STATIC_DIR))
+
+    # CSS refers to images, so hash those first
+    return sorted(paths, key=lambda p: (p.endswith('.css'), p))
+
+
+def build():
+    """Rebuild static/dist/ and return the manifest."""
+
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    manifest = {}
+
+    for rel_path in source_files():
+        with open(os.path.join(STATIC_DIR, rel_path), 'rb') as f:
+            content = f.read()
+
+        if rel_path.endswith('.css'):
+            content = CSS_URL.sub(
+                lambda m: f"url({m.group(1)}/static/dist/"
+                          f"{manifest.get(m.group(2), m.group(2))}{m.group(1)})",
+                content.decode('UTF-8')).encode('UTF-8')
+
+        hashed = fingerprint(rel_path, content)
+        write_variants(os.path.join(DIST_DIR, hashed), content)
+        manifest[rel_path.replace(os.sep, '/')] = hashed.replace(os.sep, '/')
+
+    with open(os.path.join(DIST_DIR, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+if __name__ == '__main__':
+    manifest = build()
+    print(f"Built {len(manifest)} assets into {DIST_DIR}"
+          + ("" if brotli else " (brotli not installed; gzip only)"))
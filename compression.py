@@ -0,0 +1,110 @@
+"""On-the-fly gzip compression of HTML and JSON responses.
+
+Buffered responses are compressed whole if they are at least
+COMPRESS_MIN_SIZE bytes; streamed responses are compressed chunk by chunk,
+flushing after each so clients still see data as it is produced. Responses
+that already have a Content-Encoding (e.g. precompressed assets) are left
+alone.
+
+Bytes in/out and CPU time spent compressing are recorded in metrics, per
+mimetype, to tune COMPRESS_LEVEL against bandwidth.
+"""
+
+import time
+import zlib
+
+from flask import request
+
+from metrics import metrics
+
+# wbits for a gzip (rather than raw zlib) stream
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _record(mimetype, size_in, size_out, cpu):
+    metrics.inc('warbler_compression_bytes_in_total', size_in, mimetype=mimetype)
+    metrics.inc('warbler_compression_bytes_out_total', size_out, mimetype=mimetype)
+    metrics.inc('warbler_compression_cpu_seconds_total', cpu, mimetype=mimetype)
+
+
+class Compressor:
+    """Flask extension that gzips eligible responses."""
+
+    def init_app(self, app):
+        """Install the compressor; call before other after_request hooks.
+
+        Flask runs after_request functions in reverse order, so registering
+        first means compressing last, after anything that edits the body.
+        """
+
+        self.app = app
+        app.after_request(self.compress)
+
+    def should_compress(self, response):
+        config = self.app.config
+
+        return (config['COMPRESS_ENABLED']
+                and 200 <= response.status_code < 300
+                and response.status_code != 204
+                and response.mimetype in config['COMPRESS_MIMETYPES']
+                and 'Content-Encoding' not in response.headers
+                and not response.direct_passthrough
+                and request.accept_encodings['gzip'])
+
+    def compress(self, response):
+        if not self.should_compress(response):
+            return response
+
+        level = self.app.config['COMPRESS_LEVEL']
+
+        if response.is_streamed:
+            response.response = self._compress_stream(
+                response.response, level, response.mimetype)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.app.config['COMPRESS_MIN_SIZE']:
+                return response
+
+            started = time.thread_time()
+            compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+            body = compressor.compress(data) + compressor.flush()
+            _record(response.mimetype, len(data), len(body),
+                    time.thread_time() - started)
+
+            response.set_data(body)
+
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _compress_stream(self, chunks, level, mimetype):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+        size_in = size_out = 0
+        cpu = 0.0
+
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('UTF-8')
+
+                started = time.thread_time()
+                out = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                cpu += time.thread_time() - started
+
+                size_in += len(chunk)
+                size_out += len(out)
+                yield out
+
+            started = time.thread_time()
+            out = compressor.flush()
+            cpu += time.thread_time() - started
+            size_out += len(out)
+            yield out
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            _record(mimetype, size_in, size_out, cpu)
+
+
+compressor = Compressor()
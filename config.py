@@ -0,0 +1,221 @@
+"""Configuration profiles for Warbler.
+
+Pick one with FLASK_ENV (development, production or testing); see
+app.create_app. DATABASE_URL, SECRET_KEY, PROFILER_TOKEN,
+RATELIMIT_STORAGE_URL and PROXY_COUNT in the environment override the
+values here.
+"""
+
+
+class Config:
+    """Settings shared by every profile."""
+
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///warbler'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = "it's a secret"
+
+    DEBUG = False
+    DEBUG_TOOLBAR = False
+
+    # Seconds between SSE keep-alive comments on idle /stream connections
+    STREAM_KEEPALIVE = 15
+
+    # Rows removed per statement when purging a deleted account
+    DELETION_BATCH_SIZE = 1000
+
+    # Timelines look this far back before falling back to the full history;
+    # older messages are moved to cold storage by `flask archive-messages`
+    TIMELINE_WINDOW_DAYS = 30
+    ARCHIVE_AFTER_DAYS = 365
+    ARCHIVE_BATCH_SIZE = 1000
+
+    # rows fetched per round trip by /users/<id>/export and `flask export-user`
+    EXPORT_BATCH_SIZE = 1000
+
+    # /api/messages/bulk and `flask ingest-messages`: rows per INSERT and
+    # commit, and the most one API request may post
+    INGEST_BATCH_SIZE = 500
+    INGEST_MAX_ROWS = 10_000
+
+    # Messages per page on /tags/<tag> and mentions timelines
+    TAG_PAGE_SIZE = 50
+
+    # Notifications per page on /notifications; unread counts shown in the
+    # navbar are cached per process for this many seconds
+    NOTIFICATIONS_PAGE_SIZE = 20
+    NOTIFICATIONS_COUNT_TTL = 30
+
+    # 'query' builds home timelines with one IN (...) query; 'cache' merges
+    # per-author rings of the newest TIMELINE_CACHE_SIZE message IDs
+    TIMELINE_READ_PATH = 'query'
+    TIMELINE_CACHE_SIZE = 100
+    TIMELINE_CACHE_TTL = 60
+    TIMELINE_CACHE_MAX_AUTHORS = 100_000
+
+    # /api/timeline/since returns at most TIMELINE_DELTA_LIMIT messages
+    # (more means "reload"); its cursors trail the clock by
+    # TIMELINE_DELTA_LAG seconds, and deletion tombstones are kept for
+    # TIMELINE_DELTA_RETENTION_DAYS (see `flask prune-deletions`)
+    TIMELINE_DELTA_LIMIT = 100
+    TIMELINE_DELTA_LAG = 5
+    TIMELINE_DELTA_RETENTION_DAYS = 7
+
+    # Login, signup and follow warm the user's homepage data in the
+    # background; at most PREWARM_MAX_PENDING warm-ups wait for the
+    # PREWARM_WORKERS threads, and results are kept PREWARM_TTL seconds
+    PREWARM_ENABLED = True
+    PREWARM_WORKERS = 1
+    PREWARM_MAX_PENDING = 16
+    PREWARM_TTL = 30
+
+    # Anonymous GETs of the homepage, profiles and messages are served from
+    # a shared page cache, purged by surrogate key on writes. Pages are kept
+    # in process memory unless PAGE_CACHE_STORAGE_URL is a redis:// URL.
+    # Set PAGE_CACHE_ENABLED to override the default (on unless TESTING).
+    PAGE_CACHE_TTL = 300
+    PAGE_CACHE_STORAGE_URL = None
+
+    # Databases to shard users, messages, likes and follows across by user
+    # ID (see sharding.py); empty keeps everything in DATABASE_URL. From the
+    # environment, a space-separated list.
+    SHARD_DATABASE_URLS = []
+    # Threads for the per-shard reads of every request in a process, so
+    # enough for the concurrent requests times the shards each reads
+    SHARD_READ_THREADS = 32
+
+    # Signup checks usernames and emails against in-memory counting Bloom
+    # filters (see availability.py) before querying; sized for at least
+    # AVAILABILITY_CAPACITY users at AVAILABILITY_ERROR_RATE false positives
+    # and rebuilt from the database every AVAILABILITY_REFRESH seconds
+    AVAILABILITY_CAPACITY = 100_000
+    AVAILABILITY_ERROR_RATE = 0.01
+    AVAILABILITY_REFRESH = 300
+
+    # Statements slower than SLOWLOG_THRESHOLD_MS (None disables) are
+    # appended to SLOWLOG_PATH (one file per process) as JSON lines with
+    # their plan; see slowlog.py. Each file rotates at SLOWLOG_MAX_BYTES,
+    # keeping SLOWLOG_BACKUPS old ones. Plans are taken on
+    # SLOWLOG_EXPLAIN_WORKERS threads, with at most
+    # SLOWLOG_EXPLAIN_MAX_PENDING waiting; the rest are logged without one.
+    SLOWLOG_THRESHOLD_MS = 250
+    SLOWLOG_PATH = 'logs/slow-queries.jsonl'
+    SLOWLOG_MAX_BYTES = 10_000_000
+    SLOWLOG_BACKUPS = 5
+    SLOWLOG_EXPLAIN = True
+    SLOWLOG_EXPLAIN_ANALYZE = False
+    SLOWLOG_EXPLAIN_EVERY = 60
+    SLOWLOG_EXPLAIN_WORKERS = 1
+    SLOWLOG_EXPLAIN_MAX_PENDING = 8
+
+    # Requests sent with this token (X-Profile header or ?_profile=) are
+    # profiled; None disables on-demand profiling. PROFILER_SAMPLE_RATES maps
+    # endpoints to the fraction of their requests profiled continuously.
+    PROFILER_TOKEN = None
+    PROFILER_SAMPLE_RATES = {}
+    PROFILER_INTERVAL = 0.005
+    PROFILER_DIR = 'profiles'
+
+    # Token buckets for bcrypt-heavy POSTs (login, signup, profile), as
+    # (tokens refilled per second, burst size). Buckets are kept in memory
+    # unless RATELIMIT_STORAGE_URL points at a shared redis:// store.
+    RATELIMIT_ENABLED = True
+    RATELIMIT_PER_IP = (0.5, 10)
+    RATELIMIT_PER_USERNAME = (0.1, 5)
+    RATELIMIT_STORAGE_URL = None
+
+    # Admission control (see admission.py): at most `limit` requests per
+    # group run at once in each process; more wait up to `queue_timeout`
+    # seconds for a slot, then get a 503 asking them to retry after
+    # ADMISSION_RETRY_AFTER seconds. Endpoints not in ADMISSION_GROUPS are
+    # 'writes' for POSTs and unlimited otherwise.
+    ADMISSION_ENABLED = True
+    ADMISSION_LIMITS = {
+        'timelines': (8, 0.5),
+        'auth': (4, 1.0),
+        'availability': (16, 0.25),
+        'writes': (8, 1.0),
+        'static': (32, 0.25),
+    }
+    ADMISSION_GROUPS = {
+        'warbler.homepage': 'timelines',
+        'warbler.timeline_since': 'timelines',
+        'warbler.users_show': 'timelines',
+        'warbler.show_likes': 'timelines',
+        'warbler.show_following': 'timelines',
+        'warbler.users_followers': 'timelines',
+        'warbler.tag_timeline': 'timelines',
+        'warbler.show_mentions': 'timelines',
+        'warbler.signup': 'auth',
+        'warbler.login': 'auth',
+        'warbler.profile': 'auth',
+        'warbler.check_availability': 'availability',
+        'static': 'static',
+        'asset': 'static',
+    }
+    ADMISSION_EXEMPT = ('warbler.timeline_stream', 'warbler.show_metrics')
+    ADMISSION_RETRY_AFTER = 2
+
+    # gzip HTML/JSON/CSV responses of at least COMPRESS_MIN_SIZE bytes
+    # (streamed responses are always compressed)
+    COMPRESS_ENABLED = True
+    COMPRESS_LEVEL = 6
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_MIMETYPES = ('text/html', 'application/json', 'application/x-ndjson',
+                          'text/csv')
+
+    # Applied to each new connection when DATABASE_URL is a sqlite:/// file
+    # (see sqlite_wal.py); SQLITE_WRITER_LOCK queues writers in-process
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'foreign_keys': 'ON',
+        'busy_timeout': 5000,
+        'cache_size': -64_000,      # KiB
+        'mmap_size': 256 * 2**20,
+        'temp_store': 'MEMORY',
+    }
+    SQLITE_WRITER_LOCK = True
+
+    # Client addresses allowed to scrape /metrics
+    METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+
+    # Reverse proxies in front of the app (nginx, a load balancer). Each
+    # appends to X-Forwarded-For, and that many entries are trusted to find
+    # the client address used for rate limits and METRICS_ALLOWED_IPS; with
+    # 0, the header is ignored and every client behind a proxy has its IP.
+    PROXY_COUNT = 0
+
+
+class DevelopmentConfig(Config):
+    """Local development: debugger and Flask DebugToolbar."""
+
+    DEBUG = True
+    DEBUG_TOOLBAR = True
+    # DEBUG_TB_INTERCEPT_REDIRECTS = True
+
+
+class ProductionConfig(Config):
+    """Pre-fork WSGI servers (gunicorn); no debug instrumentation."""
+
+    # never the well-known default; create_app refuses to start without one
+    SECRET_KEY = None
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
+
+
+class TestingConfig(Config):
+    """Unit tests."""
+
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///warbler-test'
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+
+profiles = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
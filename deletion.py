@@ -0,0 +1,181 @@
+"""Background, batched deletion of user accounts.
+
+Deleting a User through the ORM loads every message, like and follow into
+the session first. Instead, the account is marked deleted right away and
+its rows are removed here in bounded, set-based batches.
+
+A purge that fails is marked 'failed' with its error; `flask
+resume-deletions` finishes it, and any interrupted by a restart.
+"""
+
+import logging
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, select
+
+from models import db, AccountDeletion, Follows, Likes, Message, MessageDeletion, User
+from notifications import notifications
+from prewarm import prewarmer
+from sharding import shards
+from tasks import tasks
+from timeline_cache import timeline_cache
+
+logger = logging.getLogger(__name__)
+
+UNFINISHED = ('pending', 'running', 'failed')
+
+
+def schedule_user_deletion(user):
+    """Mark `user` deleted and queue the purge of their data."""
+
+    user.deleted_at = datetime.utcnow()
+    timeline_cache.invalidate(user.id)
+    prewarmer.discard(user.id)
+    progress = db.session.get(AccountDeletion, user.id)
+    if progress is None:
+        db.session.add(AccountDeletion(user_id=user.id, username=user.username))
+    db.session.commit()
+    if shards.enabled:
+        # hidden on their shard too, until the purge gets there
+        shards.save_user(user)
+
+    return tasks.submit(purge_user, user.id)
+
+
+def _delete_in_batches(make_stmt, batch_size, on_batch):
+    """Run `make_stmt(batch_size)` until it deletes nothing; return total."""
+
+    total = 0
+    while True:
+        deleted = db.session.execute(
+            make_stmt(batch_size),
+            execution_options={'synchronize_session': False}).rowcount
+        if not deleted:
+            return total
+        total += deleted
+        on_batch(deleted)
+        db.session.commit()
+
+
+def purge_user(user_id, batch_size=None):
+    """Delete a user's likes, follows and messages, then the user row.
+
+    Safe to re-run: each batch is committed, and a later run carries on
+    from wherever an earlier one stopped. If it fails, the deletion is
+    marked 'failed' with the error rather than left 'running'.
+    """
+
+    batch_size = batch_size or current_app.config['DELETION_BATCH_SIZE']
+    progress = db.session.get(AccountDeletion, user_id)
+    progress.status = 'running'
+    progress.error = None
+    db.session.commit()
+
+    try:
+        _purge(user_id, progress, batch_size)
+    except Exception as exc:
+        logger.exception("Purge of user %s failed", user_id)
+        db.session.rollback()
+        progress.status = 'failed'
+        progress.error = f"{type(exc).__name__}: {exc}"
+        db.session.commit()
+
+    return progress
+
+
+def resume_deletions():
+    """Purge every account whose deletion is unfinished; return how many.
+
+    Run this after a crash or deploy, when no purge is in progress.
+    """
+
+    user_ids = db.session.scalars(
+        select(AccountDeletion.user_id)
+        .where(AccountDeletion.status.in_(UNFINISHED))
+        .order_by(AccountDeletion.requested_at)).all()
+
+    for user_id in user_ids:
+        purge_user(user_id)
+    return len(user_ids)
+
+
+def _tombstone(user_id, message_ids):
+    db.session.add_all(MessageDeletion(message_id=msg_id, user_id=user_id)
+                       for msg_id in message_ids)
+
+
+def _purge(user_id, progress, batch_size):
+    if shards.enabled:
+        def tombstone(ids):
+            # committed before the shard deletes them, so none go unreported
+            _tombstone(user_id, ids)
+            db.session.commit()
+
+        def retract(kind):
+            # after the shard commits, so a resumed purge can't count a
+            # notification down twice
+            def on_batch(ids):
+                notifications.retract_all(kind, ids, user_id)
+                db.session.commit()
+            return on_batch
+
+        messages, likes, follows = shards.forget_user(
+            user_id, batch_size, tombstone,
+            on_likes=retract('like'), on_follows=retract('follow'))
+        progress.messages_deleted += messages
+        progress.likes_deleted += likes
+        progress.follows_deleted += follows
+        db.session.commit()
+
+    def count(field):
+        def on_batch(n):
+            setattr(progress, field, getattr(progress, field) + n)
+        return on_batch
+
+    # the notifications they caused are counted down with each batch
+    def delete_likes(n):
+        likes = db.session.execute(
+            select(Likes.id, Likes.message_id)
+            .where(Likes.user_id == user_id).limit(n)).all()
+        notifications.retract_all('like', [like.message_id for like in likes], user_id)
+        return delete(Likes).where(Likes.id.in_([like.id for like in likes]))
+
+    _delete_in_batches(delete_likes, batch_size, count('likes_deleted'))
+
+    def delete_following(n):
+        followed_ids = db.session.scalars(
+            select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == user_id).limit(n)).all()
+        notifications.retract_all('follow', followed_ids, user_id)
+        return delete(Follows).where(Follows.user_following_id == user_id,
+                                     Follows.user_being_followed_id.in_(followed_ids))
+
+    _delete_in_batches(delete_following, batch_size, count('follows_deleted'))
+
+    _delete_in_batches(
+        lambda n: delete(Follows).where(
+            Follows.user_being_followed_id == user_id,
+            Follows.user_following_id.in_(
+                select(Follows.user_following_id)
+                .where(Follows.user_being_followed_id == user_id)
+                .limit(n))),
+        batch_size, count('follows_deleted'))
+
+    def delete_messages(n):
+        # tombstones, so timeline deltas drop these messages too; committed
+        # with the batch they're for
+        ids = db.session.scalars(
+            select(Message.id).where(Message.user_id == user_id).limit(n)).all()
+        _tombstone(user_id, ids)
+        return delete(Message).where(Message.id.in_(ids))
+
+    # likes of these messages by other users go with them via ondelete='cascade'
+    _delete_in_batches(delete_messages, batch_size, count('messages_deleted'))
+
+    db.session.execute(delete(User).where(User.id == user_id),
+                       execution_options={'synchronize_session': False})
+
+    progress.status = 'done'
+    progress.finished_at = datetime.utcnow()
+    db.session.commit()
@@ -0,0 +1,202 @@
+"""Streaming export of one user's data, as NDJSON or CSV.
+
+Each section (profile, messages, archived messages, likes, following,
+followers) is read with a server-side cursor, batch_size rows at a time,
+and written out as it is read, so memory stays flat however many rows an
+account has. With sharding on, messages, likes and follows are read from
+the user's shard, and usernames from the main database.
+
+NDJSON puts every section in one stream, one object per line tagged with
+"type". Message IDs are snowflakes above 2**53, which JavaScript and
+other readers that parse numbers as doubles would round, so they are
+written as strings, as the homepage cursor is. CSV holds a single
+section with a header row.
+
+    flask export-user 42 --output user-42.ndjson
+    flask export-user 42 --format csv --section messages
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, ArchivedMessage, Follows, Likes, Message, User
+from sharding import shards
+
+
+def _profile(user_id):
+    return (select(User.id, User.username, User.email, User.bio, User.location,
+                   User.image_url, User.header_image_url)
+            .where(User.id == user_id))
+
+
+def _messages(user_id):
+    return (select(Message.id, Message.text, Message.timestamp)
+            .where(Message.user_id == user_id)
+            .order_by(Message.id))
+
+
+def _archived_messages(user_id):
+    return (select(ArchivedMessage.id, ArchivedMessage.payload,
+                   ArchivedMessage.timestamp)
+            .where(ArchivedMessage.user_id == user_id)
+            .order_by(ArchivedMessage.id))
+
+
+def _likes(user_id):
+    return (select(Likes.message_id)
+            .where(Likes.user_id == user_id)
+            .order_by(Likes.message_id))
+
+
+def _following(user_id):
+    return (select(User.id, User.username)
+            .join(Follows, Follows.user_being_followed_id == User.id)
+            .where(Follows.user_following_id == user_id)
+            .order_by(User.id))
+
+
+def _followers(user_id):
+    return (select(User.id, User.username)
+            .join(Follows, Follows.user_following_id == User.id)
+            .where(Follows.user_being_followed_id == user_id)
+            .order_by(User.id))
+
+
+def _following_ids(user_id):
+    return (select(Follows.user_being_followed_id.label('id'))
+            .where(Follows.user_following_id == user_id)
+            .order_by(Follows.user_being_followed_id))
+
+
+def _follower_ids(user_id):
+    return (select(Follows.user_following_id.label('id'))
+            .where(Follows.user_being_followed_id == user_id)
+            .order_by(Follows.user_following_id))
+
+
+def _add_usernames(rows):
+    """Rows of user IDs, with usernames from the main database."""
+
+    names = dict(db.session.execute(
+        select(User.id, User.username)
+        .where(User.id.in_([row['id'] for row in rows]))).all())
+    return [{'id': row['id'], 'username': names.get(row['id'])} for row in rows]
+
+
+def _archived_row(row):
+    return {'id': row.id,
+            'text': ArchivedMessage.decode(row.payload)['text'],
+            'timestamp': row.timestamp}
+
+
+# section -> (query builder, CSV columns, row -> dict)
+SECTIONS = {
+    'profile': (_profile, ('id', 'username', 'email', 'bio', 'location',
+                           'image_url', 'header_image_url'), None),
+    'messages': (_messages, ('id', 'text', 'timestamp'), None),
+    'archived_messages': (_archived_messages, ('id', 'text', 'timestamp'),
+                          _archived_row),
+    'likes': (_likes, ('message_id',), None),
+    'following': (_following, ('id', 'username'), None),
+    'followers': (_followers, ('id', 'username'), None),
+}
+
+# type of each NDJSON line, by section
+TYPES = {
+    'profile': 'profile',
+    'messages': 'message',
+    'archived_messages': 'message',
+    'likes': 'like',
+    'following': 'following',
+    'followers': 'follower',
+}
+
+# sections read from the user's shard when sharding is on -> (query
+# builder, batch -> batch); a shard has other users' IDs but not their rows
+SHARDED = {
+    'messages': (_messages, None),
+    'likes': (_likes, None),
+    'following': (_following_ids, _add_usernames),
+    'followers': (_follower_ids, _add_usernames),
+}
+
+# snowflake columns, written to NDJSON as strings, by section
+SNOWFLAKES = {
+    'messages': ('id',),
+    'archived_messages': ('id',),
+    'likes': ('message_id',),
+}
+
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _read(session, stmt, batch_size, convert=None, finish=None):
+    result = session.execute(stmt, execution_options={'yield_per': batch_size})
+
+    for partition in result.partitions():
+        rows = [convert(row) if convert else row._asdict() for row in partition]
+        yield finish(rows) if finish else rows
+
+
+def _batches(section, user_id, batch_size):
+    """Lists of row dicts for one section, read batch_size at a time."""
+
+    query, _, convert = SECTIONS[section]
+
+    if shards.enabled and section in SHARDED:
+        query, finish = SHARDED[section]
+        with shards.for_user(user_id) as session:
+            yield from _read(session, query(user_id), batch_size, finish=finish)
+    else:
+        yield from _read(db.session, query(user_id), batch_size, convert)
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def ndjson_chunks(user_id, batch_size=1000):
+    """Every section for `user_id`, as NDJSON text, one chunk per batch."""
+
+    for section, kind in TYPES.items():
+        snowflakes = SNOWFLAKES.get(section, ())
+        for rows in _batches(section, user_id, batch_size):
+            yield ''.join(
+                json.dumps(dict({'type': kind},
+                                **{key: str(value) if key in snowflakes
+                                   else _json_value(value)
+                                   for key, value in row.items()})) + "\n"
+                for row in rows)
+
+
+def csv_chunks(user_id, section, batch_size=1000):
+    """One section for `user_id`, as CSV text, one chunk per batch."""
+
+    columns = SECTIONS[section][1]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, columns, extrasaction='ignore')
+    writer.writeheader()
+
+    for rows in _batches(section, user_id, batch_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_chunks(user_id, format='ndjson', section=None, batch_size=1000):
+    """Text chunks of `user_id`'s export in `format` ('ndjson' or 'csv').
+
+    CSV needs a `section`; NDJSON exports them all.
+    """
+
+    if format == 'csv':
+        return csv_chunks(user_id, section or 'messages', batch_size)
+    return ndjson_chunks(user_id, batch_size)
@@ -0,0 +1,253 @@
+"""Offline follow-graph metrics, computed with NumPy.
+
+The follows table is streamed in batches into two int32 edge arrays over
+dense user indexes, then sorted into CSR (compressed sparse row)
+adjacency: `indptr[i]:indptr[i + 1]` slices the neighbours of user i out
+of `indices`. Every metric is a vectorized pass over those arrays, in
+chunks of at most `chunk_size` edges, so working memory is a few bytes per
+edge plus a few arrays per user. Results replace the user_stats table in
+one transaction. With SHARD_DATABASE_URLS set, follows are read from
+every shard and each user's stats are written to their own shard, where
+their profile reads them. Run it from cron:
+
+    flask graph-analytics
+"""
+
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import delete, func, insert, select, true
+
+from models import db, Follows, User, UserStats
+from sharding import shards
+
+
+class CSR(NamedTuple):
+    """Adjacency lists for `n` rows, with sorted neighbours per row."""
+
+    indptr: np.ndarray
+    indices: np.ndarray
+
+    @property
+    def n(self):
+        return len(self.indptr) - 1
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    @classmethod
+    def from_edges(cls, rows, cols, n):
+        """Build from parallel arrays of row and column indexes."""
+
+        keys = rows.astype(np.int64) * n + cols
+        keys.sort()
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // n, minlength=n), out=indptr[1:])
+        return cls(indptr, (keys % n).astype(np.int32))
+
+    def edge_rows(self, start, stop):
+        """Row index of each entry in indices[start:stop]."""
+
+        return np.searchsorted(self.indptr, np.arange(start, stop), side='right') - 1
+
+    def row_sums(self, values, chunk_size):
+        """For each row, the sum of `values` over its neighbours."""
+
+        out = np.zeros(self.n)
+        for start in range(0, len(self.indices), chunk_size):
+            stop = min(start + chunk_size, len(self.indices))
+            out += np.bincount(self.edge_rows(start, stop),
+                               weights=values[self.indices[start:stop]],
+                               minlength=self.n)
+        return out
+
+    def keys(self):
+        """Sorted int64 row * n + column key for every entry."""
+
+        rows = np.repeat(np.arange(self.n, dtype=np.int64), self.degrees())
+        return rows * self.n + self.indices
+
+
+class Graph(NamedTuple):
+    user_ids: np.ndarray
+    following: CSR
+    followers: CSR
+
+
+def follow_sources():
+    """(session, condition) for each database to read follows from.
+
+    A sharded follow is stored on the follower's shard and mirrored on the
+    followed user's; only the first copy is read.
+    """
+
+    if not shards.enabled:
+        yield db.session, true()
+        return
+
+    for shard in range(len(shards.engines)):
+        with shards.session(shard) as session:
+            yield session, Follows.user_following_id % len(shards.engines) == shard
+
+
+def load_graph(batch_size=100_000):
+    """Stream live users' follows into a Graph."""
+
+    user_ids = np.fromiter(
+        db.session.scalars(select(User.id)
+                           .where(User.deleted_at.is_(None))
+                           .order_by(User.id)),
+        dtype=np.int64)
+    n = len(user_ids)
+    if not n:
+        empty = CSR(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32))
+        return Graph(user_ids, empty, empty)
+
+    capacity = sum(session.scalar(select(func.count()).select_from(Follows)
+                                  .where(owned)) or 0
+                   for session, owned in follow_sources())
+    src = np.empty(capacity, dtype=np.int32)
+    dst = np.empty(capacity, dtype=np.int32)
+    size = 0
+
+    batches = (batch
+               for session, owned in follow_sources()
+               for batch in session.execute(
+                   select(Follows.user_following_id, Follows.user_being_followed_id)
+                   .where(owned),
+                   execution_options={'yield_per': batch_size}).partitions())
+
+    for batch in batches:
+        pairs = np.array(batch, dtype=np.int64).reshape(-1, 2)
+        a = np.searchsorted(user_ids, pairs[:, 0])
+        b = np.searchsorted(user_ids, pairs[:, 1])
+        # drop edges touching deleted users (or rows missing from user_ids)
+        live = ((a < n) & (b < n)
+                & (user_ids[np.minimum(a, n - 1)] == pairs[:, 0])
+                & (user_ids[np.minimum(b, n - 1)] == pairs[:, 1]))
+        a, b = a[live], b[live]
+
+        if size + len(a) > len(src):
+            # follows added since the count
+            capacity = max(size + len(a), 2 * len(src))
+            src = np.resize(src, capacity)
+            dst = np.resize(dst, capacity)
+        src[size:size + len(a)] = a
+        dst[size:size + len(b)] = b
+        size += len(a)
+
+    src, dst = src[:size], dst[:size]
+    following = CSR.from_edges(src, dst, n)
+    followers = CSR.from_edges(dst, src, n)
+
+    return Graph(user_ids, following, followers)
+
+
+def mutual_counts(graph, chunk_size):
+    """How many of each user's follows follow them back."""
+
+    following = graph.following
+    n = following.n
+    followed_by = graph.followers.keys()
+    counts = np.zeros(n, dtype=np.int64)
+
+    if not len(followed_by):
+        return counts
+
+    for start in range(0, len(following.indices), chunk_size):
+        stop = min(start + chunk_size, len(following.indices))
+        rows = following.edge_rows(start, stop)
+        # a follows b; mutual if (a, b) is also a followed-by entry
+        wanted = rows * n + following.indices[start:stop]
+        pos = np.minimum(np.searchsorted(followed_by, wanted), len(followed_by) - 1)
+        counts += np.bincount(rows[followed_by[pos] == wanted], minlength=n)
+
+    return counts
+
+
+def reach(graph, chunk_size):
+    """Followers plus followers' followers, counting overlaps."""
+
+    followers_count = graph.followers.degrees()
+    return followers_count + graph.followers.row_sums(
+        followers_count.astype(np.float64), chunk_size).astype(np.int64)
+
+
+def pagerank(graph, chunk_size, damping=0.85, tol=1e-6, max_iter=100):
+    """PageRank over follows: following someone passes rank to them."""
+
+    n = graph.following.n
+    if n == 0:
+        return np.zeros(0)
+
+    out_degree = graph.following.degrees()
+    dangling = out_degree == 0
+    rank = np.full(n, 1.0 / n)
+
+    for _ in range(max_iter):
+        share = np.where(dangling, 0.0, rank / np.maximum(out_degree, 1))
+        new = graph.followers.row_sums(share, chunk_size)
+        new = damping * (new + rank[dangling].sum() / n) + (1 - damping) / n
+        delta = np.abs(new - rank).sum()
+        rank = new
+        if delta < tol:
+            break
+
+    return rank
+
+
+def compute_stats(graph, chunk_size=1_000_000):
+    """Dict of per-user metric arrays, aligned with graph.user_ids."""
+
+    return {
+        'followers_count': graph.followers.degrees(),
+        'following_count': graph.following.degrees(),
+        'mutuals_count': mutual_counts(graph, chunk_size),
+        'reach': reach(graph, chunk_size),
+        'pagerank': pagerank(graph, chunk_size),
+    }
+
+
+def write_stats(user_ids, stats, batch_size=10_000, session=None):
+    """Replace user_stats with `stats`, in bulk, in one transaction."""
+
+    session = session or db.session
+    computed_at = datetime.utcnow()
+    session.execute(delete(UserStats))
+
+    columns = list(stats)
+    for start in range(0, len(user_ids), batch_size):
+        stop = start + batch_size
+        chunk = {name: stats[name][start:stop].tolist() for name in columns}
+        session.execute(insert(UserStats), [
+            dict({name: chunk[name][i] for name in columns},
+                 user_id=user_id, computed_at=computed_at)
+            for i, user_id in enumerate(user_ids[start:stop].tolist())])
+
+    session.commit()
+
+
+def store_stats(user_ids, stats, batch_size=10_000):
+    """write_stats() to the main database, or each user's rows to their
+    shard."""
+
+    if not shards.enabled:
+        write_stats(user_ids, stats, batch_size)
+        return
+
+    owners = user_ids % len(shards.engines)
+    for shard in range(len(shards.engines)):
+        mine = owners == shard
+        with shards.session(shard) as session:
+            write_stats(user_ids[mine],
+                        {name: values[mine] for name, values in stats.items()},
+                        batch_size, session=session)
+
+
+def run(batch_size=100_000, chunk_size=1_000_000):
+    """Load the graph, compute metrics and store them; return user count."""
+
+    graph = load_graph(batch_size)
+    store_stats(graph.user_ids, compute_stats(graph, chunk_size))
+    return len(graph.user_ids)
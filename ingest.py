@@ -0,0 +1,120 @@
+"""Bulk message ingestion from NDJSON.
+
+Each line is a JSON object with the message "text". Lines are validated
+with MessageForm, one at a time, and valid ones are inserted batch_size at
+a time in multi-row INSERTs, tagged and committed. Bad lines are reported
+by line number and skipped, so one typo doesn't sink a whole import.
+
+    flask ingest-messages alice messages.ndjson
+"""
+
+import json
+from typing import NamedTuple
+
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+
+from forms import MessageForm
+from models import db, Message
+from sharding import shards
+from snowflake import next_id
+from tagging import index_messages
+
+
+class IngestedMessage(NamedTuple):
+    id: int
+    user_id: int
+    text: str
+
+
+class IngestResult(NamedTuple):
+    ids: list
+    errors: list
+
+
+def parse_line(line):
+    """The message text on one NDJSON line; raises ValueError if invalid."""
+
+    try:
+        row = json.loads(line)
+    except ValueError:
+        raise ValueError("Not valid JSON.")
+
+    if not isinstance(row, dict):
+        raise ValueError("Expected a JSON object.")
+
+    text = row.get('text')
+    if not isinstance(text, str):
+        raise ValueError("text: This field is required.")
+
+    form = MessageForm(formdata=MultiDict({'text': text}), meta={'csrf': False})
+    if not form.validate():
+        raise ValueError('; '.join(f"{name}: {error}"
+                                   for name, errors in form.errors.items()
+                                   for error in errors))
+
+    return text
+
+
+def insert_batch(batch):
+    """Insert and index IngestedMessages in one transaction.
+
+    With sharding on they go to their author's shard and, as for single
+    posts, aren't indexed: tags and mentions cover the main database only.
+    """
+
+    rows = [msg._asdict() for msg in batch]
+    if shards.enabled:
+        shards.insert_messages(batch[0].user_id, rows)
+        return
+
+    db.session.execute(insert(Message), rows)
+    index_messages(batch)
+    db.session.commit()
+
+
+def ingest(user_id, lines, batch_size=500, max_rows=None, on_commit=None):
+    """Post each NDJSON line in `lines` as a message by `user_id`.
+
+    Blank lines are skipped. `on_commit(batch)` is called after each batch
+    of IngestedMessages is committed. Returns an IngestResult of the new
+    message IDs and (line number, error) pairs.
+    """
+
+    ids, errors = [], []
+    batch = []
+    rows = 0
+
+    def flush():
+        insert_batch(batch)
+        ids.extend(msg.id for msg in batch)
+        if on_commit:
+            on_commit(list(batch))
+        batch.clear()
+
+    for line_no, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('UTF-8', errors='replace')
+        if not line.strip():
+            continue
+
+        rows += 1
+        if max_rows is not None and rows > max_rows:
+            errors.append((line_no, f"Over the limit of {max_rows} messages; "
+                                    "this and later lines were skipped."))
+            break
+
+        try:
+            text = parse_line(line)
+        except ValueError as exc:
+            errors.append((line_no, str(exc)))
+            continue
+
+        batch.append(IngestedMessage(next_id(), user_id, text))
+        if len(batch) == batch_size:
+            flush()
+
+    if batch:
+        flush()
+
+    return IngestResult(ids, errors)
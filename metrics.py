@@ -0,0 +1,60 @@
+"""Process-local counters, gauges and summaries in Prometheus text format."""
+
+import threading
+from collections import defaultdict
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _format(name, labels, value):
+    if labels:
+        inner = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{inner}}} {value}"
+    return f"{name} {value}"
+
+
+class Metrics:
+    """A tiny metrics registry, scraped from /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        """Add `value` to the counter `name`."""
+
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def observe(self, name, value, **labels):
+        """Record one observation of `name` as a `_sum`/`_count` pair."""
+
+        with self._lock:
+            self._counters[_key(name + '_sum', labels)] += value
+            self._counters[_key(name + '_count', labels)] += 1
+
+    def set(self, name, value, **labels):
+        """Set the gauge `name` to `value`."""
+
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def get(self, name, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            return self._gauges.get(key, self._counters.get(key, 0))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+
+        with self._lock:
+            items = list(self._counters.items()) + list(self._gauges.items())
+
+        return "".join(_format(name, labels, value) + "\n"
+                       for (name, labels), value in sorted(items))
+
+
+metrics = Metrics()
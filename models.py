@@ -1,12 +1,40 @@
 """SQLAlchemy models for Warbler."""
 
+import json
+import os
+import weakref
+import zlib
 from datetime import datetime
 
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+import sqlite_wal
+from snowflake import next_id
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
+sqlite_wal.install_session_events(db.session)
+
+
+class utcnow(FunctionElement):
+    """The database's current time, as naive UTC."""
+
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
 
 
 class Follows(db.Model):
@@ -31,6 +59,9 @@ class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -43,9 +74,9 @@ class Likes(db.Model):
     )
 
     message_id = db.Column(
-        db.Integer,
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        index=True
     )
 
 
@@ -94,7 +125,18 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', lazy='subquery')
+    is_admin = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+    )
+
+    # set when the user deletes their account; rows are purged in the background
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    messages = db.relationship('Message')
 
     followers = db.relationship(
         "User",
@@ -123,14 +165,12 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return any(user.id == other_user.id for user in self.followers)
 
     def is_following(self, other_user):
         """Is this user following `other_user`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return any(user.id == other_user.id for user in self.following)
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -162,7 +202,7 @@ class User(db.Model):
         If can't find matching user (or if password is wrong), returns False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
             is_auth = bcrypt.check_password_hash(user.password, password)
@@ -176,10 +216,17 @@ class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_messages_user_id_id', 'user_id', 'id'),
+    )
+    __mapper_args__ = {'eager_defaults': True}
 
+    # a snowflake (see snowflake.py): newer messages have larger IDs
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        default=next_id,
     )
 
     text = db.Column(
@@ -190,7 +237,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        server_default=utcnow(),
     )
 
     user_id = db.Column(
@@ -204,6 +251,277 @@ class Message(db.Model):
                            )
 
 
+class ArchivedMessage(db.Model):
+    """A message moved out of `messages` into compressed cold storage.
+
+    Keeps the original message ID so /messages/<id> still resolves it.
+    """
+
+    __tablename__ = 'archived_messages'
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True,
+    )
+
+    # zlib-compressed JSON: {"text": ..., "liked_by": [user ids]}
+    payload = db.Column(
+        db.LargeBinary,
+        nullable=False,
+    )
+
+    user = db.relationship('User')
+
+    @classmethod
+    def from_message(cls, msg, liked_by):
+        """Build the archived copy of `msg`."""
+
+        data = json.dumps({"text": msg.text, "liked_by": liked_by})
+        return cls(id=msg.id,
+                   timestamp=msg.timestamp,
+                   user_id=msg.user_id,
+                   payload=zlib.compress(data.encode('UTF-8'), 9))
+
+    @staticmethod
+    def decode(payload):
+        return json.loads(zlib.decompress(payload).decode('UTF-8'))
+
+    @property
+    def data(self):
+        return self.decode(self.payload)
+
+    @property
+    def text(self):
+        return self.data["text"]
+
+
+class MessageDeletion(db.Model):
+    """A tombstone for a deleted message, so timeline deltas can report it.
+
+    The ID is a snowflake taken at deletion time, so "deleted since cursor
+    X" is a range scan on (user_id, id), like new messages are.
+    """
+
+    __tablename__ = 'message_deletions'
+    __table_args__ = (
+        db.Index('ix_message_deletions_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+        autoincrement=False,
+        default=next_id,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+    # the message's author; not a foreign key, since it outlives the user
+    user_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class Tag(db.Model):
+    """A #hashtag, stored lowercased."""
+
+    __tablename__ = 'tags'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+        unique=True,
+    )
+
+
+class MessageTag(db.Model):
+    """A message containing a #hashtag.
+
+    The (tag_id, message_id) key doubles as the index for tag timelines.
+    """
+
+    __tablename__ = 'message_tags'
+
+    tag_id = db.Column(
+        db.Integer,
+        db.ForeignKey('tags.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+class Mention(db.Model):
+    """A message that @mentions a user."""
+
+    __tablename__ = 'mentions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+
+class Notification(db.Model):
+    """Likes of a user's message, or follows of the user, coalesced.
+
+    One row per (user_id, kind, target_id): for 'like' the target is the
+    message, for 'follow' it is the user themselves. actor_count is how many
+    people are behind it and last_actor_id the most recent of them.
+    """
+
+    __tablename__ = 'notifications'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'kind', 'target_id'),
+        db.Index('ix_notifications_user_id_updated_at', 'user_id', 'updated_at', 'id'),
+    )
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    target_id = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+    actor_count = db.Column(db.Integer, nullable=False, default=1)
+
+    last_actor_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='set null'),
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    is_read = db.Column(db.Boolean, nullable=False, default=False)
+
+
+class UserStats(db.Model):
+    """Follow-graph metrics for a user, written by `flask graph-analytics`.
+
+    reach is an upper bound on the two-hop audience: followers plus their
+    followers, without removing overlaps.
+    """
+
+    __tablename__ = 'user_stats'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    followers_count = db.Column(db.Integer, nullable=False)
+    following_count = db.Column(db.Integer, nullable=False)
+    mutuals_count = db.Column(db.Integer, nullable=False)
+    reach = db.Column(db.BigInteger, nullable=False)
+
+    pagerank = db.Column(
+        db.Float,
+        nullable=False,
+        index=True,
+    )
+
+    computed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class AccountDeletion(db.Model):
+    """Progress of a background account purge.
+
+    Not a foreign key to users, since it outlives the user row.
+    """
+
+    __tablename__ = 'account_deletions'
+
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    username = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='pending',
+    )
+
+    likes_deleted = db.Column(db.Integer, nullable=False, default=0)
+    follows_deleted = db.Column(db.Integer, nullable=False, default=0)
+    messages_deleted = db.Column(db.Integer, nullable=False, default=0)
+
+    requested_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    # why the last attempt failed, if it did
+    error = db.Column(
+        db.Text,
+    )
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -212,3 +530,19 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    sqlite_wal.configure(app, db)
+
+    # Pre-fork servers (gunicorn) create the app, then fork workers. Drop the
+    # parent's pooled connections in each child so no two processes ever
+    # share a socket; close=False leaves the parent's connections alone.
+    app_ref = weakref.ref(app)
+
+    def dispose_engines_in_child():
+        app = app_ref()
+        if app is not None:
+            with app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=dispose_engines_in_child)
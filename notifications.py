@@ -0,0 +1,227 @@
+"""Notifications of likes and follows, coalesced per target.
+
+toggle_like and the follow views write here in the same transaction as
+the like or follow itself. Repeat events on one target update a single
+row ("alice and 3 others liked your warble") instead of adding new ones,
+and retractions (unlike, unfollow) count it back down.
+
+Unread counts are shown on every page, so they are cached per process for
+NOTIFICATIONS_COUNT_TTL seconds. Writes handled by this process drop the
+cached count; the TTL bounds staleness from writes elsewhere.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import read_models
+from models import db, Notification
+from sharding import shards
+
+
+class UnreadCounts:
+    """Per-user unread counts with a TTL, in a plain dict."""
+
+    def __init__(self, max_users=100_000):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def get(self, user_id, ttl):
+        with self._lock:
+            entry = self._counts.get(user_id)
+        if entry is None or time.monotonic() - entry[0] > ttl:
+            return None
+        return entry[1]
+
+    def set(self, user_id, count):
+        with self._lock:
+            if len(self._counts) >= self.max_users:
+                self._counts.clear()
+            self._counts[user_id] = (time.monotonic(), count)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._counts.pop(user_id, None)
+
+
+class Notifications:
+    """Flask extension for writing and counting notifications."""
+
+    def __init__(self):
+        self.counts = UnreadCounts()
+
+    def init_app(self, app):
+        app.add_template_global(self.unread_count, 'unread_notifications')
+
+    def notify(self, user_id, kind, target_id, actor_id):
+        """Record that `actor_id` did `kind` to `target_id`, owned by `user_id`.
+
+        Doesn't commit.
+        """
+
+        if user_id == actor_id:
+            return
+
+        now = datetime.utcnow()
+        where = (Notification.user_id == user_id,
+                 Notification.kind == kind,
+                 Notification.target_id == target_id)
+        bump = (update(Notification)
+                .where(*where)
+                .values(actor_count=Notification.actor_count + 1,
+                        last_actor_id=actor_id, updated_at=now, is_read=False)
+                .execution_options(synchronize_session=False))
+
+        if not db.session.execute(bump).rowcount:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(Notification).values(
+                        user_id=user_id, kind=kind, target_id=target_id,
+                        actor_count=1, last_actor_id=actor_id,
+                        updated_at=now, is_read=False))
+            except IntegrityError:
+                # a concurrent request created the row first
+                db.session.execute(bump)
+
+        self.counts.delete(user_id)
+
+    def retract(self, user_id, kind, target_id, actor_id):
+        """Undo `actor_id`'s notify(); the row goes once nobody is left
+        behind it, and names another actor if it named this one.
+
+        Call after the like or follow is removed. Doesn't commit.
+        """
+
+        if user_id == actor_id:
+            return      # notify() skipped it too
+
+        where = (Notification.user_id == user_id,
+                 Notification.kind == kind,
+                 Notification.target_id == target_id)
+        db.session.execute(
+            update(Notification).where(*where)
+            .values(actor_count=Notification.actor_count - 1)
+            .execution_options(synchronize_session=False))
+        db.session.execute(
+            delete(Notification).where(*where, Notification.actor_count <= 0)
+            .execution_options(synchronize_session=False))
+
+        shown = db.session.scalar(select(Notification.last_actor_id).where(*where))
+        if shown == actor_id:
+            db.session.execute(
+                update(Notification).where(*where)
+                .values(last_actor_id=self._other_actor(kind, target_id, actor_id))
+                .execution_options(synchronize_session=False))
+
+        self.counts.delete(user_id)
+
+    def retract_all(self, kind, target_ids, actor_id):
+        """retract() for each of `target_ids`, in a few statements; for
+        purging an account's likes or follows in batches.
+
+        A target ID names its owner too (a message's author, or the user
+        followed), so the owners aren't needed. Doesn't commit.
+        """
+
+        if not target_ids:
+            return
+
+        where = (Notification.kind == kind,
+                 Notification.target_id.in_(target_ids),
+                 Notification.user_id != actor_id)
+        owners = set(db.session.scalars(select(Notification.user_id).where(*where)))
+
+        db.session.execute(
+            update(Notification).where(*where)
+            .values(actor_count=Notification.actor_count - 1)
+            .execution_options(synchronize_session=False))
+        db.session.execute(
+            delete(Notification).where(*where, Notification.actor_count <= 0)
+            .execution_options(synchronize_session=False))
+
+        shown = db.session.execute(
+            select(Notification.id, Notification.target_id)
+            .where(*where, Notification.last_actor_id == actor_id)).all()
+        for notification_id, target_id in shown:
+            db.session.execute(
+                update(Notification).where(Notification.id == notification_id)
+                .values(last_actor_id=self._other_actor(kind, target_id, actor_id))
+                .execution_options(synchronize_session=False))
+
+        for user_id in owners:
+            self.counts.delete(user_id)
+
+    def _other_actor(self, kind, target_id, actor_id):
+        """An actor still behind `target_id`'s notification, or None."""
+
+        store = shards if shards.enabled else read_models
+        if kind == 'like':
+            others = [user_id for user_id in store.liker_ids(target_id, limit=2)
+                      if user_id != actor_id]
+            return others[0] if others else None
+
+        # follows aren't timestamped, so any remaining follower will do
+        return max(store.follower_ids(target_id) - {actor_id}, default=None)
+
+    def forget_message(self, msg):
+        """Drop like notifications for a deleted message. Doesn't commit."""
+
+        db.session.execute(
+            delete(Notification)
+            .where(Notification.user_id == msg.user_id,
+                   Notification.kind == 'like',
+                   Notification.target_id == msg.id)
+            .execution_options(synchronize_session=False))
+
+        self.counts.delete(msg.user_id)
+
+    def mark_read(self, user_id):
+        """Mark all of `user_id`'s notifications read. Doesn't commit."""
+
+        db.session.execute(
+            update(Notification)
+            .where(Notification.user_id == user_id, Notification.is_read.is_(False))
+            .values(is_read=True)
+            .execution_options(synchronize_session=False))
+
+        self.counts.set(user_id, 0)
+
+    def unread_count(self, user_id):
+        """How many of `user_id`'s notifications are unread (maybe cached)."""
+
+        ttl = current_app.config['NOTIFICATIONS_COUNT_TTL']
+        count = self.counts.get(user_id, ttl)
+
+        if count is None:
+            count = db.session.scalar(
+                select(func.count())
+                .select_from(Notification)
+                .where(Notification.user_id == user_id,
+                       Notification.is_read.is_(False)))
+            self.counts.set(user_id, count)
+
+        return count
+
+
+def parse_cursor(value):
+    """The (updated_at, id) pair in a 'before' cursor, or None if invalid."""
+
+    try:
+        updated_at, notification_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(updated_at), int(notification_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def cursor(card):
+    """The 'before' cursor for the page after `card`."""
+
+    return f"{card.updated_at.isoformat()}_{card.id}"
+
+
+notifications = Notifications()
@@ -0,0 +1,180 @@
+"""Shared whole-page cache for anonymous GETs, purged by surrogate key.
+
+Views decorated with @page_cache.cached serve anonymous visitors a stored
+copy of their HTML. While rendering, a view tags its page with the
+surrogate keys it depends on ('user:<id>', 'message:<id>'), and writes
+call page_cache.purge() with the keys they affect, so a page is dropped
+exactly when something on it changes; PAGE_CACHE_TTL is only a backstop.
+The keys are also sent in a Surrogate-Key header for CDNs that purge the
+same way.
+
+Pages live in process memory by default, so purges only reach the
+worker that handled the write. Set PAGE_CACHE_STORAGE_URL to a redis://
+URL to share pages (and purges) between workers and hosts.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, g, make_response, request, session
+
+from metrics import metrics
+
+
+class MemoryBackend:
+    """Pages in an LRU-ordered dict, with a surrogate key index."""
+
+    def __init__(self, max_pages=10_000):
+        self.max_pages = max_pages
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._keys = {}
+
+    def get(self, path):
+        """The (status, mimetype, body, keys) stored for `path`, or None."""
+
+        with self._lock:
+            entry = self._pages.get(path)
+            if entry is None:
+                return None
+            expires, page, _ = entry
+            if time.monotonic() > expires:
+                self._drop(path)
+                return None
+            self._pages.move_to_end(path)
+            return page
+
+    def set(self, path, page, keys, ttl):
+        with self._lock:
+            self._drop(path)
+            self._pages[path] = (time.monotonic() + ttl, page, keys)
+            for key in keys:
+                self._keys.setdefault(key, set()).add(path)
+            while len(self._pages) > self.max_pages:
+                self._drop(next(iter(self._pages)))
+
+    def purge(self, keys):
+        with self._lock:
+            for key in keys:
+                for path in self._keys.pop(key, ()):
+                    self._drop(path)
+
+    def _drop(self, path):
+        entry = self._pages.pop(path, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            paths = self._keys.get(key)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self._keys[key]
+
+
+class RedisBackend:
+    """Pages in Redis, shared by every worker. Needs the `redis` package."""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, path):
+        status, mimetype, body, keys = self.client.hmget(
+            f"pagecache:page:{path}", 'status', 'mimetype', 'body', 'keys')
+        if body is None:
+            return None
+        return int(status), mimetype.decode(), body, keys.decode()
+
+    def set(self, path, page, keys, ttl):
+        status, mimetype, body, surrogate = page
+        pipe = self.client.pipeline()
+        pipe.hset(f"pagecache:page:{path}",
+                  mapping={'status': status, 'mimetype': mimetype, 'body': body,
+                           'keys': surrogate})
+        pipe.expire(f"pagecache:page:{path}", ttl)
+        for key in keys:
+            pipe.sadd(f"pagecache:key:{key}", path)
+            pipe.expire(f"pagecache:key:{key}", ttl)
+        pipe.execute()
+
+    def purge(self, keys):
+        for key in keys:
+            paths = self.client.smembers(f"pagecache:key:{key}")
+            pipe = self.client.pipeline()
+            for path in paths:
+                pipe.delete(f"pagecache:page:{path.decode()}")
+            pipe.delete(f"pagecache:key:{key}")
+            pipe.execute()
+
+
+class PageCache:
+    """Flask extension holding the page backend."""
+
+    def init_app(self, app):
+        url = app.config['PAGE_CACHE_STORAGE_URL']
+        self.backend = RedisBackend(url) if url else MemoryBackend()
+
+    def cacheable(self):
+        """Whether this request may be answered from, or stored in, the cache."""
+
+        return (current_app.config.get('PAGE_CACHE_ENABLED', not current_app.testing)
+                and request.method == 'GET'
+                and not g.user
+                # the page would render (and consume) flashed messages
+                and '_flashes' not in session)
+
+    def tag(self, *keys):
+        """Mark the page being rendered as depending on `keys`."""
+
+        g.setdefault('surrogate_keys', set()).update(keys)
+
+    def purge(self, *keys):
+        """Drop every cached page tagged with any of `keys`."""
+
+        self.backend.purge(keys)
+
+    def cached(self, view):
+        """Decorator: cache the view's anonymous 200 responses."""
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.cacheable():
+                return view(*args, **kwargs)
+
+            path = request.full_path
+            page = self.backend.get(path)
+
+            if page is not None:
+                metrics.inc('warbler_page_cache_requests_total', result='hit')
+                status, mimetype, body, surrogate = page
+                response = Response(body, status=status, mimetype=mimetype,
+                                    headers={'X-Cache': 'HIT'})
+                if surrogate:
+                    response.headers['Surrogate-Key'] = surrogate
+                return response
+
+            metrics.inc('warbler_page_cache_requests_total', result='miss')
+            response = make_response(view(*args, **kwargs))
+            keys = g.pop('surrogate_keys', set())
+            surrogate = ' '.join(sorted(keys))
+
+            if (response.status_code == 200
+                    and not response.is_streamed
+                    and not session.modified):
+                self.backend.set(path,
+                                 (response.status_code, response.mimetype,
+                                  response.get_data(), surrogate),
+                                 keys, current_app.config['PAGE_CACHE_TTL'])
+
+            response.headers['X-Cache'] = 'MISS'
+            if surrogate:
+                response.headers['Surrogate-Key'] = surrogate
+            return response
+
+        return wrapper
+
+
+page_cache = PageCache()
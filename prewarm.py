@@ -0,0 +1,134 @@
+"""Background warm-up of a user's homepage after login, signup or follow.
+
+Those views redirect to pages whose first render would otherwise run the
+timeline, liked-set and profile queries cold. Instead they call
+prewarmer.warm(user_id), which loads that data on a small dedicated pool
+while the redirect is in flight, and homepage() takes it if it is ready.
+
+Warm-ups are best effort: at most PREWARM_MAX_PENDING are queued and the
+rest are dropped, so they never pile up behind or compete with foreground
+requests. A warmed page is used once, within PREWARM_TTL seconds, and
+discard() drops it (and any warm-up in progress) when the user's data
+changes in between, or someone they follow posts or deletes a message.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Prewarmer:
+    """Flask extension holding warmed homepage data, one entry per user."""
+
+    def __init__(self):
+        self.app = None
+        self.load = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        # bumped by discard(), for users with a warm-up in flight only
+        self._versions = {}
+        self._pages = {}
+
+    def init_app(self, app):
+        self.app = app
+        self._slots = threading.BoundedSemaphore(app.config['PREWARM_MAX_PENDING'])
+
+    def loader(self, fn):
+        """Register `fn(user_id)`, which returns the homepage's template context."""
+
+        self.load = fn
+        return fn
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.app.config['PREWARM_WORKERS'],
+                thread_name_prefix='warbler-prewarm')
+        return self._executor
+
+    def warm(self, user_id):
+        """Queue a warm-up of `user_id`'s homepage; return a Future or None.
+
+        Returns None if warming is disabled, one is already queued for
+        this user, or the queue is full.
+        """
+
+        app = self.app
+        if not app.config['PREWARM_ENABLED']:
+            return None
+
+        with self._lock:
+            if user_id in self._pending:
+                return None
+            if not self._slots.acquire(blocking=False):
+                metrics.inc('warbler_prewarm_dropped_total')
+                return None
+            self._pending.add(user_id)
+            version = self._versions.get(user_id, 0)
+
+        def run():
+            try:
+                with app.app_context():
+                    page = self.load(user_id)
+                self._store(user_id, version, page)
+                return page
+            except Exception:
+                logger.exception("Prewarming user %s failed", user_id)
+                raise
+            finally:
+                with self._lock:
+                    self._pending.discard(user_id)
+                    self._versions.pop(user_id, None)
+                self._slots.release()
+
+        if app.config.get('TASKS_EAGER', app.testing):
+            future = Future()
+            future.set_result(run())
+            return future
+
+        return self.executor.submit(run)
+
+    def _store(self, user_id, version, page):
+        expires = time.monotonic() + self.app.config['PREWARM_TTL']
+
+        with self._lock:
+            # the user's data changed while we were loading it
+            if self._versions.get(user_id, 0) != version:
+                return
+            if len(self._pages) >= 10 * self.app.config['PREWARM_MAX_PENDING']:
+                now = time.monotonic()
+                self._pages = {uid: entry for uid, entry in self._pages.items()
+                               if entry[0] > now}
+            self._pages[user_id] = (expires, page)
+
+    def take(self, user_id):
+        """The warmed page for `user_id` if there is a fresh one, else None."""
+
+        with self._lock:
+            entry = self._pages.pop(user_id, None)
+
+        if entry is None or entry[0] < time.monotonic():
+            metrics.inc('warbler_prewarm_misses_total')
+            return None
+
+        metrics.inc('warbler_prewarm_hits_total')
+        return entry[1]
+
+    def discard(self, *user_ids):
+        """Forget warmed pages for `user_ids`, including ones being loaded."""
+
+        with self._lock:
+            for user_id in user_ids:
+                self._pages.pop(user_id, None)
+                if user_id in self._pending:
+                    self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+
+prewarmer = Prewarmer()
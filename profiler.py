@@ -0,0 +1,203 @@
+"""On-demand sampling profiler for individual requests.
+
+A request is profiled when it carries the configured token, either as an
+`X-Profile` header or a `_profile` query parameter, or when its endpoint is
+picked by PROFILER_SAMPLE_RATES (e.g. {'warbler.homepage': 0.01} profiles
+1% of home timelines).
+
+While profiling, a helper thread samples the request thread's Python stack
+every PROFILER_INTERVAL seconds, and each SQL statement is timed. Results
+are written to PROFILER_DIR in "folded" format, one `frame;frame;... count`
+line per stack, which flamegraph.pl and speedscope read directly. SQL time
+appears as a `SQL <statement>` leaf under the code that ran it, weighted in
+the same sample units; samples taken while a statement runs are dropped, so
+that time isn't counted twice.
+
+Under gevent or eventlet the request runs in a greenlet: a helper thread
+can't see its stack, and wouldn't run while the request is busy. There,
+only SQL is profiled.
+"""
+
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_active = threading.local()
+
+
+def green_threads():
+    """Has gevent or eventlet monkey-patched threading?"""
+
+    gevent_monkey = sys.modules.get('gevent.monkey')
+    if gevent_monkey is not None and gevent_monkey.is_module_patched('threading'):
+        return True
+    eventlet_patcher = sys.modules.get('eventlet.patcher')
+    return eventlet_patcher is not None and eventlet_patcher.is_monkey_patched('thread')
+
+
+def _fold(frame):
+    """Frames from `frame` up to the root, as a root-first folded string."""
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RequestProfile:
+    """Stack samples and SQL timings for one request."""
+
+    def __init__(self, interval, sample=True):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.queries = []
+        self.in_sql = False
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True,
+                                         name='warbler-profiler') if sample else None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self._sampler is not None:
+            self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            if self.in_sql:
+                continue        # counted from the statement's own timing
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+
+    def record_query(self, statement, stack, seconds):
+        self.queries.append((statement, stack, seconds))
+
+    def folded(self):
+        """Lines in folded-stack format, SQL included."""
+
+        stacks = Counter(self.stacks)
+        for statement, stack, seconds in self.queries:
+            weight = max(1, round(seconds / self.interval))
+            sql = "SQL " + " ".join(statement.split())[:120].replace(";", ",")
+            stacks[f"{stack};{sql}" if stack else sql] += weight
+
+        return [f"{stack} {count}" for stack, count in stacks.most_common()]
+
+
+class Profiler:
+    """Flask extension that profiles requests on demand."""
+
+    def init_app(self, app):
+        self.app = app
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        if not getattr(Profiler, '_listening', False):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+            Profiler._listening = True
+
+    def wants_profile(self):
+        """Should the current request be profiled?"""
+
+        config = self.app.config
+        token = config['PROFILER_TOKEN']
+        given = request.headers.get('X-Profile') or request.args.get('_profile')
+
+        if token and given and hmac.compare_digest(given, token):
+            return True
+
+        rate = config['PROFILER_SAMPLE_RATES'].get(request.endpoint, 0)
+        return rate > 0 and random.random() < rate
+
+    def _before_request(self):
+        if not self.wants_profile():
+            return
+
+        sample = not green_threads()
+        if not sample and not getattr(self, '_warned', False):
+            logger.warning("Green threads in use; profiling SQL only, without stack samples")
+            self._warned = True
+
+        profile = RequestProfile(self.app.config['PROFILER_INTERVAL'], sample)
+        profile.filename = os.path.join(
+            self.app.config['PROFILER_DIR'],
+            f"{datetime.utcnow():%Y%m%dT%H%M%S}-{request.endpoint}-"
+            f"{uuid.uuid4().hex[:8]}.folded")
+
+        g.profile = profile
+        _active.profile = profile
+        profile.start()
+
+    def _after_request(self, response):
+        profile = g.get('profile')
+        if profile is not None:
+            response.headers['X-Profile-File'] = os.path.basename(profile.filename)
+        return response
+
+    def _teardown_request(self, exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+
+        _active.profile = None
+        profile.stop()
+
+        os.makedirs(os.path.dirname(profile.filename), exist_ok=True)
+        with open(profile.filename, 'w') as f:
+            f.writelines(line + "\n" for line in profile.folded())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_active, 'profile', None)
+    if profile is not None and context is not None:
+        context._profile_start = time.perf_counter()
+        profile.in_sql = True
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_active, 'profile', None)
+    start = getattr(context, '_profile_start', None)
+    if profile is None or start is None:
+        return
+
+    seconds = time.perf_counter() - start
+    profile.in_sql = False
+    # skip SQLAlchemy's own frames so the SQL hangs off the app code
+    frame = sys._getframe(1)
+    while frame is not None and 'sqlalchemy' in frame.f_code.co_filename:
+        frame = frame.f_back
+    profile.record_query(statement, _fold(frame), seconds)
+
+
+def _handle_error(exception_context):
+    profile = getattr(_active, 'profile', None)
+    if profile is not None:
+        profile.in_sql = False
+
+
+profiler = Profiler()
@@ -0,0 +1,94 @@
+"""In-process pub/sub for live timeline updates.
+
+Subscribers are plain bounded queues, so an idle SSE connection costs one
+queue and one parked greenlet rather than a worker thread. Run the app under
+a cooperative worker for that to hold, e.g.:
+
+    gunicorn -k gevent --worker-connections 2000 app:app
+"""
+
+import queue
+import threading
+
+
+class Subscription:
+    """A single subscriber's view of one channel."""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, payload):
+        """Queue `payload`, dropping the oldest item if the reader is slow."""
+
+        while True:
+            try:
+                self.queue.put_nowait(payload)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next payload, or None if nothing arrived within `timeout`."""
+
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class PubSub:
+    """Fan out payloads to every subscriber of a channel."""
+
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def subscribe(self, channel):
+        """Subscribe to `channel` and return the new Subscription."""
+
+        sub = Subscription(self, channel, self.maxsize)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._channels.get(sub.channel)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._channels[sub.channel]
+
+    def publish(self, channels, payload):
+        """Deliver `payload` to everyone subscribed to any of `channels`.
+
+        Returns the number of subscriptions it was delivered to.
+        """
+
+        with self._lock:
+            targets = [sub
+                       for channel in channels
+                       for sub in self._channels.get(channel, ())]
+
+        for sub in targets:
+            sub.put(payload)
+
+        return len(targets)
+
+    def subscriber_count(self, channel=None):
+        with self._lock:
+            if channel is not None:
+                return len(self._channels.get(channel, ()))
+            return sum(len(subs) for subs in self._channels.values())
+
+
+timeline_events = PubSub()
@@ -0,0 +1,168 @@
+"""Token-bucket rate limiting for routes that do bcrypt work.
+
+Each limited POST takes a token from a per-IP bucket and from a
+per-username bucket: the one the form names (login, signup), or the
+logged-in user's on views limited with by_user=True, where the form's
+username is the new one being chosen. When either is empty the request
+is answered with 429 before any password is hashed or checked.
+
+Client IPs come from request.remote_addr; behind a reverse proxy, set
+PROXY_COUNT (see app.trust_proxies) so each client gets its own bucket.
+
+Buckets live in process memory by default. Set RATELIMIT_STORAGE_URL to a
+redis:// URL to share them between workers and hosts.
+"""
+
+import heapq
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import Response, current_app, g, request
+
+from metrics import metrics
+
+
+class MemoryBackend:
+    """Buckets in a dict, for a single process.
+
+    Each bucket records when it will be full again, by its own rate and
+    burst; a heap ordered by that time lets full (forgettable) buckets be
+    dropped as they come due, rather than by scanning them all.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}      # key -> (tokens, updated, full_at)
+        self._full_at = []      # heap of (full_at, key), some of them stale
+
+    def consume(self, key, rate, burst, now=None):
+        """Take a token from `key`'s bucket.
+
+        Returns 0 if allowed, otherwise seconds until a token is available.
+        """
+
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            self._evict(now)
+
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+
+            full_at = now + (burst - tokens) / rate
+            self._buckets[key] = (tokens, now, full_at)
+            heapq.heappush(self._full_at, (full_at, key))
+
+            # still too many: forget those nearest to full first
+            while len(self._buckets) > self.max_keys:
+                self._pop()
+
+            if len(self._full_at) > 2 * len(self._buckets) + 1000:
+                self._full_at = [(bucket[2], key) for key, bucket in self._buckets.items()]
+                heapq.heapify(self._full_at)
+
+        return wait
+
+    def _evict(self, now):
+        """Forget buckets that have refilled completely by `now`."""
+
+        while self._full_at and self._full_at[0][0] <= now:
+            self._pop()
+
+    def _pop(self):
+        full_at, key = heapq.heappop(self._full_at)
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket[2] == full_at:
+            del self._buckets[key]
+
+
+class RedisBackend:
+    """Buckets in Redis, shared by every worker. Needs the `redis` package."""
+
+    SCRIPT = """
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or ARGV[2])
+    local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or ARGV[3])
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def consume(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now
+        return float(self.script(keys=[f"ratelimit:{key}"],
+                                 args=[rate, burst, now]))
+
+
+class RateLimiter:
+    """Flask extension holding the bucket backend."""
+
+    def init_app(self, app):
+        url = app.config['RATELIMIT_STORAGE_URL']
+        self.backend = RedisBackend(url) if url else MemoryBackend()
+
+    def check(self, scope, by_user=False):
+        """Seconds the current request must wait, or 0 if it may proceed."""
+
+        config = current_app.config
+        if by_user:
+            username = g.user and g.user.username
+        else:
+            username = request.form.get('username')
+
+        buckets = [('ip', request.remote_addr, config['RATELIMIT_PER_IP'])]
+        if username:
+            buckets.append(('username', username.lower(),
+                            config['RATELIMIT_PER_USERNAME']))
+
+        for key_type, value, (rate, burst) in buckets:
+            wait = self.backend.consume(f"{scope}:{key_type}:{value}", rate, burst)
+            if wait:
+                metrics.inc('warbler_ratelimit_rejected_total',
+                            scope=scope, key=key_type)
+                return wait
+
+        return 0
+
+    def limit(self, scope, methods=('POST',), by_user=False):
+        """Decorator: rate-limit a view's `methods` (POSTs) under `scope`.
+
+        With `by_user`, the per-username bucket is the logged-in user's.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if (request.method in methods
+                        and current_app.config['RATELIMIT_ENABLED']):
+                    wait = self.check(scope, by_user)
+                    if wait:
+                        return Response(
+                            "Too many attempts. Please try again later.",
+                            status=429,
+                            headers={'Retry-After': str(math.ceil(wait))})
+
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+limiter = RateLimiter()
@@ -0,0 +1,362 @@
+"""Lightweight read models for timeline and listing pages.
+
+These run Core select()s for just the columns the templates render and
+return small slotted rows instead of ORM instances, so read paths skip
+identity-map bookkeeping and relationship loading. Rows are read-only; use
+the models in models.py for anything that writes.
+
+The functions sharding.py reuses take an optional `session`, to run on a
+shard's session instead of db.session.
+"""
+
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import aliased
+
+from models import db, Follows, Likes, Mention, Message, MessageDeletion, MessageTag
+from models import Notification, Tag, User, UserStats
+from snowflake import id_at
+
+
+class Author(NamedTuple):
+    id: int
+    username: str
+    image_url: str
+
+
+class MessageCard:
+    """A message as shown in a timeline: text plus a little about its author."""
+
+    __slots__ = ('id', 'text', 'timestamp', 'user')
+
+    def __init__(self, id, text, timestamp, user):
+        self.id = id
+        self.text = text
+        self.timestamp = timestamp
+        self.user = user
+
+
+class UserCard(NamedTuple):
+    """A user as shown in user listings."""
+
+    id: int
+    username: str
+    image_url: str
+    header_image_url: str
+    bio: str
+
+
+class UserProfile(NamedTuple):
+    """A user's profile header, with counts instead of collections."""
+
+    id: int
+    username: str
+    image_url: str
+    header_image_url: str
+    bio: str
+    location: str
+    messages_count: int
+    following_count: int
+    followers_count: int
+    likes_count: int
+    # from the last `flask graph-analytics` run; None until then
+    mutuals_count: int
+    reach: int
+
+
+class InfluentialUser(NamedTuple):
+    """A user ranked by follow-graph PageRank."""
+
+    id: int
+    username: str
+    image_url: str
+    followers_count: int
+    mutuals_count: int
+    reach: int
+    pagerank: float
+    computed_at: datetime
+
+
+class NotificationCard(NamedTuple):
+    """A coalesced notification, with its latest actor and liked message."""
+
+    id: int
+    kind: str
+    target_id: int
+    actor_count: int
+    updated_at: datetime
+    is_read: bool
+    actor: Author
+    text: str
+
+
+CARD_COLUMNS = (Message.id, Message.text, Message.timestamp,
+                User.id.label('user_id'), User.username, User.image_url)
+
+USER_CARD_COLUMNS = (User.id, User.username, User.image_url,
+                     User.header_image_url, User.bio)
+
+# messages of accounts awaiting purge are hidden like the accounts are
+LIVE_AUTHOR = and_(Message.user_id == User.id, User.deleted_at.is_(None))
+
+
+def _cards(stmt, session=None):
+    return [MessageCard(row.id, row.text, row.timestamp,
+                        Author(row.user_id, row.username, row.image_url))
+            for row in (session or db.session).execute(stmt)]
+
+
+def timeline_query(user_ids, limit=100, since=None):
+    """Select the newest `limit` messages by `user_ids`, with their authors."""
+
+    stmt = (select(*CARD_COLUMNS)
+            .join(User, LIVE_AUTHOR)
+            .where(Message.user_id.in_(user_ids))
+            .order_by(Message.id.desc())
+            .limit(limit))
+
+    if since is not None:
+        # IDs are time-ordered, so this stays on the (user_id, id) index
+        stmt = stmt.where(Message.id >= id_at(since))
+
+    return stmt
+
+
+def timeline_cards(user_ids, limit=100, window=None, session=None):
+    """Newest `limit` messages by `user_ids`, as MessageCards.
+
+    Looks inside the last `window` (a timedelta) first, so the
+    (user_id, id) index range stays short for busy authors, and
+    only falls back to the full history if that window is too sparse.
+    """
+
+    if window is not None:
+        recent = _cards(timeline_query(user_ids, limit,
+                                       since=datetime.utcnow() - window),
+                        session)
+        if len(recent) == limit:
+            return recent
+
+    return _cards(timeline_query(user_ids, limit), session)
+
+
+def cards_by_ids(ids, session=None):
+    """MessageCards for `ids`, in the same order; missing IDs are skipped."""
+
+    if not ids:
+        return []
+
+    by_id = {card.id: card
+             for card in _cards(select(*CARD_COLUMNS)
+                                .join(User, LIVE_AUTHOR)
+                                .where(Message.id.in_(ids)),
+                                session)}
+
+    return [by_id[msg_id] for msg_id in ids if msg_id in by_id]
+
+
+def cards_since(user_ids, since, limit=100, session=None):
+    """Messages by `user_ids` with IDs above `since`, newest first."""
+
+    return _cards(select(*CARD_COLUMNS)
+                  .join(User, LIVE_AUTHOR)
+                  .where(Message.user_id.in_(user_ids), Message.id > since)
+                  .order_by(Message.id.desc())
+                  .limit(limit),
+                  session)
+
+
+def deleted_since(user_ids, since):
+    """IDs of messages by `user_ids` deleted after the snowflake `since`."""
+
+    return list(db.session.scalars(
+        select(MessageDeletion.message_id)
+        .where(MessageDeletion.user_id.in_(user_ids), MessageDeletion.id > since)
+        .order_by(MessageDeletion.id)))
+
+
+def liked_cards(user_id):
+    """Messages `user_id` has liked, newest first."""
+
+    return _cards(select(*CARD_COLUMNS)
+                  .join(User, LIVE_AUTHOR)
+                  .join(Likes, Likes.message_id == Message.id)
+                  .where(Likes.user_id == user_id)
+                  .order_by(Message.id.desc()))
+
+
+def tag_cards(tag, before=None, limit=50):
+    """Messages tagged #`tag`, newest first, with IDs below `before`."""
+
+    stmt = (select(*CARD_COLUMNS)
+            .join(User, LIVE_AUTHOR)
+            .join(MessageTag, MessageTag.message_id == Message.id)
+            .join(Tag, Tag.id == MessageTag.tag_id)
+            .where(Tag.name == tag)
+            .order_by(MessageTag.message_id.desc())
+            .limit(limit))
+
+    if before is not None:
+        stmt = stmt.where(MessageTag.message_id < before)
+
+    return _cards(stmt)
+
+
+def mention_cards(user_id, before=None, limit=50):
+    """Messages @mentioning `user_id`, newest first, with IDs below `before`."""
+
+    stmt = (select(*CARD_COLUMNS)
+            .join(User, LIVE_AUTHOR)
+            .join(Mention, Mention.message_id == Message.id)
+            .where(Mention.user_id == user_id)
+            .order_by(Mention.message_id.desc())
+            .limit(limit))
+
+    if before is not None:
+        stmt = stmt.where(Mention.message_id < before)
+
+    return _cards(stmt)
+
+
+def liked_ids(user_id, session=None):
+    """Set of message IDs `user_id` has liked."""
+
+    return set((session or db.session).scalars(
+        select(Likes.message_id).where(Likes.user_id == user_id)))
+
+
+def liker_ids(message_id, limit=None, session=None):
+    """IDs of users who like `message_id`, most recent first."""
+
+    return list((session or db.session).scalars(
+        select(Likes.user_id)
+        .where(Likes.message_id == message_id)
+        .order_by(Likes.id.desc())
+        .limit(limit)))
+
+
+def following_ids(user_id, session=None):
+    """Set of user IDs `user_id` follows."""
+
+    return set((session or db.session).scalars(
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == user_id)))
+
+
+def follower_ids(user_id, session=None):
+    """Set of user IDs following `user_id`."""
+
+    return set((session or db.session).scalars(
+        select(Follows.user_following_id)
+        .where(Follows.user_being_followed_id == user_id)))
+
+
+def notification_cards(user_id, before=None, limit=20):
+    """`user_id`'s notifications, most recently active first.
+
+    `before` is an (updated_at, id) pair from the last card of the
+    previous page.
+    """
+
+    actor = aliased(User)
+    stmt = (select(Notification.id, Notification.kind, Notification.target_id,
+                   Notification.actor_count, Notification.updated_at,
+                   Notification.is_read, actor.id.label('actor_id'),
+                   actor.username, actor.image_url, Message.text)
+            .outerjoin(actor, actor.id == Notification.last_actor_id)
+            .outerjoin(Message, and_(Notification.kind == 'like',
+                                     Message.id == Notification.target_id))
+            .where(Notification.user_id == user_id)
+            .order_by(Notification.updated_at.desc(), Notification.id.desc())
+            .limit(limit))
+
+    if before is not None:
+        updated_at, notification_id = before
+        stmt = stmt.where(or_(Notification.updated_at < updated_at,
+                              and_(Notification.updated_at == updated_at,
+                                   Notification.id < notification_id)))
+
+    return [NotificationCard(row.id, row.kind, row.target_id, row.actor_count,
+                             row.updated_at, row.is_read,
+                             Author(row.actor_id, row.username, row.image_url)
+                             if row.actor_id else None,
+                             row.text)
+            for row in db.session.execute(stmt)]
+
+
+def profile_query(user_id):
+    """Select a live user's profile columns and counts in one statement."""
+
+    def count(column, where):
+        return (select(func.count())
+                .select_from(column.table)
+                .where(where)
+                .scalar_subquery())
+
+    return (select(User.id, User.username, User.image_url,
+                   User.header_image_url, User.bio, User.location,
+                   count(Message.id, Message.user_id == User.id),
+                   count(Follows.user_following_id,
+                         Follows.user_following_id == User.id),
+                   count(Follows.user_being_followed_id,
+                         Follows.user_being_followed_id == User.id),
+                   count(Likes.id, Likes.user_id == User.id),
+                   UserStats.mutuals_count, UserStats.reach)
+            .outerjoin(UserStats, UserStats.user_id == User.id)
+            .where(User.id == user_id, User.deleted_at.is_(None)))
+
+
+def user_profile(user_id, session=None):
+    """UserProfile for `user_id`, or None if there is no such live user."""
+
+    row = (session or db.session).execute(profile_query(user_id)).first()
+    return UserProfile(*row) if row else None
+
+
+def influential_users(limit=50, session=None):
+    """Live users with the highest PageRank, as of the last analytics run."""
+
+    return [InfluentialUser(*row) for row in (session or db.session).execute(
+        select(User.id, User.username, User.image_url,
+               UserStats.followers_count, UserStats.mutuals_count,
+               UserStats.reach, UserStats.pagerank, UserStats.computed_at)
+        .join(UserStats, UserStats.user_id == User.id)
+        .where(User.deleted_at.is_(None))
+        .order_by(UserStats.pagerank.desc())
+        .limit(limit))]
+
+
+def user_cards(search=None, ids=None, session=None):
+    """Live users, optionally those whose username contains `search` or
+    whose ID is in `ids`."""
+
+    stmt = select(*USER_CARD_COLUMNS).where(User.deleted_at.is_(None))
+
+    if search:
+        stmt = stmt.where(User.username.like(f"%{search}%"))
+    if ids is not None:
+        stmt = stmt.where(User.id.in_(ids))
+
+    return [UserCard(*row) for row in (session or db.session).execute(stmt)]
+
+
+def following_cards(user_id):
+    """Users `user_id` follows."""
+
+    return [UserCard(*row) for row in db.session.execute(
+        select(*USER_CARD_COLUMNS)
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .where(Follows.user_following_id == user_id,
+               User.deleted_at.is_(None)))]
+
+
+def follower_cards(user_id):
+    """Users following `user_id`."""
+
+    return [UserCard(*row) for row in db.session.execute(
+        select(*USER_CARD_COLUMNS)
+        .join(Follows, Follows.user_following_id == User.id)
+        .where(Follows.user_being_followed_id == user_id,
+               User.deleted_at.is_(None)))]
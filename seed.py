@@ -1,23 +1,36 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
+from datetime import datetime
+
+from sqlalchemy import insert
+
 from app import db, app
 from models import User, Message, Follows
+from sqlite_wal import bulk_load
+from snowflake import MAX_SEQUENCE, id_at
 
 # Create the database tables
 with app.app_context():
     db.drop_all()
     db.create_all()
 
-    # Seed the database with data from CSV files
     with open('generator/users.csv') as users:
-        db.session.bulk_insert_mappings(User, DictReader(users))
+        users = list(DictReader(users))
 
     with open('generator/messages.csv') as messages:
-        db.session.bulk_insert_mappings(Message, DictReader(messages))
+        messages = list(DictReader(messages))
+
+    # IDs from the sample timestamps, so seeded timelines sort by ID
+    for n, row in enumerate(messages):
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+        row['id'] = id_at(row['timestamp'], sequence=n & MAX_SEQUENCE)
 
     with open('generator/follows.csv') as follows:
-        db.session.bulk_insert_mappings(Follows, DictReader(follows))
+        follows = list(DictReader(follows))
 
-    # Commit the changes to the database
-    db.session.commit()
+    # Seed the database with data from CSV files, in one transaction
+    with bulk_load(db.engine) as connection:
+        connection.execute(insert(User), users)
+        connection.execute(insert(Message), messages)
+        connection.execute(insert(Follows), follows)
@@ -0,0 +1,407 @@
+"""Optional sharding of users, messages, likes and follows by user ID.
+
+Set SHARD_DATABASE_URLS to N database URLs (and run `flask create-shards`)
+and each user's data lives on shard user_id % N:
+
+- their users row (a copy; see below) and their messages;
+- the likes they make;
+- the follows they make, plus a mirror of every follow of them, so both
+  following and follower lists and counts are single-shard reads;
+- their user_stats row, which `flask graph-analytics` computes from the
+  follows on every shard.
+
+Per-user reads (profiles, likes, follow lists) go to one shard. Home
+timelines and user search scatter the same read_models query to every
+shard involved, in parallel, and merge the results. The parallel reads
+of all requests share SHARD_READ_THREADS threads.
+
+The main database (DATABASE_URL) stays the user directory: it hands out
+user IDs, enforces unique usernames and emails, and backs login and
+everything not listed above (notifications, tags, archives).
+Signup and profile edits copy the users row to its shard. Shard tables
+are created without foreign keys, since rows on one shard refer to users
+and messages on others.
+
+Writes that touch two shards (a follow) are not atomic across them. The
+follower's shard is written first, so a failure leaves at worst a missing
+mirror row.
+"""
+
+import heapq
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+from sqlalchemy import ForeignKeyConstraint, MetaData, create_engine, delete, insert, select
+from sqlalchemy.orm import joinedload, sessionmaker
+
+import read_models
+import sqlite_wal
+from models import db, Follows, Likes, Message, User
+
+SHARDED_TABLES = ('users', 'messages', 'follows', 'likes', 'user_stats')
+
+
+def shard_metadata():
+    """The sharded tables, without foreign keys."""
+
+    metadata = MetaData()
+    for name in SHARDED_TABLES:
+        table = db.metadata.tables[name].to_metadata(metadata)
+        for constraint in [c for c in table.constraints
+                           if isinstance(c, ForeignKeyConstraint)]:
+            table.constraints.discard(constraint)
+        table.foreign_keys.clear()
+        for column in table.columns:
+            column.foreign_keys.clear()
+    return metadata
+
+
+class ShardRouter:
+    """Flask extension routing per-user rows to SHARD_DATABASE_URLS.
+
+    Its read methods take the same arguments as their read_models
+    namesakes, so views can use either (see app.read_store).
+    """
+
+    def __init__(self):
+        self.engines = []
+        self._sessions = []
+        self._executor = None
+        self.threads = None
+
+    def init_app(self, app):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for engine in self.engines:
+            engine.dispose()
+
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        self.engines = [create_engine(url, **options)
+                        for url in app.config['SHARD_DATABASE_URLS']]
+        self.threads = max(app.config['SHARD_READ_THREADS'], len(self.engines))
+        self._sessions = []
+        for engine in self.engines:
+            sqlite_wal.configure_engine(app, engine)
+            factory = sessionmaker(bind=engine)
+            sqlite_wal.install_session_events(factory)
+            self._sessions.append(factory)
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads,
+                                                thread_name_prefix='warbler-shard')
+        return self._executor
+
+    def shard_of(self, user_id):
+        return user_id % len(self.engines)
+
+    @contextmanager
+    def session(self, shard):
+        """A session on `shard`, closed afterwards. Doesn't commit."""
+
+        with self._sessions[shard]() as session:
+            yield session
+
+    def for_user(self, user_id):
+        """A session on `user_id`'s shard."""
+
+        return self.session(self.shard_of(user_id))
+
+    def gather(self, fn, shards=None):
+        """[fn(session, shard) for each of `shards`], run in parallel.
+
+        Defaults to every shard.
+        """
+
+        shards = list(range(len(self.engines)) if shards is None else shards)
+
+        def run(shard):
+            with self.session(shard) as session:
+                return fn(session, shard)
+
+        if len(shards) == 1:
+            return [run(shards[0])]
+        return list(self.executor.map(run, shards))
+
+    def group(self, user_ids):
+        """{shard: [user IDs on it]} for `user_ids`."""
+
+        by_shard = defaultdict(list)
+        for user_id in user_ids:
+            by_shard[self.shard_of(user_id)].append(user_id)
+        return by_shard
+
+    def create_all(self):
+        metadata = shard_metadata()
+        for engine in self.engines:
+            metadata.create_all(engine)
+
+    def drop_all(self):
+        metadata = shard_metadata()
+        for engine in self.engines:
+            metadata.drop_all(engine)
+
+    ##########################################################################
+    # Reads
+
+    def user_profile(self, user_id):
+        with self.for_user(user_id) as session:
+            return read_models.user_profile(user_id, session=session)
+
+    def following_ids(self, user_id):
+        with self.for_user(user_id) as session:
+            return read_models.following_ids(user_id, session=session)
+
+    def follower_ids(self, user_id):
+        with self.for_user(user_id) as session:
+            return read_models.follower_ids(user_id, session=session)
+
+    def liked_ids(self, user_id):
+        with self.for_user(user_id) as session:
+            return read_models.liked_ids(user_id, session=session)
+
+    def liker_ids(self, message_id, limit=None):
+        """Likers of `message_id` from every shard; newest first per shard,
+        since like IDs aren't comparable across shards."""
+
+        per_shard = self.gather(lambda session, shard: read_models.liker_ids(
+            message_id, limit, session=session))
+        return list(islice((user_id for ids in per_shard for user_id in ids), limit))
+
+    def influential_users(self, limit=50):
+        """Highest PageRank first, from every shard's user_stats."""
+
+        per_shard = self.gather(lambda session, shard: read_models.influential_users(
+            limit, session=session))
+        return list(islice(heapq.merge(*per_shard, key=lambda user: user.pagerank,
+                                       reverse=True),
+                           limit))
+
+    def timeline_cards(self, user_ids, limit=100, window=None):
+        """Newest `limit` messages by `user_ids`, from each author's shard."""
+
+        by_shard = self.group(user_ids)
+        per_shard = self.gather(
+            lambda session, shard: read_models.timeline_cards(
+                by_shard[shard], limit, window, session=session),
+            by_shard)
+
+        return list(islice(heapq.merge(*per_shard, key=lambda card: card.id,
+                                       reverse=True),
+                           limit))
+
+    def cards_since(self, user_ids, since, limit=100):
+        """Messages by `user_ids` above `since`, from each author's shard."""
+
+        by_shard = self.group(user_ids)
+        per_shard = self.gather(
+            lambda session, shard: read_models.cards_since(
+                by_shard[shard], since, limit, session=session),
+            by_shard)
+
+        return list(islice(heapq.merge(*per_shard, key=lambda card: card.id,
+                                       reverse=True),
+                           limit))
+
+    def deleted_since(self, user_ids, since):
+        # tombstones are written to the main database; see app.message_deleted
+        return read_models.deleted_since(user_ids, since)
+
+    def cards_by_ids(self, ids):
+        """MessageCards for `ids`, in the same order, from any shard."""
+
+        if not ids:
+            return []
+
+        by_id = {card.id: card
+                 for cards in self.gather(
+                     lambda session, shard: read_models.cards_by_ids(ids, session=session))
+                 for card in cards}
+
+        return [by_id[msg_id] for msg_id in ids if msg_id in by_id]
+
+    def liked_cards(self, user_id):
+        return self.cards_by_ids(sorted(self.liked_ids(user_id), reverse=True))
+
+    def user_cards(self, search=None, ids=None):
+        """Live users matching `search` or `ids`, from every shard involved."""
+
+        if ids is not None:
+            by_shard = self.group(ids)
+            shards = list(by_shard)
+        else:
+            by_shard, shards = None, None
+
+        per_shard = self.gather(
+            lambda session, shard: read_models.user_cards(
+                search, by_shard[shard] if by_shard else None, session=session),
+            shards)
+
+        return sorted((card for cards in per_shard for card in cards),
+                      key=lambda card: card.id)
+
+    def following_cards(self, user_id):
+        return self.user_cards(ids=self.following_ids(user_id))
+
+    def follower_cards(self, user_id):
+        return self.user_cards(ids=self.follower_ids(user_id))
+
+    def message(self, message_id):
+        """The Message (with its user loaded) with `message_id`, or None.
+
+        The returned object is detached from its shard's session.
+        """
+
+        messages = self.gather(lambda session, shard: session.get(
+            Message, message_id, options=[joinedload(Message.user)]))
+
+        return next((msg for msg in messages if msg is not None), None)
+
+    ##########################################################################
+    # Writes
+
+    def save_user(self, user):
+        """Copy `user`'s row from the directory to their shard."""
+
+        with self.for_user(user.id) as session:
+            session.merge(User(**{column.key: getattr(user, column.key)
+                                  for column in User.__table__.columns}))
+            session.commit()
+
+    def forget_user(self, user_id, batch_size=1000, on_messages=None, on_likes=None,
+                    on_follows=None):
+        """Delete a user's rows, and follows of them, from every shard.
+
+        Messages go batch_size at a time, with likes of them on any shard;
+        `on_messages(ids)` is called with each batch before it's deleted.
+        `on_likes(message_ids)` and `on_follows(followed_ids)` are called
+        with each batch of the user's own likes and follows once it's
+        deleted. Returns the numbers of (messages, likes, follows) deleted.
+        """
+
+        home = self.shard_of(user_id)
+
+        # the home shard has their follows and a mirror of every follow of them
+        with self.session(home) as session:
+            followed_ids = session.scalars(
+                select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == user_id)).all()
+
+        def drop_follows(session, shard):
+            deleted = session.execute(delete(Follows).where(
+                (Follows.user_following_id == user_id)
+                | (Follows.user_being_followed_id == user_id))).rowcount
+            session.commit()
+            return deleted
+
+        follows = self.gather(drop_follows)[home]
+        if on_follows:
+            for start in range(0, len(followed_ids), batch_size):
+                on_follows(followed_ids[start:start + batch_size])
+
+        with self.session(home) as session:
+            likes = 0
+            while True:
+                liked_ids = session.scalars(select(Likes.message_id)
+                                            .where(Likes.user_id == user_id)
+                                            .limit(batch_size)).all()
+                if not liked_ids:
+                    break
+                session.execute(delete(Likes).where(Likes.user_id == user_id,
+                                                    Likes.message_id.in_(liked_ids)))
+                session.commit()
+                if on_likes:
+                    on_likes(liked_ids)
+                likes += len(liked_ids)
+
+            messages = 0
+            while True:
+                ids = session.scalars(select(Message.id)
+                                      .where(Message.user_id == user_id)
+                                      .limit(batch_size)).all()
+                if not ids:
+                    break
+                if on_messages:
+                    on_messages(ids)
+                self.delete_likes_of(ids)
+                session.execute(delete(Message).where(Message.id.in_(ids)))
+                session.commit()
+                messages += len(ids)
+
+            session.execute(delete(User).where(User.id == user_id))
+            session.commit()
+
+        return messages, likes, follows
+
+    def delete_likes_of(self, message_ids):
+        """Delete likes of `message_ids` from every shard, since likes live
+        on the liker's shard."""
+
+        def drop(session, shard):
+            session.execute(delete(Likes).where(Likes.message_id.in_(message_ids)))
+            session.commit()
+
+        self.gather(drop)
+
+    def add_message(self, user_id, text):
+        """Post a message on its author's shard; return it, detached."""
+
+        with self.for_user(user_id) as session:
+            msg = Message(text=text, user_id=user_id)
+            session.add(msg)
+            session.commit()
+            session.refresh(msg)
+            session.expunge(msg)
+            return msg
+
+    def insert_messages(self, user_id, rows):
+        """Insert message row dicts by `user_id` on their shard, together."""
+
+        with self.for_user(user_id) as session:
+            session.execute(insert(Message), rows)
+            session.commit()
+
+    def delete_message(self, msg):
+        self.delete_likes_of([msg.id])
+        with self.for_user(msg.user_id) as session:
+            session.execute(delete(Message).where(Message.id == msg.id))
+            session.commit()
+
+    def toggle_like(self, user_id, message_id):
+        """Like or unlike; return True if `user_id` now likes the message."""
+
+        with self.for_user(user_id) as session:
+            like = session.scalars(select(Likes).where(
+                Likes.user_id == user_id, Likes.message_id == message_id)).first()
+            if like is None:
+                session.add(Likes(user_id=user_id, message_id=message_id))
+            else:
+                session.delete(like)
+            session.commit()
+            return like is None
+
+    def follow(self, user_id, other_id):
+        for shard in dict.fromkeys([self.shard_of(user_id), self.shard_of(other_id)]):
+            with self.session(shard) as session:
+                session.merge(Follows(user_following_id=user_id,
+                                      user_being_followed_id=other_id))
+                session.commit()
+
+    def unfollow(self, user_id, other_id):
+        for shard in dict.fromkeys([self.shard_of(user_id), self.shard_of(other_id)]):
+            with self.session(shard) as session:
+                session.execute(delete(Follows).where(
+                    Follows.user_following_id == user_id,
+                    Follows.user_being_followed_id == other_id))
+                session.commit()
+
+
+shards = ShardRouter()
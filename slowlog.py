@@ -0,0 +1,285 @@
+"""Slow-query log with automatic EXPLAIN capture.
+
+Every statement run through a SQLAlchemy engine (the main database and any
+shards) is timed by cursor events. Those slower than SLOWLOG_THRESHOLD_MS
+are appended to SLOWLOG_PATH, one JSON object per line, with:
+
+- the statement and its parameters, strings and bytes replaced by their
+  length so no user data (emails, password hashes) is written out;
+- the endpoint that ran it, and the app function that issued it;
+- its plan, from EXPLAIN on a separate connection in the background.
+  With SLOWLOG_EXPLAIN_ANALYZE, PostgreSQL SELECTs are re-run under
+  EXPLAIN ANALYZE (and rolled back) for actual row counts and timings.
+  Each distinct statement is explained at most once every
+  SLOWLOG_EXPLAIN_EVERY seconds, so a slow query storm doesn't double
+  its own load.
+
+Each process writes its own file, SLOWLOG_PATH with its snowflake worker
+ID before the extension (logs/slow-queries.3.jsonl), since rotating one
+file from several gunicorn workers loses entries. Files rotate at
+SLOWLOG_MAX_BYTES; /admin/slow-queries merges the newest entries of all
+of them.
+
+EXPLAINs run on SLOWLOG_EXPLAIN_WORKERS threads of their own, not the
+tasks pool that account purges use. At most SLOWLOG_EXPLAIN_MAX_PENDING
+wait; beyond that a slow statement is logged without its plan.
+"""
+
+import glob
+import heapq
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from itertools import islice
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import snowflake
+from metrics import metrics
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def redact(value):
+    """`value` as logged: numbers, booleans, None and dates as they are."""
+
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return f"<str:{len(value)}>"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<bytes:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def redact_parameters(parameters):
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    return [redact(value) for value in parameters or ()]
+
+
+def _caller():
+    """file:function:line of the innermost frame outside SQLAlchemy."""
+
+    frame = sys._getframe()
+    while frame is not None and ('sqlalchemy' in frame.f_code.co_filename
+                                 or frame.f_code.co_filename == __file__):
+        frame = frame.f_back
+    if frame is None:
+        return None
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def explain(engine, statement, parameters, analyze=False):
+    """The plan for `statement` on `engine`, as a list of lines."""
+
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        sql = f"EXPLAIN QUERY PLAN {statement}"
+    elif dialect == 'postgresql':
+        sql = f"EXPLAIN (ANALYZE, BUFFERS) {statement}" if analyze else f"EXPLAIN {statement}"
+    else:
+        sql = f"EXPLAIN {statement}"
+
+    # never committed, so an analyzed statement's effects are rolled back
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(sql, parameters or ()).all()
+
+    if dialect == 'sqlite':
+        return [row[-1] for row in rows]
+    return [" ".join(str(col) for col in row) for row in rows]
+
+
+class SlowQueryLog:
+    """Flask extension that records slow statements to a rotating file."""
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._handler = None
+        self._explained = {}
+        self._executor = None
+        self._slots = None
+
+    def init_app(self, app):
+        self.app = app
+        with self._lock:
+            if self._handler is not None:
+                self._handler.close()
+            self._handler = None
+            self._explained = {}
+            self._slots = threading.BoundedSemaphore(app.config['SLOWLOG_EXPLAIN_MAX_PENDING'])
+
+        if not getattr(SlowQueryLog, '_listening', False):
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            SlowQueryLog._listening = True
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.app.config['SLOWLOG_EXPLAIN_WORKERS'],
+                thread_name_prefix='warbler-slowlog')
+        return self._executor
+
+    @property
+    def path(self):
+        """This process's log file."""
+
+        root, ext = os.path.splitext(self.app.config['SLOWLOG_PATH'])
+        return f"{root}.{snowflake.worker_id()}{ext}"
+
+    @property
+    def threshold(self):
+        ms = self.app and self.app.config['SLOWLOG_THRESHOLD_MS']
+        return None if ms is None else ms / 1000
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context,
+                               executemany):
+        # kept on the execution context, which a failed statement discards
+        if self.threshold is not None and context is not None:
+            context._slowlog_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context,
+                              executemany):
+        start = getattr(context, '_slowlog_start', None)
+        threshold = self.threshold
+        if threshold is None or start is None:
+            return
+
+        seconds = time.perf_counter() - start
+        if seconds < threshold or statement.lstrip()[:7].upper() == 'EXPLAIN':
+            return
+
+        record = {
+            'at': datetime.utcnow().isoformat(timespec='milliseconds'),
+            'duration_ms': round(seconds * 1000, 3),
+            'database': conn.engine.url.database,
+            'statement': statement,
+            'parameters': redact_parameters(parameters[0] if executemany else parameters),
+            'executemany': executemany,
+            'endpoint': request.endpoint if has_request_context() else None,
+            'method': request.method if has_request_context() else None,
+            'caller': _caller(),
+            'plan': None,
+        }
+        metrics.inc('warbler_slow_queries_total', endpoint=record['endpoint'])
+
+        if not executemany and self._should_explain(statement):
+            self._submit_explain(conn.engine, statement, parameters, record)
+        else:
+            self.write(record)
+
+    def _submit_explain(self, engine, statement, parameters, record):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            metrics.inc('warbler_slowlog_explains_dropped_total')
+            self.write(record)
+            return
+
+        def run():
+            try:
+                self._explain_and_write(engine, statement, parameters, record)
+            finally:
+                slots.release()
+
+        if self.app.config.get('TASKS_EAGER', self.app.testing):
+            run()
+        else:
+            self.executor.submit(run)
+
+    def _should_explain(self, statement):
+        config = self.app.config
+        if not config['SLOWLOG_EXPLAIN'] or statement.lstrip()[:6].upper() not in EXPLAINABLE:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            last = self._explained.get(statement)
+            if last is not None and now - last < config['SLOWLOG_EXPLAIN_EVERY']:
+                return False
+            if len(self._explained) > 10_000:
+                self._explained.clear()
+            self._explained[statement] = now
+        return True
+
+    def _explain_and_write(self, engine, statement, parameters, record):
+        analyze = (self.app.config['SLOWLOG_EXPLAIN_ANALYZE']
+                   and statement.lstrip()[:6].upper() == 'SELECT')
+        try:
+            record['plan'] = explain(engine, statement, parameters, analyze)
+            record['analyzed'] = analyze and engine.dialect.name == 'postgresql'
+        except Exception as exc:
+            record['plan_error'] = f"{type(exc).__name__}: {exc}"
+        self.write(record)
+
+    def write(self, record):
+        """Append `record` to the log, rotating it if it's full."""
+
+        with self._lock:
+            if self._handler is None:
+                config = self.app.config
+                path = self.path
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                self._handler = RotatingFileHandler(
+                    path, maxBytes=config['SLOWLOG_MAX_BYTES'],
+                    backupCount=config['SLOWLOG_BACKUPS'], encoding='UTF-8')
+            handler = self._handler
+
+        handler.handle(logging.makeLogRecord({'msg': json.dumps(record, default=str)}))
+
+    def recent(self, limit=100):
+        """The newest `limit` records, newest first, from every process's
+        files."""
+
+        root, ext = os.path.splitext(self.app.config['SLOWLOG_PATH'])
+        paths = glob.glob(f"{glob.escape(root)}.*{ext}")
+        return list(islice(heapq.merge(*(self._recent(path, limit) for path in paths),
+                                       key=lambda record: record['at'], reverse=True),
+                           limit))
+
+    def _recent(self, path, limit):
+        """The newest `limit` records in `path` and its rotated files."""
+
+        records = []
+
+        for n in range(self.app.config['SLOWLOG_BACKUPS'] + 1):
+            try:
+                with open(f"{path}.{n}" if n else path, encoding='UTF-8') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                break
+
+            for line in reversed(lines):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue        # cut short by a crash mid-write
+                if len(records) == limit:
+                    return records
+
+        return records
+
+    def _reset_after_fork(self):
+        # the parent's file, threads and lock state stay with the parent
+        self._lock = threading.Lock()
+        self._handler = None
+        self._executor = None
+
+
+slowlog = SlowQueryLog()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=slowlog._reset_after_fork)
@@ -0,0 +1,186 @@
+"""K-sortable 64-bit message IDs ("snowflakes").
+
+An ID is 41 bits of milliseconds since EPOCH, 10 bits of worker ID and a
+12-bit per-millisecond sequence, so IDs sort by creation time across
+workers and timelines can order and paginate on the primary key alone.
+
+Each process needs a distinct worker ID. On first use a process claims
+the lowest free one in its host's range by locking a file for it in
+WARBLER_WORKER_LOCK_DIR (default: the temp dir); the lock goes with the
+process, freeing the ID for its replacement. Forked children (e.g.
+gunicorn workers) claim their own.
+
+The range is WARBLER_WORKER_SPAN IDs from WARBLER_WORKER_ID. Unset, it
+is all of 0-1023, which suits a single host. Hosts sharing a database
+need disjoint ranges, e.g. WARBLER_WORKER_ID=0, 256, 512 with
+WARBLER_WORKER_SPAN=256. WARBLER_WORKER_ID alone reserves just that one
+ID. When every ID in the range is held, making an ID raises rather than
+share one.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+
+EPOCH = datetime(2010, 1, 1)
+EPOCH_MS = int((EPOCH - datetime(1970, 1, 1)).total_seconds() * 1000)
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TIME_SHIFT = WORKER_BITS + SEQUENCE_BITS
+
+
+# IDs this process has claimed; its own locks wouldn't stop it reclaiming them
+_claimed = set()
+
+
+def worker_range():
+    """(first, last) worker IDs this host may use, from the environment."""
+
+    if 'WARBLER_WORKER_ID' in os.environ:
+        first = int(os.environ['WARBLER_WORKER_ID'])
+        span = int(os.environ.get('WARBLER_WORKER_SPAN', 1))
+    else:
+        first = 0
+        span = int(os.environ.get('WARBLER_WORKER_SPAN', MAX_WORKER + 1))
+
+    last = first + span - 1
+    if not 0 <= first <= last <= MAX_WORKER:
+        raise ValueError("WARBLER_WORKER_ID and WARBLER_WORKER_SPAN must pick "
+                         f"IDs within 0-{MAX_WORKER}")
+    return first, last
+
+
+def claim_worker_id(lock_dir=None):
+    """Lock the lowest worker ID in worker_range() no other process holds.
+
+    Returns (worker ID, open lock file); the ID is ours while the file
+    stays open and the process lives.
+    """
+
+    first, last = worker_range()
+    if fcntl is None:
+        if first != last:
+            raise RuntimeError("Can't lock worker IDs here; give each process "
+                               "its own WARBLER_WORKER_ID and WARBLER_WORKER_SPAN=1")
+        return first, None
+
+    lock_dir = (lock_dir or os.environ.get('WARBLER_WORKER_LOCK_DIR')
+                or tempfile.gettempdir())
+    for worker_id in range(first, last + 1):
+        if worker_id in _claimed:
+            continue
+        lock_file = open(os.path.join(lock_dir, f"warbler-worker-{worker_id}.lock"), 'a')
+        try:
+            # POSIX record locks are per process, so forked children don't
+            # inherit their parent's
+            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _claimed.add(worker_id)
+        return worker_id, lock_file
+
+    raise RuntimeError(f"Worker IDs {first}-{last} are all in use; "
+                       "widen WARBLER_WORKER_SPAN")
+
+
+class IdGenerator:
+    """Thread-safe snowflake generator for one worker.
+
+    Without a `worker_id`, claims one (see claim_worker_id) on first use.
+    """
+
+    def __init__(self, worker_id=None, clock=time.time):
+        self.worker_id = worker_id
+        self.clock = clock
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _now_ms(self):
+        return int(self.clock() * 1000) - EPOCH_MS
+
+    def _claim(self):
+        if self.worker_id is None:
+            self.worker_id, self._lock_file = claim_worker_id()
+        return self.worker_id
+
+    def claim(self):
+        """This generator's worker ID, claiming one if it has none yet."""
+
+        with self._lock:
+            return self._claim()
+
+    def next_id(self):
+        with self._lock:
+            self._claim()
+
+            now = self._now_ms()
+
+            # never go backwards, even if the wall clock does
+            if now <= self._last_ms:
+                now = self._last_ms
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # sequence exhausted this millisecond; borrow the next
+                    now += 1
+            else:
+                self._sequence = 0
+
+            self._last_ms = now
+            return (now << TIME_SHIFT) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+def id_at(when, worker_id=0, sequence=0):
+    """The ID for the naive UTC datetime `when`.
+
+    With the defaults this is the smallest ID created at or after `when`,
+    for use as a range bound.
+    """
+
+    ms = int((when - EPOCH).total_seconds() * 1000)
+    return (max(ms, 0) << TIME_SHIFT) | (worker_id << SEQUENCE_BITS) | sequence
+
+
+def timestamp_of(snowflake_id):
+    """The naive UTC datetime `snowflake_id` was created at (to the ms)."""
+
+    ms = (snowflake_id >> TIME_SHIFT) + EPOCH_MS
+    return datetime.utcfromtimestamp(ms / 1000)
+
+
+generator = IdGenerator()
+
+
+def next_id():
+    """A new ID from this process's generator."""
+
+    return generator.next_id()
+
+
+def worker_id():
+    """This process's worker ID, also used to name its own files."""
+
+    return generator.claim()
+
+
+def _reset_after_fork():
+    global generator
+    # the parent's locks, and so its IDs, stay with the parent
+    _claimed.clear()
+    generator = IdGenerator()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
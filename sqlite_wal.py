@@ -0,0 +1,129 @@
+"""Embedded SQLite mode for small single-node installs.
+
+Point DATABASE_URL at a file (sqlite:////var/lib/warbler/warbler.db) and
+connect_db() will, for that engine:
+
+- set SQLITE_PRAGMAS on every new connection: WAL journaling, so readers
+  never block on the writer; synchronous=NORMAL, which is durable enough
+  with WAL; a larger page cache and memory-mapped reads; a busy timeout;
+  and foreign key enforcement, which SQLite leaves off by default.
+
+- serialize writers within the process (SQLITE_WRITER_LOCK): the first
+  INSERT/UPDATE/DELETE or flush in a session takes a process-wide lock,
+  held until that session commits or rolls back. SQLite allows a single
+  writer anyway, and queueing here avoids "database is locked" errors,
+  while readers keep running concurrently on their own connections.
+
+The lock is per process, so run one worker process with threads or
+gevent (gunicorn -k gevent -w 1); busy_timeout only papers over
+contention between processes.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class WriterLockTimeout(RuntimeError):
+    """Waited longer than busy_timeout for the writer lock."""
+
+
+# engine -> (lock, timeout in seconds)
+_writer_locks = {}
+
+
+def configure(app, db):
+    """Apply SQLite settings to `db`'s engine for `app`, if it is SQLite."""
+
+    with app.app_context():
+        configure_engine(app, db.engine)
+
+
+def configure_engine(app, engine):
+    """Apply `app`'s SQLite settings to `engine`, if it is SQLite."""
+
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = app.config['SQLITE_PRAGMAS']
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    if app.config['SQLITE_WRITER_LOCK']:
+        timeout = pragmas.get('busy_timeout', 5000) / 1000
+        _writer_locks[engine] = (threading.Lock(), timeout)
+
+    # connections opened before this (e.g. by the fork handler) lack pragmas
+    engine.dispose()
+
+
+def _take_writer_lock(session):
+    if session.info.get('sqlite_writer'):
+        return
+
+    entry = _writer_locks.get(session.get_bind())
+    if entry is None:
+        return
+
+    lock, timeout = entry
+    if not lock.acquire(timeout=timeout):
+        raise WriterLockTimeout("Timed out waiting for the SQLite writer lock")
+    session.info['sqlite_writer'] = lock
+
+
+def _release_writer_lock(session, transaction):
+    if transaction.parent is None:
+        lock = session.info.pop('sqlite_writer', None)
+        if lock is not None:
+            lock.release()
+
+
+def install_session_events(session):
+    """Hook the writer lock into `session` (a Session class or scoped_session)."""
+
+    @event.listens_for(session, 'before_flush')
+    def before_flush(session, flush_context, instances):
+        _take_writer_lock(session)
+
+    @event.listens_for(session, 'do_orm_execute')
+    def before_execute(orm_execute_state):
+        if (orm_execute_state.is_insert or orm_execute_state.is_update
+                or orm_execute_state.is_delete):
+            _take_writer_lock(orm_execute_state.session)
+
+    event.listen(session, 'after_transaction_end', _release_writer_lock)
+
+
+@contextmanager
+def bulk_load(engine):
+    """A connection whose work inside the block is committed in one go.
+
+    On SQLite, fsyncs are skipped while loading. Statistics are refreshed
+    afterwards on any database.
+    """
+
+    sqlite = engine.dialect.name == 'sqlite'
+
+    with engine.connect() as connection:
+        if sqlite:
+            connection.exec_driver_sql("PRAGMA synchronous = OFF")
+            connection.commit()
+        try:
+            yield connection
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            if sqlite:
+                connection.exec_driver_sql("PRAGMA synchronous = NORMAL")
+                connection.commit()
+
+        connection.exec_driver_sql("ANALYZE")
+        connection.commit()
@@ -0,0 +1,131 @@
+"""#hashtag and @mention indexing for messages.
+
+Tokens are pulled out of Message.text when a message is posted and stored
+in message_tags/mentions, so tag and mention timelines are index lookups
+rather than LIKE scans. Messages that predate this are indexed with:
+
+    flask backfill-tags
+"""
+
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Mention, Message, MessageTag, Tag, User
+
+TOKEN_RE = re.compile(r"(?<![\w#@])([#@])(\w{1,50})")
+
+
+def extract_tokens(text):
+    """(tags, mentions) in `text`: lowercased tag names and usernames."""
+
+    tags, mentions = set(), set()
+    for kind, word in TOKEN_RE.findall(text):
+        if kind == '#':
+            tags.add(word.lower())
+        else:
+            mentions.add(word)
+    return tags, mentions
+
+
+def linkify(text):
+    """Escape `text` for HTML, linking its #tags and @mentions."""
+
+    parts = []
+    last = 0
+    for match in TOKEN_RE.finditer(text):
+        kind, word = match.groups()
+        href = f"/tags/{word.lower()}" if kind == '#' else f"/users?q={word}"
+        parts.append(escape(text[last:match.start()]))
+        parts.append(Markup('<a href="{}">{}</a>').format(href, match.group()))
+        last = match.end()
+    parts.append(escape(text[last:]))
+    return Markup('').join(parts)
+
+
+def tag_ids(names):
+    """Map each tag name to its ID, creating tags that don't exist yet."""
+
+    if not names:
+        return {}
+
+    ids = dict(db.session.execute(
+        select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+
+    missing = [name for name in names if name not in ids]
+    for name in missing:
+        # one savepoint each, so a tag another request created first only
+        # undoes its own insert
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Tag), {'name': name})
+        except IntegrityError:
+            pass
+    if missing:
+        ids.update(db.session.execute(
+            select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+
+    return ids
+
+
+def index_messages(messages):
+    """Record tags and mentions for `messages` (objects with .id and .text).
+
+    Doesn't commit. Returns (tag rows, mention rows) inserted.
+    """
+
+    tokens = {msg.id: extract_tokens(msg.text) for msg in messages}
+
+    all_tags = set().union(*(tags for tags, _ in tokens.values()))
+    all_mentions = set().union(*(mentions for _, mentions in tokens.values()))
+
+    tags = tag_ids(sorted(all_tags))
+    users = dict(db.session.execute(
+        select(User.username, User.id)
+        .where(User.username.in_(all_mentions), User.deleted_at.is_(None))
+    ).all()) if all_mentions else {}
+
+    tag_rows = [{'tag_id': tags[name], 'message_id': msg_id}
+                for msg_id, (names, _) in tokens.items() for name in names]
+    mention_rows = [{'user_id': users[name], 'message_id': msg_id}
+                    for msg_id, (_, names) in tokens.items()
+                    for name in names if name in users]
+
+    if tag_rows:
+        db.session.execute(insert(MessageTag), tag_rows)
+    if mention_rows:
+        db.session.execute(insert(Mention), mention_rows)
+
+    return len(tag_rows), len(mention_rows)
+
+
+def backfill(batch_size=1000):
+    """(Re)index every message, `batch_size` at a time, in ID order.
+
+    Safe to re-run: each batch's existing rows are replaced. Returns the
+    number of messages processed.
+    """
+
+    last_id = 0
+    total = 0
+
+    while True:
+        batch = db.session.execute(
+            select(Message.id, Message.text)
+            .where(Message.id > last_id)
+            .order_by(Message.id)
+            .limit(batch_size)).all()
+
+        if not batch:
+            return total
+
+        ids = [row.id for row in batch]
+        db.session.execute(delete(MessageTag).where(MessageTag.message_id.in_(ids)))
+        db.session.execute(delete(Mention).where(Mention.message_id.in_(ids)))
+        index_messages(batch)
+        db.session.commit()
+
+        last_id = ids[-1]
+        total += len(batch)
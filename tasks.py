@@ -0,0 +1,54 @@
+"""Bounded background worker for jobs that shouldn't run inside a request."""
+
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class TaskRunner:
+    """Run callables on a small thread pool, inside an app context.
+
+    With TASKS_EAGER set (the default when TESTING), tasks run inline so
+    tests see their effects, and their errors, immediately.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self.app = None
+        self._executor = None
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('TASKS_MAX_WORKERS', self.max_workers)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='warbler-task')
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule `fn(*args, **kwargs)` and return a Future."""
+
+        app = self.app
+
+        def run():
+            with app.app_context():
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    logger.exception("Background task %s failed", fn.__name__)
+                    raise
+
+        if app.config.get('TASKS_EAGER', app.testing):
+            future = Future()
+            future.set_result(fn(*args, **kwargs))
+            return future
+
+        return self.executor.submit(run)
+
+
+tasks = TaskRunner()
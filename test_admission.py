@@ -0,0 +1,135 @@
+"""Admission control tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_admission.py
+
+import os
+import threading
+import time
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from admission import Gate, admission
+from metrics import metrics
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+class GateTestCase(TestCase):
+    """Test a Gate on its own."""
+
+    def test_limit_and_timeout(self):
+        gate = Gate('test', 1, 0.01)
+
+        self.assertTrue(gate.acquire())
+        self.assertFalse(gate.acquire())
+        self.assertEqual(metrics.get('warbler_admission_in_flight', group='test'), 1)
+
+        gate.release()
+        self.assertTrue(gate.acquire())
+        gate.release()
+        self.assertEqual(metrics.get('warbler_admission_in_flight', group='test'), 0)
+
+    def test_queued_request_admitted(self):
+        gate = Gate('test_queue', 1, 5)
+        gate.acquire()
+        admitted = []
+
+        waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+        waiter.start()
+        while gate.waiting == 0:
+            time.sleep(0.001)
+        self.assertEqual(metrics.get('warbler_admission_queue_depth', group='test_queue'), 1)
+
+        gate.release()
+        waiter.join()
+
+        self.assertEqual(admitted, [True])
+        self.assertEqual(gate.waiting, 0)
+        gate.release()
+
+
+class AdmissionTestCase(TestCase):
+    """Test requests are shed, per group, when their gate is full."""
+
+    def setUp(self):
+        reset_db()
+
+        self.user = User.signup("admission_user", "admission_user@test.com", "password", None)
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def fill(self, group):
+        """Take every slot of `group`'s gate; return a function giving them back."""
+
+        gate = admission.gates[group]
+        timeout, gate.queue_timeout = gate.queue_timeout, 0.01
+        taken = 0
+        while gate.acquire():
+            taken += 1
+
+        def release():
+            for _ in range(taken):
+                gate.release()
+            gate.queue_timeout = timeout
+        return release
+
+    def get(self, url, **kwargs):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+            return c.get(url, **kwargs)
+
+    def test_timelines_shed(self):
+        shed = metrics.get('warbler_admission_shed_total', group='timelines')
+        release = self.fill('timelines')
+        try:
+            resp = self.get("/")
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.headers['Retry-After'], "2")
+            self.assertEqual(metrics.get('warbler_admission_shed_total', group='timelines'),
+                             shed + 1)
+
+            # other groups, and unlisted GETs, are unaffected
+            self.assertEqual(self.get("/login").status_code, 200)
+            self.assertEqual(self.get("/messages/new").status_code, 200)
+        finally:
+            release()
+
+        self.assertEqual(self.get("/").status_code, 200)
+        self.assertEqual(admission.gates['timelines'].in_flight, 0)
+
+    def test_writes_shed(self):
+        release = self.fill('writes')
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.user.id
+                resp = c.post("/messages/new", data={"text": "shed me"})
+        finally:
+            release()
+
+        self.assertEqual(resp.status_code, 503)
+
+    def test_stream_exempt(self):
+        self.assertIsNone(admission.group_of('warbler.timeline_stream', 'GET'))
+        self.assertEqual(admission.group_of('warbler.toggle_like', 'POST'), 'writes')
+        self.assertEqual(admission.group_of('warbler.login', 'POST'), 'auth')
+        self.assertEqual(admission.group_of('warbler.check_availability', 'GET'),
+                         'availability')
+        self.assertEqual(admission.group_of('static', 'GET'), 'static')
+        self.assertIsNone(admission.group_of('warbler.messages_show', 'GET'))
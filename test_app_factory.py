@@ -0,0 +1,68 @@
+"""App factory and configuration profile tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_app_factory.py
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+import app as app_module
+from app import create_app
+
+
+def run_script(script, **env):
+    """Run `script` in a fresh interpreter, so the apps it creates don't
+    re-initialize the extensions this process's tests use; return stdout."""
+
+    env = dict({key: value for key, value in os.environ.items() if key != 'FLASK_ENV'},
+               **env)
+    result = subprocess.run([sys.executable, "-c", script], env=env, check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return result.stdout.split()
+
+
+class AppFactoryTestCase(TestCase):
+    """Test each profile configures the app it's meant to."""
+
+    def test_production_requires_secret_key(self):
+        secret_key = os.environ.pop('SECRET_KEY', None)
+        try:
+            with self.assertRaisesRegex(RuntimeError, "SECRET_KEY"):
+                create_app('production')
+        finally:
+            if secret_key is not None:
+                os.environ['SECRET_KEY'] = secret_key
+
+    def test_production_has_no_debug_toolbar(self):
+        output = run_script(
+            "import sys; from app import create_app; app = create_app('production'); "
+            "print(app.config['DEBUG'], app.config['SECRET_KEY'], "
+            "'flask_debugtoolbar' in sys.modules, 'debugtoolbar' in app.blueprints)",
+            SECRET_KEY="production-secret")
+
+        self.assertEqual(output, ["False", "production-secret", "False", "False"])
+
+    def test_testing_profile(self):
+        output = run_script(
+            "from app import create_app; app = create_app('testing'); "
+            "print(app.testing, app.config['WTF_CSRF_ENABLED'], app.config['DEBUG'])")
+
+        self.assertEqual(output, ["True", "False", "False"])
+
+    def test_default_app_created_lazily(self):
+        output = run_script(
+            "import app as module; created = 'app' in vars(module); "
+            "from app import app; "
+            "print(created, type(app).__name__, module.app is app, app.config['DEBUG'])",
+            FLASK_ENV="testing")
+
+        self.assertEqual(output, ["False", "Flask", "True", "False"])
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(AttributeError):
+            app_module.no_such_attribute
@@ -0,0 +1,86 @@
+"""Static asset pipeline tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_assets.py
+
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+from assets import assets
+from build_assets import fingerprint
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+
+class AssetsTestCase(TestCase):
+    """Test fingerprinted URLs and precompressed serving."""
+
+    def setUp(self):
+        self.dist_dir = tempfile.mkdtemp()
+        self.css = b"body { color: red; }" * 10
+
+        os.makedirs(os.path.join(self.dist_dir, "stylesheets"))
+        path = os.path.join(self.dist_dir, "stylesheets", "style.abc.css")
+        with open(path, "wb") as f:
+            f.write(self.css)
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(self.css))
+
+        self.saved = assets.dist_dir, assets.manifest
+        assets.dist_dir = self.dist_dir
+        assets.manifest = {"stylesheets/style.css": "stylesheets/style.abc.css"}
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        assets.dist_dir, assets.manifest = self.saved
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("a/b.css", b"x"), fingerprint("a/b.css", b"x"))
+        self.assertNotEqual(fingerprint("a/b.css", b"x"), fingerprint("a/b.css", b"y"))
+        self.assertRegex(fingerprint("a/b.css", b"x"), r"^a/b\.[0-9a-f]{10}\.css$")
+
+    def test_url(self):
+        self.assertEqual(assets.url("/static/stylesheets/style.css"),
+                         "/static/dist/stylesheets/style.abc.css")
+        self.assertEqual(assets.url("/static/images/unbuilt.png"),
+                         "/static/images/unbuilt.png")
+        self.assertEqual(assets.url("http://example.com/pic.png"),
+                         "http://example.com/pic.png")
+
+    def test_page_uses_hashed_url(self):
+        resp = self.client.get("/login")
+
+        self.assertIn("/static/dist/stylesheets/style.abc.css", str(resp.data))
+
+    def test_manifest_read_at_render_time(self):
+        self.client.get("/login")
+        assets.manifest = {"stylesheets/style.css": "stylesheets/style.def.css"}
+
+        resp = self.client.get("/login")
+
+        self.assertIn("/static/dist/stylesheets/style.def.css", str(resp.data))
+
+    def test_serve_gzip(self):
+        resp = self.client.get("/static/dist/stylesheets/style.abc.css",
+                               headers={"Accept-Encoding": "gzip, deflate"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.mimetype, "text/css")
+        self.assertEqual(gzip.decompress(resp.data), self.css)
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+        self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+
+    def test_serve_identity(self):
+        resp = self.client.get("/static/dist/stylesheets/style.abc.css")
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, self.css)
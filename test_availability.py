@@ -0,0 +1,178 @@
+"""Username/email availability tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_availability.py
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from availability import CountingBloomFilter, availability
+from deletion import schedule_user_deletion
+from metrics import metrics
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+class CountingBloomFilterTestCase(TestCase):
+    """Test the filter on its own."""
+
+    def test_membership(self):
+        bloom = CountingBloomFilter(1000, 0.01)
+        names = [f"user{n}" for n in range(1000)]
+        for name in names:
+            bloom.add(name)
+
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum(f"other{n}" in bloom for n in range(10_000))
+        self.assertLess(false_positives, 300)
+
+    def test_remove(self):
+        bloom = CountingBloomFilter(100, 0.01)
+        bloom.add("alice")
+        bloom.add("bob")
+        bloom.add("bob")
+
+        bloom.remove("alice")
+        bloom.remove("bob")
+
+        self.assertNotIn("alice", bloom)
+        self.assertIn("bob", bloom)
+
+
+class AvailabilityTestCase(TestCase):
+    """Test signup, profile and deletion keep the filters current."""
+
+    def setUp(self):
+        reset_db()
+
+        self.client = app.test_client()
+
+        self.user = User.signup("avail_user", "avail_user@test.com", "password", None)
+        db.session.commit()
+        availability.init_app(app)
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['AVAILABILITY_CAPACITY'] = 100_000
+        app.config['AVAILABILITY_REFRESH'] = 300
+        availability.init_app(app)
+
+    def check(self, **args):
+        with self.client as c:
+            return c.get("/api/availability", query_string=args)
+
+    def test_endpoint(self):
+        self.assertEqual(self.check(username="avail_user").json, {"username": False})
+        self.assertEqual(self.check(username="nobody").json, {"username": True})
+
+        # emails aren't answered, so accounts can't be looked up by them
+        self.assertEqual(self.check(email="avail_user@test.com").status_code, 400)
+        self.assertEqual(self.check().status_code, 400)
+
+    def test_unknown_names_skip_the_database(self):
+        filtered = metrics.get('warbler_availability_checks_total', result='filtered')
+
+        self.assertFalse(availability.is_taken('username', "never_seen_before"))
+        self.assertEqual(metrics.get('warbler_availability_checks_total', result='filtered'),
+                         filtered + 1)
+
+    def test_signup(self):
+        taken = metrics.get('warbler_availability_checks_total', result='taken')
+
+        with self.client as c:
+            resp = c.post("/signup", data={"username": "avail_user", "email": "x@test.com",
+                                           "password": "password"})
+            self.assertIn("Username already taken", resp.get_data(as_text=True))
+            resp = c.post("/signup", data={"username": "avail_new", "email": "avail_user@test.com",
+                                           "password": "password"})
+            self.assertIn("E-mail already registered", resp.get_data(as_text=True))
+
+        self.assertEqual(metrics.get('warbler_availability_checks_total', result='taken'),
+                         taken + 2)
+        self.assertEqual(User.query.count(), 1)
+
+        with self.client as c:
+            c.post("/signup", data={"username": "avail_new", "email": "avail_new@test.com",
+                                    "password": "password"})
+
+        self.assertFalse(self.check(username="avail_new").json['username'])
+
+    def test_learn_only_what_was_taken(self):
+        # as if another worker signed up avail_user@test.com under a new name
+        availability.filters()['email'].remove("avail_user@test.com")
+
+        availability.learn("avail_other", "avail_user@test.com")
+
+        self.assertTrue(availability.is_taken('email', "avail_user@test.com"))
+        self.assertNotIn("avail_other", availability.filters()['username'])
+
+    def test_other_workers_users_never_corrupt_the_filter(self):
+        app.config['AVAILABILITY_CAPACITY'] = 1
+        availability.init_app(app)
+        self.assertTrue(availability.is_taken('username', "avail_user"))
+
+        # signed up on another worker, so never added to this one's filter
+        other = User.signup("avail_elsewhere", "avail_elsewhere@test.com", "password", None)
+        db.session.commit()
+        schedule_user_deletion(other)
+
+        self.assertTrue(availability.is_taken('username', "avail_user"))
+        self.assertTrue(availability.is_taken('email', "avail_user@test.com"))
+
+    def test_rebuilt_after_refresh(self):
+        self.assertFalse(availability.is_taken('username', "avail_elsewhere"))
+        User.signup("avail_elsewhere", "avail_elsewhere@test.com", "password", None)
+        db.session.commit()
+
+        self.assertFalse(availability.is_taken('username', "avail_elsewhere"))
+
+        app.config['AVAILABILITY_REFRESH'] = 0
+        self.assertTrue(availability.is_taken('username', "avail_elsewhere"))
+
+    def test_profile_edit(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+            c.post("/users/profile", data={"username": "avail_renamed",
+                                           "email": "avail_user@test.com",
+                                           "password": "password"})
+
+        self.assertTrue(self.check(username="avail_user").json['username'])
+        self.assertTrue(availability.is_taken('email', "avail_user@test.com"))
+        self.assertFalse(self.check(username="avail_renamed").json['username'])
+        # still a "maybe", answered by the database, until the next rebuild
+        self.assertIn("avail_user", availability.filters()['username'])
+
+    def test_profile_edit_taken_elsewhere(self):
+        self.assertFalse(availability.is_taken('username', "avail_elsewhere"))
+        # signed up on another worker, after this one built its filters
+        User.signup("avail_elsewhere", "avail_elsewhere@test.com", "password", None)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user.id
+            resp = c.post("/users/profile", data={"username": "avail_elsewhere",
+                                                  "email": "avail_user@test.com",
+                                                  "password": "password"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Username already taken", resp.get_data(as_text=True))
+        self.assertTrue(availability.is_taken('username', "avail_elsewhere"))
+
+    def test_deletion_frees_names(self):
+        schedule_user_deletion(self.user)
+
+        self.assertTrue(self.check(username="avail_user").json['username'])
+        self.assertFalse(availability.is_taken('email', "avail_user@test.com"))
@@ -0,0 +1,93 @@
+"""Response compression tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_compression.py
+
+import gzip
+from unittest import TestCase
+
+from flask import Flask, Response, jsonify
+
+from compression import Compressor
+from config import Config
+from metrics import metrics
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+
+    Compressor().init_app(app)
+
+    @app.route('/big')
+    def big():
+        return "<p>warble</p>" * 100
+
+    @app.route('/small')
+    def small():
+        return "<p>hi</p>"
+
+    @app.route('/json')
+    def json():
+        return jsonify(ids=list(range(200)))
+
+    @app.route('/stream')
+    def stream():
+        return Response((f"<p>{i}</p>" for i in range(50)), mimetype='text/html')
+
+    @app.route('/encoded')
+    def encoded():
+        return Response(gzip.compress(b"x" * 1000), mimetype='text/html',
+                        headers={'Content-Encoding': 'gzip'})
+
+    return app
+
+
+class CompressionTestCase(TestCase):
+    """Test which responses get compressed, and how."""
+
+    def setUp(self):
+        self.client = make_app().test_client()
+        self.gzip = {"Accept-Encoding": "gzip"}
+
+    def test_compress_html(self):
+        before = metrics.get('warbler_compression_bytes_in_total', mimetype='text/html')
+
+        resp = self.client.get('/big', headers=self.gzip)
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(gzip.decompress(resp.data), b"<p>warble</p>" * 100)
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+
+        after = metrics.get('warbler_compression_bytes_in_total', mimetype='text/html')
+        self.assertEqual(after - before, 1300)
+
+    def test_compress_json(self):
+        resp = self.client.get('/json', headers=self.gzip)
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+
+    def test_compress_stream(self):
+        resp = self.client.get('/stream', headers=self.gzip)
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        self.assertEqual(gzip.decompress(resp.data),
+                         "".join(f"<p>{i}</p>" for i in range(50)).encode())
+
+    def test_skip_small(self):
+        resp = self.client.get('/small', headers=self.gzip)
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_skip_without_accept_encoding(self):
+        resp = self.client.get('/big')
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, b"<p>warble</p>" * 100)
+
+    def test_skip_already_encoded(self):
+        resp = self.client.get('/encoded', headers=self.gzip)
+
+        self.assertEqual(gzip.decompress(resp.data), b"x" * 1000)
@@ -0,0 +1,123 @@
+"""User data export tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_export.py
+
+import csv
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, ArchivedMessage
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from export import export_chunks
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+class ExportTestCase(TestCase):
+    """Test /users/<id>/export and `flask export-user`."""
+
+    def setUp(self):
+        reset_db()
+        app.config['EXPORT_BATCH_SIZE'] = 2
+
+        self.client = app.test_client()
+
+        self.u1 = User.signup("export_user_1", "export_user_1@test.com", "password", None)
+        self.u2 = User.signup("export_user_2", "export_user_2@test.com", "password", None)
+        db.session.commit()
+
+        self.messages = [Message(text=f"post {n}", user_id=self.u1.id) for n in range(5)]
+        other = Message(text="theirs", user_id=self.u2.id)
+        db.session.add_all(self.messages + [other])
+        db.session.add(ArchivedMessage.from_message(
+            Message(id=1, text="archived", user_id=self.u1.id,
+                    timestamp=datetime.utcnow() - timedelta(days=400)), []))
+        db.session.add(Follows(user_following_id=self.u1.id, user_being_followed_id=self.u2.id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u1.id, message_id=other.id))
+        db.session.commit()
+        self.other_id = other.id
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['EXPORT_BATCH_SIZE'] = 1000
+
+    def export(self, as_user, user_id, query=""):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = as_user
+            return c.get(f"/users/{user_id}/export{query}")
+
+    def test_ndjson(self):
+        resp = self.export(self.u1.id, self.u1.id)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        self.assertIn('warbler-export_user_1.ndjson', resp.headers['Content-Disposition'])
+
+        lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        by_type = {}
+        for line in lines:
+            by_type.setdefault(line.pop('type'), []).append(line)
+
+        self.assertEqual(by_type['profile'][0]['username'], "export_user_1")
+        self.assertNotIn('password', by_type['profile'][0])
+        self.assertEqual([m['text'] for m in by_type['message']],
+                         [f"post {n}" for n in range(5)] + ["archived"])
+        self.assertEqual(by_type['like'], [{'message_id': str(self.other_id)}])
+        self.assertEqual([m['id'] for m in by_type['message'][:5]],
+                         [str(m.id) for m in self.messages])
+        self.assertEqual(by_type['following'], [{'id': self.u2.id, 'username': "export_user_2"}])
+        self.assertNotIn('follower', by_type)
+
+    def test_csv_section(self):
+        resp = self.export(self.u1.id, self.u1.id, "?format=csv&section=messages")
+
+        self.assertEqual(resp.mimetype, 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual([row['text'] for row in rows], [f"post {n}" for n in range(5)])
+        self.assertEqual([int(row['id']) for row in rows], [m.id for m in self.messages])
+
+    def test_csv_empty_section_has_header(self):
+        chunks = list(export_chunks(self.u1.id, 'csv', 'followers'))
+
+        self.assertEqual(''.join(chunks).strip(), "id,username")
+
+    def test_bad_section(self):
+        resp = self.export(self.u1.id, self.u1.id, "?format=csv&section=password")
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_only_self_or_admin(self):
+        resp = self.export(self.u2.id, self.u1.id)
+        self.assertEqual(resp.status_code, 302)
+
+        self.u2.is_admin = True
+        db.session.commit()
+        resp = self.export(self.u2.id, self.u1.id)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_cli(self):
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['export-user', str(self.u1.id),
+                                     '--format', 'csv', '--section', 'likes'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output.split(), ['message_id', str(self.other_id)])
+
+        result = runner.invoke(args=['export-user', '9999'])
+        self.assertNotEqual(result.exit_code, 0)
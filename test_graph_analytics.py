@@ -0,0 +1,95 @@
+"""Follow-graph analytics tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_graph_analytics.py
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+import numpy as np
+
+from models import db, User, Follows, UserStats
+import graph_analytics
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# follower -> followed, as indexes into the users made in setUp
+EDGES = [(0, 1), (1, 0), (2, 0), (3, 0), (0, 2), (2, 1), (3, 2), (4, 3)]
+
+
+class GraphAnalyticsTestCase(TestCase):
+    """Test metrics against a small graph worked out by hand."""
+
+    def setUp(self):
+        reset_db()
+
+        self.users = [User.signup(f"graph{i}", f"graph{i}@test.com", "password", None)
+                      for i in range(6)]
+        db.session.commit()
+
+        ids = [u.id for u in self.users]
+        db.session.add_all(Follows(user_following_id=ids[a], user_being_followed_id=ids[b])
+                           for a, b in EDGES)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_metrics(self):
+        graph = graph_analytics.load_graph(batch_size=3)
+        stats = graph_analytics.compute_stats(graph, chunk_size=3)
+
+        self.assertEqual(stats['followers_count'].tolist(), [3, 2, 2, 1, 0, 0])
+        self.assertEqual(stats['following_count'].tolist(), [2, 1, 2, 2, 1, 0])
+        # 0<->1 and 0<->2
+        self.assertEqual(stats['mutuals_count'].tolist(), [2, 1, 1, 0, 0, 0])
+        # user 0: followers 1, 2, 3 with 2 + 2 + 1 followers of their own
+        self.assertEqual(stats['reach'].tolist(), [8, 7, 6, 1, 0, 0])
+
+        rank = stats['pagerank']
+        self.assertAlmostEqual(rank.sum(), 1.0)
+        self.assertEqual(int(np.argmax(rank)), 0)
+        self.assertAlmostEqual(rank[4], rank[5])
+
+    def test_deleted_users_dropped(self):
+        self.users[4].deleted_at = datetime.utcnow()
+        db.session.commit()
+
+        graph = graph_analytics.load_graph()
+
+        self.assertEqual(len(graph.user_ids), 5)
+        self.assertEqual(graph.followers.degrees().tolist(), [3, 2, 2, 0, 0])
+
+    def test_run_and_views(self):
+        self.assertEqual(graph_analytics.run(), 6)
+        self.assertEqual(UserStats.query.count(), 6)
+
+        graph_analytics.run()
+        self.assertEqual(UserStats.query.count(), 6)
+
+        top = self.users[0]
+        self.assertEqual(db.session.get(UserStats, top.id).reach, 8)
+
+        resp = app.test_client().get(f"/users/{top.id}")
+        self.assertIn("Reach", str(resp.data))
+
+        top.is_admin = True
+        db.session.commit()
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = top.id
+            resp = c.get("/admin/graph")
+
+        html = str(resp.data)
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(html.index("@graph0"), html.index("@graph4"))
@@ -0,0 +1,113 @@
+"""Bulk message ingestion tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_ingest.py
+
+import json
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, MessageTag
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from pubsub import timeline_events
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+def ndjson(*rows):
+    return "".join(row if isinstance(row, str) else json.dumps(row) + "\n"
+                   for row in rows)
+
+
+class IngestTestCase(TestCase):
+    """Test /api/messages/bulk and `flask ingest-messages`."""
+
+    def setUp(self):
+        reset_db()
+        app.config['INGEST_BATCH_SIZE'] = 2
+
+        self.client = app.test_client()
+
+        self.u1 = User.signup("ingest_user_1", "ingest_user_1@test.com", "password", None)
+        self.u2 = User.signup("ingest_user_2", "ingest_user_2@test.com", "password", None)
+        db.session.commit()
+        db.session.add(Follows(user_following_id=self.u2.id, user_being_followed_id=self.u1.id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['INGEST_BATCH_SIZE'] = 500
+        app.config['INGEST_MAX_ROWS'] = 10_000
+
+    def post(self, body, user_id=None, content_type='application/x-ndjson'):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                if user_id:
+                    sess[CURR_USER_KEY] = user_id
+            return c.post("/api/messages/bulk", data=body, content_type=content_type)
+
+    def test_bulk_post(self):
+        sub = timeline_events.subscribe(self.u2.id)
+        try:
+            resp = self.post(ndjson({"text": "one #bulk"},
+                                    {"text": ""},
+                                    "\n",
+                                    "not json\n",
+                                    {"text": "x" * 141},
+                                    {"text": "two"},
+                                    {"text": "three #bulk"},
+                                    [1, 2]),
+                             self.u1.id)
+
+            self.assertEqual(resp.status_code, 200)
+            ids = [int(msg_id) for msg_id in resp.json['ids']]
+            self.assertEqual(len(ids), 3)
+            self.assertEqual([e['line'] for e in resp.json['errors']], [2, 4, 5, 8])
+            self.assertIn("140", resp.json['errors'][2]['error'])
+
+            texts = [m.text for m in Message.query.order_by(Message.id)]
+            self.assertEqual(texts, ["one #bulk", "two", "three #bulk"])
+            self.assertEqual([m.id for m in Message.query.order_by(Message.id)], ids)
+            self.assertEqual(MessageTag.query.count(), 2)
+
+            # followers' live streams hear about every new message
+            events = [sub.get(timeout=0) for _ in range(3)]
+            self.assertEqual([e['id'] for e in events], ids)
+        finally:
+            sub.close()
+
+    def test_requires_login_and_ndjson(self):
+        self.assertEqual(self.post(ndjson({"text": "hi"})).status_code, 401)
+        self.assertEqual(self.post("text=hi", self.u1.id,
+                                   'application/x-www-form-urlencoded').status_code, 415)
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_max_rows(self):
+        app.config['INGEST_MAX_ROWS'] = 2
+
+        resp = self.post(ndjson(*({"text": f"msg {n}"} for n in range(4))), self.u1.id)
+
+        self.assertEqual(len(resp.json['ids']), 2)
+        self.assertEqual([e['line'] for e in resp.json['errors']], [3])
+        self.assertEqual(Message.query.count(), 2)
+
+    def test_cli(self):
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['ingest-messages', 'ingest_user_2', '-'],
+                               input=ndjson({"text": "from cli"}, {"nope": 1}))
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Posted 1 messages, skipped 1 lines.", result.output)
+        self.assertEqual([m.text for m in Message.query], ["from cli"])
+
+        result = runner.invoke(args=['ingest-messages', 'nobody', '-'], input="")
+        self.assertNotEqual(result.exit_code, 0)
@@ -1,6 +1,7 @@
 """Message model tests."""
 
 import os
+from datetime import datetime
 from unittest import TestCase
 from sqlalchemy import exc
 
@@ -15,6 +16,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 from app import app
+from testing import reset_db
 
 app.app_context().push()
 
@@ -26,8 +28,7 @@ class MessageModelTestCase(TestCase):
         """Create test client, add sample data."""
 
         with app.app_context():
-            db.drop_all()
-            db.create_all()
+            reset_db()
 
         self.testuser = User.signup(username="TestUser12",
                                     email="TestUser12@test.com",
@@ -49,7 +50,6 @@ class MessageModelTestCase(TestCase):
     def tearDown(self):
         res = super().tearDown()
         db.session.rollback()
-        db.drop_all()
         return res
     
 
@@ -89,3 +89,19 @@ class MessageModelTestCase(TestCase):
         self.assertEqual(m1.user_id, self.u1.id)
 
 
+
+
+    def test_message_ids_time_ordered(self):
+        """Test that new messages get increasing snowflake IDs and a timestamp"""
+
+        m1 = Message(text='first', user_id=self.u1_id)
+        m2 = Message(text='second', user_id=self.u1_id)
+        db.session.add(m1)
+        db.session.commit()
+        db.session.add(m2)
+        db.session.commit()
+
+        self.assertGreater(m2.id, m1.id)
+        self.assertGreater(m1.id, 2**31)
+        self.assertIsNotNone(m1.timestamp)
+        self.assertLessEqual(abs((m1.timestamp - datetime.utcnow()).total_seconds()), 5)
@@ -5,9 +5,13 @@
 
 
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 from models import db, connect_db, Message, User
+from models import ArchivedMessage
+from pubsub import timeline_events
+from archive import archive_messages
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -45,6 +49,7 @@ class MessageViewTestCase(TestCase):
 
         User.query.delete()
         Message.query.delete()
+        ArchivedMessage.query.delete()
 
         self.client = app.test_client()
 
@@ -77,6 +82,45 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(msg.text, "test message for test_add_message")
 
 
+    def test_add_message_too_long(self):
+        """Are messages over 140 characters rejected by the form?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/messages/new", data={"text": "x" * 141})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(Message.query.count(), 0)
+
+
+    def test_add_message_publishes(self):
+        """Does adding a message notify the author's open streams?"""
+
+        sub = timeline_events.subscribe(self.testuser.id)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            c.post("/messages/new", data={"text": "test message for test_add_message_publishes"})
+
+        msg = Message.query.one()
+        self.assertEqual(sub.get(timeout=0), {"id": msg.id, "user_id": self.testuser.id})
+        sub.close()
+
+
+    def test_stream_not_logged_in(self):
+        """When logged out, is the timeline stream refused?"""
+
+        with self.client as c:
+            resp = c.get('/stream', follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Access unauthorized", str(resp.data))
+
+
     def test_add_msg_not_logged_in(self):
         """When logged out, is user prohibited from adding messages?"""
 
@@ -197,3 +241,33 @@ class MessageViewTestCase(TestCase):
 
             self.assertEqual(resp.status_code, 404)
 
+
+
+    def test_show_archived_msg(self):
+        """Are archived messages still shown by ID?"""
+
+        old = Message(
+            id=4321,
+            text="Old message for test_show_archived_msg",
+            timestamp=datetime.utcnow() - timedelta(days=400),
+            user_id=self.testuser.id
+        )
+        new = Message(
+            id=4322,
+            text="New message for test_show_archived_msg",
+            timestamp=datetime.utcnow(),
+            user_id=self.testuser.id
+        )
+        db.session.add_all([old, new])
+        db.session.commit()
+
+        count = archive_messages(datetime.utcnow() - timedelta(days=365))
+        self.assertEqual(count, 1)
+        self.assertIsNone(Message.query.get(4321))
+        self.assertIsNotNone(Message.query.get(4322))
+
+        with self.client as c:
+            resp = c.get('/messages/4321')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Old message for test_show_archived_msg", str(resp.data))
@@ -0,0 +1,154 @@
+"""Notification tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_notifications.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Notification
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from deletion import schedule_user_deletion
+from notifications import notifications
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+
+class NotificationViewTestCase(TestCase):
+    """Test writing, coalescing and reading notifications."""
+
+    def setUp(self):
+        reset_db()
+        notifications.counts = type(notifications.counts)()
+
+        self.client = app.test_client()
+
+        self.owner = User.signup("owner", "owner@test.com", "password", None)
+        self.fans = [User.signup(f"fan{i}", f"fan{i}@test.com", "password", None)
+                     for i in range(3)]
+        db.session.commit()
+
+        self.msg = Message(id=1, text="likeable", user_id=self.owner.id)
+        db.session.add(self.msg)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def as_user(self, user, method, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user.id
+            return getattr(c, method)(url)
+
+    def test_likes_coalesce(self):
+        for fan in self.fans:
+            self.as_user(fan, 'post', f"/users/toggle_like/{self.msg.id}")
+
+        n = Notification.query.one()
+        self.assertEqual((n.kind, n.target_id, n.actor_count), ('like', self.msg.id, 3))
+        self.assertEqual(n.last_actor_id, self.fans[-1].id)
+        self.assertEqual(notifications.unread_count(self.owner.id), 1)
+
+        resp = self.as_user(self.owner, 'get', "/notifications")
+        self.assertIn("@fan2", str(resp.data))
+        self.assertIn("and 2 others", str(resp.data))
+        self.assertIn("liked", str(resp.data))
+        self.assertEqual(notifications.unread_count(self.owner.id), 0)
+
+    def test_unlike_retracts(self):
+        fan = self.fans[0]
+        self.as_user(fan, 'post', f"/users/toggle_like/{self.msg.id}")
+        self.as_user(fan, 'post', f"/users/toggle_like/{self.msg.id}")
+        self.assertEqual(Notification.query.count(), 0)
+
+        self.as_user(fan, 'post', f"/users/toggle_like/{self.msg.id}")
+        self.assertEqual(Notification.query.one().actor_count, 1)
+
+    def test_unlike_by_last_actor(self):
+        for fan in self.fans[:2]:
+            self.as_user(fan, 'post', f"/users/toggle_like/{self.msg.id}")
+        self.as_user(self.fans[1], 'post', f"/users/toggle_like/{self.msg.id}")
+
+        n = Notification.query.one()
+        self.assertEqual((n.actor_count, n.last_actor_id), (1, self.fans[0].id))
+
+    def test_self_follow_ignored(self):
+        self.as_user(self.fans[0], 'post', f"/users/follow/{self.owner.id}")
+        self.as_user(self.owner, 'post', f"/users/follow/{self.owner.id}")
+        self.as_user(self.owner, 'post', f"/users/stop-following/{self.owner.id}")
+
+        n = Notification.query.one()
+        self.assertEqual((n.actor_count, n.last_actor_id), (1, self.fans[0].id))
+
+    def test_follow_and_unread_badge(self):
+        self.as_user(self.fans[0], 'post', f"/users/follow/{self.owner.id}")
+
+        n = Notification.query.one()
+        self.assertEqual((n.kind, n.target_id, n.is_read), ('follow', self.owner.id, False))
+
+        resp = self.as_user(self.owner, 'get', f"/users/{self.owner.id}")
+        self.assertIn('badge-pill badge-primary">1<', str(resp.data))
+
+        self.as_user(self.fans[0], 'post', f"/users/stop-following/{self.owner.id}")
+        self.assertEqual(Notification.query.count(), 0)
+
+    def test_pagination(self):
+        app.config['NOTIFICATIONS_PAGE_SIZE'] = 2
+        try:
+            for fan in self.fans:
+                self.as_user(fan, 'post', f"/users/follow/{self.owner.id}")
+                self.as_user(fan, 'post', f"/users/toggle_like/{self.msg.id}")
+            for i in range(2, 5):
+                db.session.add(Message(id=i, text=f"m{i}", user_id=self.owner.id))
+            db.session.commit()
+            for i in range(2, 5):
+                self.as_user(self.fans[0], 'post', f"/users/toggle_like/{i}")
+
+            seen = []
+            url = "/notifications"
+            while url:
+                resp = self.as_user(self.owner, 'get', url)
+                html = resp.data.decode()
+                seen.append(html.count('class="list-group-item'))
+                url = None
+                if 'Older' in html:
+                    start = html.index('href="?before=') + len('href="')
+                    url = "/notifications" + html[start:html.index('"', start)].replace('&amp;', '&')
+
+            self.assertEqual(seen, [2, 2, 1])
+        finally:
+            app.config['NOTIFICATIONS_PAGE_SIZE'] = 20
+
+        self.assertEqual(self.as_user(self.owner, 'get', "/notifications?before=junk").status_code, 400)
+
+    def test_deleted_message_forgotten(self):
+        self.as_user(self.fans[0], 'post', f"/users/toggle_like/{self.msg.id}")
+        self.as_user(self.owner, 'post', f"/messages/{self.msg.id}/delete")
+
+        self.assertEqual(Notification.query.count(), 0)
+
+    def test_deleted_account_retracted(self):
+        for fan in self.fans[:2]:
+            self.as_user(fan, 'post', f"/users/toggle_like/{self.msg.id}")
+            self.as_user(fan, 'post', f"/users/follow/{self.owner.id}")
+        self.assertEqual(notifications.unread_count(self.owner.id), 2)
+
+        schedule_user_deletion(db.session.get(User, self.fans[1].id))
+
+        rows = {n.kind: (n.actor_count, n.last_actor_id) for n in Notification.query}
+        self.assertEqual(rows, {'like': (1, self.fans[0].id),
+                                'follow': (1, self.fans[0].id)})
+
+        schedule_user_deletion(db.session.get(User, self.fans[0].id))
+
+        self.assertEqual(Notification.query.count(), 0)
+        self.assertEqual(notifications.unread_count(self.owner.id), 0)
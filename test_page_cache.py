@@ -0,0 +1,136 @@
+"""Anonymous page cache tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_page_cache.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from page_cache import MemoryBackend, page_cache
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+class MemoryBackendTestCase(TestCase):
+    """Test the surrogate key index."""
+
+    def test_purge_by_key(self):
+        backend = MemoryBackend()
+        backend.set('/a', 'page a', {'user:1'}, 60)
+        backend.set('/b', 'page b', {'user:1', 'message:2'}, 60)
+        backend.set('/c', 'page c', {'user:3'}, 60)
+
+        backend.purge(['message:2'])
+
+        self.assertEqual(backend.get('/a'), 'page a')
+        self.assertIsNone(backend.get('/b'))
+        self.assertEqual(backend.get('/c'), 'page c')
+        self.assertEqual(backend._keys['user:1'], {'/a'})
+
+    def test_lru_and_ttl(self):
+        backend = MemoryBackend(max_pages=2)
+        backend.set('/a', 'page a', {'user:1'}, 60)
+        backend.set('/b', 'page b', set(), 60)
+        backend.get('/a')
+        backend.set('/c', 'page c', set(), 60)
+        backend.set('/d', 'page d', set(), -1)
+
+        self.assertIsNone(backend.get('/b'))
+        self.assertIsNone(backend.get('/d'))
+        self.assertEqual(backend.get('/c'), 'page c')
+
+
+class PageCacheViewTestCase(TestCase):
+    """Test caching and purging of anonymous pages."""
+
+    def setUp(self):
+        reset_db()
+        app.config['PAGE_CACHE_ENABLED'] = True
+        page_cache.init_app(app)
+
+        self.client = app.test_client()
+
+        self.u1 = User.signup("page_user_1", "page_user_1@test.com", "password", None)
+        db.session.commit()
+
+        self.msg = Message(text="cached words", user_id=self.u1.id)
+        db.session.add(self.msg)
+        db.session.commit()
+
+    def tearDown(self):
+        del app.config['PAGE_CACHE_ENABLED']
+        db.session.rollback()
+
+    def as_user(self, method, url, **kwargs):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1.id
+        resp = getattr(self.client, method)(url, **kwargs)
+        with self.client.session_transaction() as sess:
+            sess.clear()
+        return resp
+
+    def test_profile_cached_and_purged_on_post(self):
+        url = f"/users/{self.u1.id}"
+
+        self.assertEqual(self.client.get(url).headers['X-Cache'], 'MISS')
+        resp = self.client.get(url)
+        self.assertEqual(resp.headers['X-Cache'], 'HIT')
+        self.assertEqual(resp.headers['Surrogate-Key'], f"user:{self.u1.id}")
+
+        self.as_user('post', "/messages/new", data={"text": "brand new"})
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.headers['X-Cache'], 'MISS')
+        self.assertIn("brand new", str(resp.data))
+
+    def test_message_purged_on_profile_edit(self):
+        url = f"/messages/{self.msg.id}"
+        self.client.get(url)
+        self.assertEqual(self.client.get(url).headers['X-Cache'], 'HIT')
+
+        self.as_user('post', "/users/profile",
+                     data={"username": "renamed", "email": "page_user_1@test.com",
+                           "password": "password"})
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.headers['X-Cache'], 'MISS')
+        self.assertIn("@renamed", str(resp.data))
+
+    def test_message_purged_on_delete(self):
+        url = f"/messages/{self.msg.id}"
+        self.client.get(url)
+
+        self.as_user('post', f"/messages/{self.msg.id}/delete")
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_logged_in_bypasses(self):
+        url = f"/users/{self.u1.id}"
+        self.client.get(url)
+
+        resp = self.as_user('get', url)
+
+        self.assertNotIn('X-Cache', resp.headers)
+        self.assertIn("Edit Profile", str(resp.data))
+
+    def test_flashes_bypass(self):
+        self.client.get("/")
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [("success", "You have been logged out.")]
+
+        resp = self.client.get("/")
+
+        self.assertNotIn('X-Cache', resp.headers)
+        self.assertIn("You have been logged out.", str(resp.data))
+        self.assertEqual(self.client.get("/").headers['X-Cache'], 'HIT')
@@ -0,0 +1,127 @@
+"""Homepage prewarming tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_prewarm.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from metrics import metrics
+from prewarm import prewarmer
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+class PrewarmTestCase(TestCase):
+    """Test warming on login and follow, and discarding on writes."""
+
+    def setUp(self):
+        reset_db()
+        prewarmer.init_app(app)
+        prewarmer._pages.clear()
+
+        self.client = app.test_client()
+
+        self.u1 = User.signup("warm_user_1", "warm_user_1@test.com", "password", None)
+        self.u2 = User.signup("warm_user_2", "warm_user_2@test.com", "password", None)
+        db.session.commit()
+
+        db.session.add(Message(text="from two", user_id=self.u2.id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_login_warms_homepage(self):
+        hits = metrics.get('warbler_prewarm_hits_total')
+
+        with self.client as c:
+            c.post("/login", data={"username": "warm_user_1", "password": "password"})
+            self.assertIn(self.u1.id, prewarmer._pages)
+
+            resp = c.get("/")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("warm_user_1", str(resp.data))
+        self.assertEqual(metrics.get('warbler_prewarm_hits_total'), hits + 1)
+        self.assertNotIn(self.u1.id, prewarmer._pages)
+
+    def test_follow_rewarms_with_new_timeline(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+
+            c.post(f"/users/follow/{self.u2.id}")
+            resp = c.get("/")
+
+        self.assertIn("from two", str(resp.data))
+
+    def test_writes_discard(self):
+        prewarmer.warm(self.u1.id)
+        self.assertIn(self.u1.id, prewarmer._pages)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+            c.post("/messages/new", data={"text": "fresh"})
+
+        self.assertNotIn(self.u1.id, prewarmer._pages)
+
+    def test_followed_authors_writes_discard(self):
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2.id
+
+            prewarmer.warm(self.u1.id)
+            self.assertIn(self.u1.id, prewarmer._pages)
+            c.post("/messages/new", data={"text": "fresh from two"})
+            self.assertNotIn(self.u1.id, prewarmer._pages)
+
+            prewarmer.warm(self.u1.id)
+            msg = Message.query.filter_by(text="fresh from two").one()
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertNotIn(self.u1.id, prewarmer._pages)
+
+    def test_discard_during_load_wins(self):
+        load = prewarmer.load
+
+        def racing_load(user_id):
+            page = load(user_id)
+            prewarmer.discard(user_id)
+            return page
+
+        prewarmer.load = racing_load
+        try:
+            prewarmer.warm(self.u1.id)
+        finally:
+            prewarmer.load = load
+
+        self.assertIsNone(prewarmer.take(self.u1.id))
+        self.assertEqual(prewarmer._versions, {})
+
+    def test_discard_keeps_no_versions(self):
+        prewarmer.discard(*range(1000))
+
+        self.assertEqual(prewarmer._versions, {})
+
+    def test_full_queue_drops(self):
+        dropped = metrics.get('warbler_prewarm_dropped_total')
+        for _ in range(app.config['PREWARM_MAX_PENDING']):
+            prewarmer._slots.acquire()
+
+        self.assertIsNone(prewarmer.warm(self.u1.id))
+        self.assertEqual(metrics.get('warbler_prewarm_dropped_total'), dropped + 1)
@@ -0,0 +1,88 @@
+"""Request profiler tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_profiler.py
+
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from profiler import RequestProfile, green_threads
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+
+class RequestProfileTestCase(TestCase):
+    """Test folding of samples and SQL timings."""
+
+    def test_folded_includes_sql(self):
+        profile = RequestProfile(interval=0.005)
+        profile.stacks["app.py:homepage;models.py:recent_for"] = 3
+        profile.record_query("SELECT *\n  FROM messages", "app.py:homepage", 0.02)
+
+        lines = profile.folded()
+
+        self.assertIn("app.py:homepage;models.py:recent_for 3", lines)
+        self.assertIn("app.py:homepage;SQL SELECT * FROM messages 4", lines)
+
+    def test_no_samples_during_sql(self):
+        profile = RequestProfile(interval=0.001)
+        profile.in_sql = True
+
+        profile.start()
+        time.sleep(0.02)
+        profile.stop()
+
+        self.assertEqual(profile.stacks, {})
+
+    def test_sql_only(self):
+        self.assertFalse(green_threads())
+
+        profile = RequestProfile(interval=0.001, sample=False)
+        profile.start()
+        time.sleep(0.02)
+        profile.record_query("SELECT 1", "app.py:homepage", 0.002)
+        profile.stop()
+
+        self.assertEqual(profile.folded(), ["app.py:homepage;SQL SELECT 1 2"])
+
+
+class ProfilerViewTestCase(TestCase):
+    """Test which requests get profiled."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        app.config['PROFILER_DIR'] = self.dir
+        app.config['PROFILER_TOKEN'] = "sekrit"
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['PROFILER_TOKEN'] = None
+        app.config['PROFILER_SAMPLE_RATES'] = {}
+
+    def test_profile_with_token(self):
+        resp = self.client.get("/login", headers={"X-Profile": "sekrit"})
+
+        self.assertEqual(resp.status_code, 200)
+        filename = resp.headers["X-Profile-File"]
+        self.assertTrue(filename.endswith(".folded"))
+        self.assertIn(filename, os.listdir(self.dir))
+
+    def test_no_profile_with_wrong_token(self):
+        resp = self.client.get("/login?_profile=wrong")
+
+        self.assertNotIn("X-Profile-File", resp.headers)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_continuous_sampling(self):
+        app.config['PROFILER_SAMPLE_RATES'] = {'warbler.login': 1.0}
+
+        resp = self.client.get("/login")
+
+        self.assertIn("X-Profile-File", resp.headers)
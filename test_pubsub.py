@@ -0,0 +1,44 @@
+"""Pub/sub tests."""
+
+# run these tests like:
+#    python -m unittest test_pubsub.py
+
+from unittest import TestCase
+
+from pubsub import PubSub
+
+
+class PubSubTestCase(TestCase):
+    """Test the in-process pub/sub broker."""
+
+    def setUp(self):
+        self.broker = PubSub(maxsize=2)
+
+    def test_publish_to_subscribers(self):
+        sub1 = self.broker.subscribe(1)
+        sub2 = self.broker.subscribe(2)
+
+        delivered = self.broker.publish([1, 3], {"id": 10})
+
+        self.assertEqual(delivered, 1)
+        self.assertEqual(sub1.get(timeout=0), {"id": 10})
+        self.assertIsNone(sub2.get(timeout=0))
+
+    def test_unsubscribe(self):
+        sub = self.broker.subscribe(1)
+        self.assertEqual(self.broker.subscriber_count(1), 1)
+
+        sub.close()
+
+        self.assertEqual(self.broker.subscriber_count(), 0)
+        self.assertEqual(self.broker.publish([1], {"id": 10}), 0)
+
+    def test_slow_subscriber_drops_oldest(self):
+        sub = self.broker.subscribe(1)
+
+        for msg_id in range(3):
+            self.broker.publish([1], {"id": msg_id})
+
+        self.assertEqual(sub.get(timeout=0), {"id": 1})
+        self.assertEqual(sub.get(timeout=0), {"id": 2})
+        self.assertIsNone(sub.get(timeout=0))
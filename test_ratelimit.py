@@ -0,0 +1,168 @@
+"""Rate limiting tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_ratelimit.py
+
+import os
+from unittest import TestCase
+
+from models import db, User
+from metrics import metrics
+from ratelimit import MemoryBackend, limiter
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, trust_proxies
+from testing import reset_db
+
+app.app_context().push()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+
+class MemoryBackendTestCase(TestCase):
+    """Test the in-memory token buckets."""
+
+    def test_burst_then_refill(self):
+        backend = MemoryBackend()
+
+        for _ in range(3):
+            self.assertEqual(backend.consume("k", rate=1, burst=3, now=100), 0)
+
+        self.assertEqual(backend.consume("k", rate=1, burst=3, now=100), 1)
+        self.assertEqual(backend.consume("k", rate=1, burst=3, now=101), 0)
+
+    def test_eviction_keeps_busy_buckets(self):
+        backend = MemoryBackend(max_keys=2)
+
+        backend.consume("idle", rate=1, burst=1, now=0)
+        backend.consume("busy", rate=1, burst=1, now=10)
+        backend.consume("new", rate=1, burst=1, now=10)
+
+        self.assertNotIn("idle", backend._buckets)
+        self.assertIn("busy", backend._buckets)
+
+    def test_eviction_uses_each_buckets_own_rate(self):
+        backend = MemoryBackend(max_keys=2)
+
+        backend.consume("slow", rate=0.01, burst=1, now=0)
+        backend.consume("fast", rate=100, burst=1, now=10)
+        backend.consume("other", rate=100, burst=1, now=10)
+
+        self.assertNotIn("fast", backend._buckets)
+        self.assertGreater(backend.consume("slow", rate=0.01, burst=1, now=10), 0)
+
+
+class RateLimitViewTestCase(TestCase):
+    """Test that auth routes shed load with 429s."""
+
+    def setUp(self):
+        limiter.backend = MemoryBackend()
+        self.enabled = app.config['RATELIMIT_ENABLED']
+        app.config['RATELIMIT_ENABLED'] = True
+        app.config['RATELIMIT_PER_IP'] = (0.001, 2)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['RATELIMIT_ENABLED'] = self.enabled
+        app.config['RATELIMIT_PER_IP'] = (0.5, 10)
+
+    def test_login_rate_limited(self):
+        before = metrics.get('warbler_ratelimit_rejected_total',
+                             scope='auth', key='ip')
+        data = {"username": "nobody", "password": "password"}
+
+        for _ in range(2):
+            resp = self.client.post("/login", data=data)
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.client.post("/login", data=data)
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn("Retry-After", resp.headers)
+
+        after = metrics.get('warbler_ratelimit_rejected_total',
+                            scope='auth', key='ip')
+        self.assertEqual(after, before + 1)
+
+    def test_get_not_limited(self):
+        for _ in range(5):
+            resp = self.client.get("/login")
+            self.assertEqual(resp.status_code, 200)
+
+    def test_metrics_endpoint(self):
+        resp = self.client.get("/metrics")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "text/plain")
+
+    def test_profile_limits_logged_in_user(self):
+        reset_db()
+        attacker = User.signup("rl_attacker", "rl_attacker@test.com", "password", None)
+        User.signup("rl_victim", "rl_victim@test.com", "password", None)
+        db.session.commit()
+        app.config['RATELIMIT_PER_IP'] = (0.5, 10)
+        app.config['RATELIMIT_PER_USERNAME'] = (0.001, 1)
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = attacker.id
+                # naming the victim takes from the attacker's own bucket
+                c.post("/users/profile", data={"username": "rl_victim",
+                                               "password": "password"})
+                resp = c.post("/users/profile", data={"username": "rl_victim",
+                                                      "password": "password"})
+                self.assertEqual(resp.status_code, 429)
+
+            resp = app.test_client().post("/login", data={"username": "rl_victim",
+                                                          "password": "password"})
+            self.assertNotEqual(resp.status_code, 429)
+        finally:
+            app.config['RATELIMIT_PER_USERNAME'] = (0.1, 5)
+            db.session.rollback()
+
+
+class ProxyTestCase(TestCase):
+    """Test client addresses are taken from trusted X-Forwarded-For."""
+
+    def setUp(self):
+        limiter.backend = MemoryBackend()
+        self.enabled = app.config['RATELIMIT_ENABLED']
+        self.wsgi_app = app.wsgi_app
+        app.config['RATELIMIT_ENABLED'] = True
+        app.config['RATELIMIT_PER_IP'] = (0.001, 2)
+        app.config['PROXY_COUNT'] = 1
+        trust_proxies(app)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.wsgi_app = self.wsgi_app
+        app.config['PROXY_COUNT'] = 0
+        app.config['RATELIMIT_ENABLED'] = self.enabled
+        app.config['RATELIMIT_PER_IP'] = (0.5, 10)
+
+    def via_proxy(self, client_ip):
+        # the proxy connects from loopback and names the client it's serving
+        return {'environ_base': {'REMOTE_ADDR': "127.0.0.1"},
+                'headers': {'X-Forwarded-For': client_ip}}
+
+    def test_bucket_per_client(self):
+        data = {"username": "nobody", "password": "password"}
+
+        for _ in range(2):
+            self.client.post("/login", data=data, **self.via_proxy("203.0.113.1"))
+        resp = self.client.post("/login", data=data, **self.via_proxy("203.0.113.1"))
+        self.assertEqual(resp.status_code, 429)
+
+        resp = self.client.post("/login", data=data, **self.via_proxy("203.0.113.2"))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_metrics_not_open_through_proxy(self):
+        resp = self.client.get("/metrics", **self.via_proxy("203.0.113.1"))
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.client.get("/metrics", **self.via_proxy("127.0.0.1"))
+        self.assertEqual(resp.status_code, 200)
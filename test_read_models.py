@@ -0,0 +1,79 @@
+"""Read model tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_read_models.py
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+import read_models
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from testing import reset_db
+
+app.app_context().push()
+
+
+class ReadModelTestCase(TestCase):
+    """Test the Core queries behind timelines and listings."""
+
+    def setUp(self):
+        reset_db()
+
+        self.u1 = User.signup("read_user_1", "read_user_1@test.com", "password", None)
+        self.u2 = User.signup("read_user_2", "read_user_2@test.com", "password", None)
+        db.session.commit()
+
+        start = datetime(2023, 1, 1)
+        db.session.add_all([
+            Message(id=1, text="first", user_id=self.u1.id, timestamp=start),
+            Message(id=2, text="second", user_id=self.u2.id,
+                    timestamp=start + timedelta(minutes=1)),
+            Message(id=3, text="third", user_id=self.u1.id,
+                    timestamp=start + timedelta(minutes=2)),
+            Follows(user_following_id=self.u1.id, user_being_followed_id=self.u2.id),
+        ])
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u1.id, message_id=2))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_timeline_cards(self):
+        cards = read_models.timeline_cards([self.u1.id, self.u2.id], limit=2)
+
+        self.assertEqual([c.text for c in cards], ["third", "second"])
+        self.assertEqual(cards[1].user.username, "read_user_2")
+
+    def test_user_profile_counts(self):
+        profile = read_models.user_profile(self.u1.id)
+
+        self.assertEqual(profile.username, "read_user_1")
+        self.assertEqual(profile.messages_count, 2)
+        self.assertEqual(profile.following_count, 1)
+        self.assertEqual(profile.followers_count, 0)
+        self.assertEqual(profile.likes_count, 1)
+
+    def test_deleted_user_hidden(self):
+        self.u2.deleted_at = datetime.utcnow()
+        db.session.commit()
+
+        self.assertIsNone(read_models.user_profile(self.u2.id))
+        self.assertEqual([u.username for u in read_models.user_cards()], ["read_user_1"])
+        self.assertEqual(read_models.following_cards(self.u1.id), [])
+
+        # nor are their messages, until the purge removes them
+        user_ids = [self.u1.id, self.u2.id]
+        self.assertEqual([c.id for c in read_models.timeline_cards(user_ids)], [3, 1])
+        self.assertEqual([c.id for c in read_models.cards_by_ids([1, 2, 3])], [1, 3])
+        self.assertEqual([c.id for c in read_models.cards_since(user_ids, 0)], [3, 1])
+        self.assertEqual(read_models.liked_cards(self.u1.id), [])
+
+    def test_likes(self):
+        self.assertEqual(read_models.liked_ids(self.u1.id), {2})
+        self.assertEqual([c.id for c in read_models.liked_cards(self.u1.id)], [2])
@@ -0,0 +1,324 @@
+"""User-ID sharding tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_sharding.py
+
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import func, inspect, select
+
+from models import db, User, Message, Follows, Likes, Notification
+from models import AccountDeletion, ArchivedMessage, MessageDeletion, UserStats
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from archive import archive_messages
+from sharding import shards
+from snowflake import id_at
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+class ShardingTestCase(TestCase):
+    """Test routing to, and scatter-gather across, three SQLite shards."""
+
+    def setUp(self):
+        reset_db()
+
+        self.dir = tempfile.mkdtemp()
+        app.config['SHARD_DATABASE_URLS'] = [
+            f"sqlite:///{os.path.join(self.dir, f'shard{n}.db')}" for n in range(3)]
+        shards.init_app(app)
+        shards.create_all()
+
+        self.client = app.test_client()
+
+        self.u1, self.u2, self.u3 = [self.make_user(f"shard_user_{n}") for n in (1, 2, 3)]
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['SHARD_DATABASE_URLS'] = []
+        shards.init_app(app)
+        shutil.rmtree(self.dir)
+
+    def make_user(self, username):
+        user = User.signup(username, f"{username}@test.com", "password", None)
+        db.session.commit()
+        shards.save_user(user)
+        return user.id
+
+    def count(self, shard, model, *where):
+        with shards.session(shard) as session:
+            return session.scalar(select(func.count()).select_from(model).where(*where))
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_shard_schema(self):
+        inspector = inspect(shards.engines[0])
+
+        self.assertEqual(set(inspector.get_table_names()),
+                         {'users', 'messages', 'follows', 'likes', 'user_stats'})
+        self.assertEqual(inspector.get_foreign_keys('likes'), [])
+
+    def test_users_on_home_shard(self):
+        self.assertEqual(len({shards.shard_of(u) for u in (self.u1, self.u2, self.u3)}), 3)
+
+        with self.client as c:
+            c.post("/signup", data={"username": "shard_new", "email": "shard_new@test.com",
+                                    "password": "password"})
+
+        user_id = User.query.filter_by(username="shard_new").one().id
+        home = shards.shard_of(user_id)
+        for shard in range(3):
+            self.assertEqual(self.count(shard, User, User.id == user_id),
+                             1 if shard == home else 0)
+
+    def test_writes_routed(self):
+        with self.client as c:
+            self.login(c, self.u1)
+            c.post("/messages/new", data={"text": "hello from a shard"})
+            c.post(f"/users/follow/{self.u2}")
+
+        home = shards.shard_of(self.u1)
+        self.assertEqual(self.count(home, Message, Message.user_id == self.u1), 1)
+        self.assertEqual(Message.query.count(), 0)
+
+        # the follow is on the follower's shard and mirrored on the followee's
+        for user_id in (self.u1, self.u2):
+            self.assertEqual(self.count(shards.shard_of(user_id), Follows,
+                                        Follows.user_following_id == self.u1), 1)
+        self.assertEqual(self.count(shards.shard_of(self.u3), Follows), 0)
+
+        profile = shards.user_profile(self.u2)
+        self.assertEqual(profile.followers_count, 1)
+        self.assertEqual(shards.follower_cards(self.u2)[0].username, "shard_user_1")
+
+        with self.client as c:
+            self.login(c, self.u1)
+            c.post(f"/users/stop-following/{self.u2}")
+
+        self.assertEqual(shards.following_ids(self.u1), set())
+        self.assertEqual(shards.follower_ids(self.u2), set())
+
+    def test_bulk_ingest(self):
+        home = shards.shard_of(self.u1)
+
+        with self.client as c:
+            self.login(c, self.u1)
+            resp = c.post("/api/messages/bulk", data='{"text": "bulk one"}\n',
+                          content_type="application/x-ndjson")
+
+        self.assertEqual(len(resp.json['ids']), 1)
+        result = app.test_cli_runner().invoke(
+            args=['ingest-messages', 'shard_user_1'], input='{"text": "bulk two"}\n')
+        self.assertIn("Posted 1 messages", result.output)
+
+        self.assertEqual(self.count(home, Message, Message.user_id == self.u1), 2)
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_export(self):
+        msg = shards.add_message(self.u2, "exported like")
+        shards.add_message(self.u1, "exported message")
+        shards.toggle_like(self.u1, msg.id)
+        shards.follow(self.u1, self.u3)
+        shards.follow(self.u2, self.u1)
+
+        with self.client as c:
+            self.login(c, self.u1)
+            resp = c.get(f"/users/{self.u1}/export")
+
+        lines = [line for line in resp.get_data(as_text=True).splitlines()]
+        self.assertIn("exported message", lines[1])
+        self.assertIn(f'{{"type": "like", "message_id": "{msg.id}"}}', lines)
+        self.assertIn(f'{{"type": "following", "id": {self.u3}, "username": "shard_user_3"}}',
+                      lines)
+        self.assertIn(f'{{"type": "follower", "id": {self.u2}, "username": "shard_user_2"}}',
+                      lines)
+
+    def test_archive(self):
+        old = datetime.utcnow() - timedelta(days=400)
+        shards.insert_messages(self.u1, [{'id': id_at(old), 'user_id': self.u1,
+                                          'text': "old on a shard", 'timestamp': old}])
+        shards.add_message(self.u1, "new on a shard")
+        shards.toggle_like(self.u3, id_at(old))
+
+        self.assertEqual(archive_messages(datetime.utcnow() - timedelta(days=365)), 1)
+
+        archived = ArchivedMessage.query.one()
+        self.assertEqual(archived.data, {"text": "old on a shard", "liked_by": [self.u3]})
+        self.assertEqual(self.count(shards.shard_of(self.u1), Message), 1)
+        self.assertEqual(self.count(shards.shard_of(self.u3), Likes), 0)
+
+    def test_delete_user(self):
+        msg = shards.add_message(self.u1, "goodbye")
+        other = shards.add_message(self.u2, "liked by the leaver")
+        shards.toggle_like(self.u3, msg.id)
+        shards.follow(self.u3, self.u1)
+
+        with self.client as c:
+            self.login(c, self.u1)
+            c.post(f"/users/toggle_like/{other.id}")
+            c.post(f"/users/follow/{self.u2}")
+            self.assertEqual(Notification.query.filter_by(user_id=self.u2).count(), 2)
+            c.post("/users/delete")
+
+        self.assertEqual(Notification.query.filter_by(user_id=self.u2).count(), 0)
+
+        for shard in range(3):
+            self.assertEqual(self.count(shard, Message, Message.user_id == self.u1), 0)
+            self.assertEqual(self.count(shard, Likes), 0)
+            self.assertEqual(self.count(shard, Follows), 0)
+            self.assertEqual(self.count(shard, User, User.id == self.u1), 0)
+
+        progress = AccountDeletion.query.get(self.u1)
+        self.assertEqual((progress.status, progress.messages_deleted,
+                          progress.likes_deleted, progress.follows_deleted),
+                         ("done", 1, 1, 2))
+        self.assertEqual(MessageDeletion.query.one().message_id, msg.id)
+
+    def test_home_timeline_merges_shards(self):
+        shards.follow(self.u1, self.u2)
+        shards.follow(self.u1, self.u3)
+        texts = []
+        for n in range(6):
+            author = (self.u1, self.u2, self.u3)[n % 3]
+            texts.append(f"timeline {n}")
+            shards.add_message(author, texts[-1])
+
+        cards = shards.timeline_cards([self.u1, self.u2, self.u3], limit=4)
+        self.assertEqual([c.text for c in cards], texts[::-1][:4])
+
+        with self.client as c:
+            self.login(c, self.u1)
+            html = c.get("/").get_data(as_text=True)
+
+        positions = [html.index(text) for text in texts[::-1]]
+        self.assertEqual(positions, sorted(positions))
+
+    def test_timeline_since(self):
+        shards.follow(self.u1, self.u2)
+        cursor = id_at(datetime.utcnow() - timedelta(minutes=1))
+        kept = shards.add_message(self.u2, "since two")
+        gone = shards.add_message(self.u1, "since one")
+
+        with self.client as c:
+            self.login(c, self.u1)
+            c.post(f"/messages/{gone.id}/delete")
+            delta = c.get(f"/api/timeline/since?cursor={cursor}").json
+
+        self.assertEqual([m['text'] for m in delta['messages']], ["since two"])
+        self.assertEqual(delta['messages'][0]['id'], str(kept.id))
+        self.assertEqual(delta['deleted'], [str(gone.id)])
+
+    def test_user_search(self):
+        with self.client as c:
+            self.login(c, self.u1)
+            html = c.get("/users?q=shard_user").get_data(as_text=True)
+
+        for n in (1, 2, 3):
+            self.assertIn(f"shard_user_{n}", html)
+        self.assertEqual([u.id for u in shards.user_cards("shard_user")],
+                         sorted([self.u1, self.u2, self.u3]))
+
+    def test_likes(self):
+        msg = shards.add_message(self.u2, "like me")
+
+        with self.client as c:
+            self.login(c, self.u1)
+            c.post(f"/users/toggle_like/{msg.id}")
+            html = c.get(f"/users/{self.u1}/likes").get_data(as_text=True)
+
+        self.assertIn("like me", html)
+        self.assertEqual(self.count(shards.shard_of(self.u1), Likes), 1)
+        self.assertEqual(self.count(shards.shard_of(self.u2), Likes), 0)
+        self.assertEqual(shards.user_profile(self.u1).likes_count, 1)
+
+        with self.client as c:
+            self.login(c, self.u1)
+            c.post(f"/users/toggle_like/{msg.id}")
+
+        self.assertEqual(shards.liked_ids(self.u1), set())
+
+    def test_unlike_names_remaining_liker(self):
+        msg = shards.add_message(self.u2, "like me")
+
+        with self.client as c:
+            for user_id in (self.u1, self.u3, self.u3):
+                self.login(c, user_id)
+                c.post(f"/users/toggle_like/{msg.id}")
+
+        n = Notification.query.one()
+        self.assertEqual((n.actor_count, n.last_actor_id), (1, self.u1))
+
+    def test_show_and_delete_message(self):
+        msg = shards.add_message(self.u3, "on shard three")
+
+        with self.client as c:
+            self.login(c, self.u3)
+            self.assertIn("on shard three", c.get(f"/messages/{msg.id}").get_data(as_text=True))
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertIsNone(shards.message(msg.id))
+
+    def test_gather_runs_in_parallel(self):
+        # deadlocks (and times out) unless all three run at once
+        barrier = threading.Barrier(3, timeout=5)
+
+        results = shards.gather(lambda session, shard: (barrier.wait(), shard)[1])
+
+        self.assertEqual(results, [0, 1, 2])
+
+    def test_concurrent_gathers_run_in_parallel(self):
+        # two requests' scatter reads share the pool without queueing
+        barrier = threading.Barrier(6, timeout=5)
+        results = []
+
+        def request():
+            results.append(shards.gather(lambda session, shard: (barrier.wait(), shard)[1]))
+
+        threads = [threading.Thread(target=request) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [[0, 1, 2], [0, 1, 2]])
+
+    def test_graph_analytics(self):
+        shards.follow(self.u1, self.u2)
+        shards.follow(self.u3, self.u2)
+        shards.follow(self.u2, self.u1)
+
+        result = app.test_cli_runner().invoke(args=['graph-analytics'])
+        self.assertIn("Computed graph metrics for 3 users", result.output)
+
+        self.assertEqual(UserStats.query.count(), 0)
+        with shards.for_user(self.u2) as session:
+            stats = session.get(UserStats, self.u2)
+            self.assertEqual((stats.followers_count, stats.mutuals_count), (2, 1))
+        self.assertEqual(self.count(shards.shard_of(self.u2), UserStats), 1)
+
+        resp = self.client.get(f"/users/{self.u2}")
+        self.assertIn("Reach", resp.get_data(as_text=True))
+
+        db.session.get(User, self.u1).is_admin = True
+        db.session.commit()
+        with self.client as c:
+            self.login(c, self.u1)
+            html = c.get("/admin/graph").get_data(as_text=True)
+
+        self.assertLess(html.index("@shard_user_2"), html.index("@shard_user_3"))
@@ -0,0 +1,159 @@
+"""Slow-query log tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_slowlog.py
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+from metrics import metrics
+from slowlog import redact_parameters, slowlog
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['RATELIMIT_ENABLED'] = False
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test slow statements are logged, explained and shown to admins."""
+
+    def setUp(self):
+        reset_db()
+
+        self.user = User.signup("slowlog_user", "slowlog_user@test.com", "password", None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+        self.dir = tempfile.mkdtemp()
+        app.config['SLOWLOG_PATH'] = os.path.join(self.dir, 'slow.jsonl')
+        slowlog.init_app(app)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 250
+        app.config['SLOWLOG_MAX_BYTES'] = 10_000_000
+        app.config['SLOWLOG_EXPLAIN_MAX_PENDING'] = 8
+        slowlog.init_app(app)
+        shutil.rmtree(self.dir)
+
+        db.session.rollback()
+
+    def test_redact(self):
+        self.assertEqual(redact_parameters(("secret@test.com", 3, None, b"hash")),
+                         ["<str:15>", 3, None, "<bytes:4>"])
+        self.assertEqual(redact_parameters({"username": "bob"}), {"username": "<str:3>"})
+
+    def test_logs_slow_statements(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 0
+
+        with self.client as c:
+            c.post("/login", data={"username": "slowlog_user", "password": "password"})
+
+        records = [r for r in slowlog.recent() if r['endpoint'] == 'warbler.login']
+        self.assertTrue(records)
+
+        record = records[-1]
+        self.assertEqual(record['method'], "POST")
+        self.assertIn("FROM users", record['statement'])
+        self.assertEqual(record['parameters'][0], "<str:12>")
+        self.assertNotIn("slowlog_user", str(record['parameters']))
+        self.assertTrue(record['caller'].startswith("models.py:authenticate"))
+        self.assertTrue(record['plan'])
+
+        # each statement is explained once a minute at most
+        with self.client as c:
+            c.post("/login", data={"username": "slowlog_user", "password": "password"})
+        self.assertIsNone(slowlog.recent()[0]['plan'])
+
+    def test_threshold(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 60_000
+
+        User.query.all()
+
+        self.assertEqual(slowlog.recent(), [])
+
+    def test_failed_statement(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 0
+
+        with db.engine.connect() as connection:
+            with self.assertRaises(Exception):
+                connection.exec_driver_sql("SELECT * FROM no_such_table")
+            self.assertNotIn('slowlog_start', connection.info)
+
+            connection.exec_driver_sql("SELECT 1")
+
+        self.assertEqual(slowlog.recent()[0]['statement'], "SELECT 1")
+
+    def test_rotation(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 0
+        app.config['SLOWLOG_MAX_BYTES'] = 2_000
+        slowlog.init_app(app)
+
+        for _ in range(20):
+            db.session.get(User, self.user_id)
+            db.session.expire_all()
+
+        self.assertTrue(os.path.exists(slowlog.path + ".1"))
+        self.assertEqual(len(slowlog.recent(1000)),
+                         sum(1 for name in os.listdir(self.dir)
+                             for _ in open(os.path.join(self.dir, name))))
+
+    def test_file_per_process(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 0
+        db.session.expire_all()
+        db.session.get(User, self.user_id)
+
+        self.assertEqual(os.listdir(self.dir), [os.path.basename(slowlog.path)])
+        self.assertNotEqual(slowlog.path, app.config['SLOWLOG_PATH'])
+
+        # another worker's newer entry is merged in
+        with open(os.path.join(self.dir, "slow.9999.jsonl"), 'w') as f:
+            f.write('{"at": "9999-01-01T00:00:00.000", "statement": "other worker"}\n')
+
+        self.assertEqual(slowlog.recent()[0]['statement'], "other worker")
+        self.assertEqual(len(slowlog.recent()), 2)
+
+    def test_explain_queue_full(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 0
+        app.config['SLOWLOG_EXPLAIN_MAX_PENDING'] = 0
+        slowlog.init_app(app)
+        dropped = metrics.get('warbler_slowlog_explains_dropped_total')
+
+        db.session.expire_all()
+        db.session.get(User, self.user_id)
+
+        self.assertGreater(metrics.get('warbler_slowlog_explains_dropped_total'), dropped)
+        record = slowlog.recent()[0]
+        self.assertIn("FROM users", record['statement'])
+        self.assertIsNone(record['plan'])
+
+    def test_admin_page(self):
+        app.config['SLOWLOG_THRESHOLD_MS'] = 0
+        User.query.filter_by(username="slowlog_user").all()
+        app.config['SLOWLOG_THRESHOLD_MS'] = None
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.get("/admin/slow-queries", follow_redirects=True)
+            self.assertIn("Access unauthorized", resp.get_data(as_text=True))
+
+            User.query.get(self.user_id).is_admin = True
+            db.session.commit()
+
+            html = c.get("/admin/slow-queries").get_data(as_text=True)
+            self.assertIn("Slow queries", html)
+            self.assertIn("FROM users", html)
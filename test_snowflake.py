@@ -0,0 +1,126 @@
+"""Snowflake ID tests."""
+
+# run these tests like:
+#    python -m unittest test_snowflake.py
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from unittest import TestCase
+
+import snowflake
+from snowflake import IdGenerator, MAX_SEQUENCE, claim_worker_id, id_at, timestamp_of
+
+
+class IdGeneratorTestCase(TestCase):
+    """Test ID layout and ordering."""
+
+    def test_layout(self):
+        gen = IdGenerator(worker_id=5, clock=lambda: 1700000000.0)
+
+        first, second = gen.next_id(), gen.next_id()
+
+        self.assertEqual(second, first + 1)
+        self.assertEqual((first >> 12) & 1023, 5)
+        self.assertEqual(timestamp_of(first), datetime.utcfromtimestamp(1700000000))
+
+    def test_clock_going_backwards(self):
+        now = [1700000000.0]
+        gen = IdGenerator(worker_id=1, clock=lambda: now[0])
+
+        before = gen.next_id()
+        now[0] -= 10
+        self.assertGreater(gen.next_id(), before)
+
+    def test_sequence_exhausted(self):
+        gen = IdGenerator(worker_id=1, clock=lambda: 1700000000.0)
+
+        ids = [gen.next_id() for _ in range(MAX_SEQUENCE + 3)]
+
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(timestamp_of(ids[-1]).microsecond, 1000)
+
+    def test_unique_across_threads(self):
+        gen = IdGenerator(worker_id=1)
+        ids = []
+
+        def make():
+            ids.extend(gen.next_id() for _ in range(2000))
+
+        threads = [threading.Thread(target=make) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(set(ids)), 8000)
+
+    def test_id_at_is_lower_bound(self):
+        when = datetime(2024, 5, 1, 12)
+        gen = IdGenerator(worker_id=1023, clock=lambda: (when - datetime(1970, 1, 1)).total_seconds())
+
+        self.assertLessEqual(id_at(when), gen.next_id())
+        self.assertLess(gen.next_id(), id_at(datetime(2024, 5, 1, 12, 0, 0, 1000)))
+
+
+class WorkerIdTestCase(TestCase):
+    """Test that processes claim distinct worker IDs."""
+
+    def setUp(self):
+        self.saved = {key: os.environ.pop(key, None)
+                      for key in ('WARBLER_WORKER_ID', 'WARBLER_WORKER_SPAN',
+                                  'WARBLER_WORKER_LOCK_DIR')}
+        os.environ['WARBLER_WORKER_LOCK_DIR'] = tempfile.mkdtemp()
+        os.environ['WARBLER_WORKER_ID'] = "100"
+        os.environ['WARBLER_WORKER_SPAN'] = "2"
+        self.claimed = set(snowflake._claimed)
+
+    def tearDown(self):
+        snowflake._claimed.intersection_update(self.claimed)
+        for key, value in self.saved.items():
+            os.environ.pop(key, None)
+            if value is not None:
+                os.environ[key] = value
+
+    def claim_in_child(self):
+        return subprocess.run(
+            [sys.executable, "-c",
+             "from snowflake import claim_worker_id; print(claim_worker_id()[0])"],
+            capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def test_processes_get_distinct_ids(self):
+        worker_id, lock_file = claim_worker_id()
+        child = self.claim_in_child()
+
+        self.assertEqual(child.returncode, 0, child.stderr)
+        self.assertEqual({worker_id, int(child.stdout)}, {100, 101})
+
+        # a finished process's ID is free again
+        self.assertEqual(self.claim_in_child().stdout, child.stdout)
+
+    def test_range_exhausted(self):
+        held = [claim_worker_id(), claim_worker_id()]
+
+        with self.assertRaises(RuntimeError):
+            claim_worker_id()
+        self.assertIn("all in use", self.claim_in_child().stderr)
+        self.assertEqual(sorted(worker_id for worker_id, _ in held), [100, 101])
+
+    def test_single_id(self):
+        os.environ.pop('WARBLER_WORKER_SPAN')
+        os.environ['WARBLER_WORKER_ID'] = "200"
+
+        gen = IdGenerator()
+        self.assertEqual(gen.next_id() >> 12 & 1023, 200)
+        self.assertNotEqual(self.claim_in_child().returncode, 0)
+
+    def test_bad_range(self):
+        os.environ['WARBLER_WORKER_ID'] = "1020"
+        os.environ['WARBLER_WORKER_SPAN'] = "10"
+
+        with self.assertRaises(ValueError):
+            claim_worker_id()
@@ -0,0 +1,174 @@
+"""Embedded SQLite mode tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_sqlite_wal.py
+
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from models import db, connect_db, User, Message
+from sqlite_wal import WriterLockTimeout, bulk_load
+
+
+def make_app(path, **config):
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    app.config['SQLITE_PRAGMAS'] = dict(Config.SQLITE_PRAGMAS)
+    app.config.update(config)
+    connect_db(app)
+    return app
+
+
+class SQLiteWALTestCase(TestCase):
+    """Test pragmas, writer serialization and bulk loading on a file DB."""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.app = make_app(os.path.join(self.dir, 'warbler.db'))
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.user = User.signup("wal_user", "wal_user@test.com", "password", None)
+        db.session.commit()
+        self.user_id = self.user.id
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.remove()
+        db.engine.dispose()
+        self.ctx.pop()
+        shutil.rmtree(self.dir)
+
+    def in_thread(self, fn):
+        """Run `fn` in its own app context (and so session) on a new thread."""
+
+        def run():
+            with self.app.app_context():
+                try:
+                    fn()
+                finally:
+                    db.session.remove()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_pragmas(self):
+        connection = db.session.connection()
+        pragma = lambda name: connection.execute(text(f"PRAGMA {name}")).scalar()
+
+        self.assertEqual(pragma('journal_mode'), 'wal')
+        self.assertEqual(pragma('foreign_keys'), 1)
+        self.assertEqual(pragma('synchronous'), 1)     # NORMAL
+        self.assertEqual(pragma('busy_timeout'), 5000)
+
+    def test_foreign_keys_enforced(self):
+        db.session.add(Message(text="orphan", user_id=self.user_id + 1000))
+
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_writers_serialized(self):
+        events = []
+        flushed = threading.Event()
+        release = threading.Event()
+
+        def first():
+            db.session.add(Message(text="first", user_id=self.user_id))
+            db.session.flush()
+            flushed.set()
+            release.wait(5)
+            events.append('first commit')
+            db.session.commit()
+
+        def second():
+            flushed.wait(5)
+            db.session.add(Message(text="second", user_id=self.user_id))
+            db.session.flush()
+            events.append('second flush')
+            db.session.commit()
+
+        threads = [self.in_thread(first), self.in_thread(second)]
+        flushed.wait(5)
+        threads[1].join(0.2)
+        # the second writer is still queued behind the first's transaction
+        self.assertEqual(events, [])
+
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(events, ['first commit', 'second flush'])
+        self.assertEqual(db.session.scalar(select(func.count(Message.id))), 2)
+
+    def test_lock_released_on_rollback(self):
+        db.session.add(Message(text="discarded", user_id=self.user_id))
+        db.session.flush()
+        db.session.rollback()
+
+        done = []
+        thread = self.in_thread(lambda: (
+            db.session.add(Message(text="kept", user_id=self.user_id)),
+            db.session.commit(),
+            done.append(True)))
+        thread.join(5)
+
+        self.assertEqual(done, [True])
+
+    def test_lock_timeout(self):
+        app = make_app(os.path.join(self.dir, 'other.db'),
+                       SQLITE_PRAGMAS=dict(Config.SQLITE_PRAGMAS, busy_timeout=100))
+        with app.app_context():
+            db.create_all()
+
+        holding = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with app.app_context():
+                db.session.execute(insert(User).values(
+                    username="holder", email="holder@test.com", password="x"))
+                holding.set()
+                release.wait(5)
+                db.session.rollback()
+                db.session.remove()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        holding.wait(5)
+
+        try:
+            with app.app_context():
+                db.session.add(User(username="waiter", email="waiter@test.com",
+                                    password="x"))
+                with self.assertRaises(WriterLockTimeout):
+                    db.session.flush()
+                db.session.rollback()
+                db.session.remove()
+        finally:
+            release.set()
+            thread.join(5)
+
+    def test_bulk_load(self):
+        with bulk_load(db.engine) as connection:
+            self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 0)
+            connection.execute(insert(Message), [
+                dict(id=n, text=f"bulk {n}", user_id=self.user_id)
+                for n in range(1, 101)])
+
+        self.assertEqual(db.session.scalar(select(func.count(Message.id))), 100)
+        # pooled connections go back to normal durability
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.exec_driver_sql("PRAGMA synchronous").scalar(), 1)
+            self.assertTrue(connection.exec_driver_sql(
+                "SELECT count(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").scalar())
@@ -0,0 +1,109 @@
+"""Tag and mention indexing tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_tagging.py
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, MessageTag, Mention, Tag
+from tagging import extract_tokens, linkify, backfill, tag_ids
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+
+class ExtractTestCase(TestCase):
+    """Test token extraction and rendering."""
+
+    def test_extract_tokens(self):
+        tags, mentions = extract_tokens("Hi @alice! #Python and #python, #flask. a#b me@x.com")
+
+        self.assertEqual(tags, {"python", "flask"})
+        self.assertEqual(mentions, {"alice"})
+
+    def test_linkify_escapes(self):
+        html = linkify("<b>#Tag</b> @bob")
+
+        self.assertIn("&lt;b&gt;", html)
+        self.assertIn('<a href="/tags/tag">#Tag</a>', html)
+        self.assertIn('<a href="/users?q=bob">@bob</a>', html)
+
+
+class TagViewTestCase(TestCase):
+    """Test indexing on post, backfill and tag timelines."""
+
+    def setUp(self):
+        reset_db()
+
+        self.client = app.test_client()
+
+        self.u1 = User.signup("tag_user_1", "tag_user_1@test.com", "password", None)
+        self.u2 = User.signup("tag_user_2", "tag_user_2@test.com", "password", None)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_post_indexes_tokens(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+
+            c.post("/messages/new", data={"text": "hello #Warbler @tag_user_2 @nobody"})
+
+        msg = Message.query.one()
+        tag = Tag.query.filter_by(name="warbler").one()
+        self.assertEqual(MessageTag.query.filter_by(tag_id=tag.id).one().message_id, msg.id)
+        self.assertEqual([m.user_id for m in Mention.query.all()], [self.u2.id])
+
+    def test_tag_ids_conflict(self):
+        # the second "raced" stands in for a tag another request inserted
+        # between the lookup and the insert
+        ids = tag_ids(["fresh", "raced", "raced"])
+
+        self.assertEqual(set(ids), {"fresh", "raced"})
+        self.assertEqual(Tag.query.count(), 2)
+
+    def test_backfill_and_pagination(self):
+        for i in range(5):
+            db.session.add(Message(id=i + 1, text=f"number {i} #count", user_id=self.u1.id))
+        db.session.add(Message(id=6, text="untagged", user_id=self.u1.id))
+        db.session.commit()
+
+        self.assertEqual(backfill(batch_size=2), 6)
+        self.assertEqual(backfill(batch_size=2), 6)
+        self.assertEqual(MessageTag.query.count(), 5)
+
+        app.config['TAG_PAGE_SIZE'] = 3
+        try:
+            resp = self.client.get("/tags/count")
+            self.assertIn("number 4", str(resp.data))
+            self.assertNotIn("number 1", str(resp.data))
+            self.assertIn("?before=3", str(resp.data))
+
+            resp = self.client.get("/tags/count?before=3")
+            self.assertIn("number 1", str(resp.data))
+            self.assertIn("number 0", str(resp.data))
+            self.assertNotIn("number 2", str(resp.data))
+        finally:
+            app.config['TAG_PAGE_SIZE'] = 50
+
+    def test_mentions_timeline(self):
+        db.session.add(Message(id=10, text="hey @tag_user_2", user_id=self.u1.id))
+        db.session.commit()
+        backfill()
+
+        resp = self.client.get(f"/users/{self.u2.id}/mentions")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Mentions of @tag_user_2", str(resp.data))
+        self.assertIn("/users?q=tag_user_2", str(resp.data))
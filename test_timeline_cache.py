@@ -0,0 +1,77 @@
+"""Timeline cache tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_timeline_cache.py
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message
+from timeline_cache import timeline_cache
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from testing import reset_db
+
+app.app_context().push()
+
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+
+class TimelineCacheTestCase(TestCase):
+    """Test heap-merged timelines from per-author rings."""
+
+    def setUp(self):
+        reset_db()
+        timeline_cache.init_app(app)
+        app.config['TIMELINE_CACHE_SIZE'] = 3
+
+        self.u1 = User.signup("cache_user_1", "cache_user_1@test.com", "password", None)
+        self.u2 = User.signup("cache_user_2", "cache_user_2@test.com", "password", None)
+        db.session.commit()
+
+        start = datetime(2023, 1, 1)
+        # u1 posts on even minutes, u2 on odd ones
+        for i in range(8):
+            author = self.u1 if i % 2 == 0 else self.u2
+            db.session.add(Message(id=i + 1, text=f"msg {i + 1}", user_id=author.id,
+                                   timestamp=start + timedelta(minutes=i)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_CACHE_SIZE'] = 100
+
+    def test_merged_timeline(self):
+        ids = timeline_cache.timeline_ids([self.u1.id, self.u2.id], limit=4)
+
+        self.assertEqual(ids, [8, 7, 6, 5])
+
+    def test_timeline_hydrates_in_order(self):
+        messages = timeline_cache.timeline([self.u1.id, self.u2.id], limit=3)
+
+        self.assertEqual([m.text for m in messages], ["msg 8", "msg 7", "msg 6"])
+
+    def test_add(self):
+        timeline_cache.timeline_ids([self.u1.id])
+
+        msg = Message(id=100, text="new", user_id=self.u1.id,
+                      timestamp=datetime(2024, 1, 1))
+        db.session.add(msg)
+        db.session.commit()
+        timeline_cache.add(msg)
+
+        self.assertEqual(timeline_cache.timeline_ids([self.u1.id]), [100, 7, 5])
+
+    def test_remove_from_full_ring_reloads(self):
+        timeline_cache.timeline_ids([self.u1.id])
+
+        msg = Message.query.get(7)
+        timeline_cache.remove(msg)
+        db.session.delete(msg)
+        db.session.commit()
+
+        self.assertEqual(timeline_cache.timeline_ids([self.u1.id]), [5, 3, 1])
@@ -0,0 +1,101 @@
+"""Timeline delta endpoint tests."""
+
+# run these tests like:
+#    FLASK_ENV=production python -m unittest test_timeline_delta.py
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Follows, MessageDeletion
+from snowflake import id_at
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import reset_db
+
+app.app_context().push()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['TESTING'] = True
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+
+class TimelineDeltaTestCase(TestCase):
+    """Test /api/timeline/since."""
+
+    def setUp(self):
+        reset_db()
+
+        self.client = app.test_client()
+
+        self.u1 = User.signup("delta_user_1", "delta_user_1@test.com", "password", None)
+        self.u2 = User.signup("delta_user_2", "delta_user_2@test.com", "password", None)
+        self.u3 = User.signup("delta_user_3", "delta_user_3@test.com", "password", None)
+        db.session.commit()
+        db.session.add(Follows(user_following_id=self.u1.id, user_being_followed_id=self.u2.id))
+        db.session.commit()
+
+        self.start = id_at(datetime.utcnow() - timedelta(minutes=1))
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def delta(self, cursor):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1.id
+            return c.get(f"/api/timeline/since?cursor={cursor}")
+
+    def test_new_and_deleted(self):
+        old = Message(text="old", user_id=self.u2.id)
+        db.session.add(old)
+        db.session.commit()
+        cursor = old.id
+
+        new = Message(text="new", user_id=self.u2.id)
+        stranger = Message(text="not followed", user_id=self.u3.id)
+        db.session.add_all([new, stranger])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2.id
+            c.post(f"/messages/{old.id}/delete")
+
+        data = self.delta(cursor).json
+
+        self.assertFalse(data['reset'])
+        self.assertEqual([m['text'] for m in data['messages']], ["new"])
+        self.assertEqual(data['messages'][0]['id'], str(new.id))
+        self.assertEqual(data['messages'][0]['user']['username'], "delta_user_2")
+        self.assertEqual(data['deleted'], [str(old.id)])
+        self.assertGreaterEqual(int(data['cursor']), cursor)
+
+    def test_nothing_changed(self):
+        data = self.delta(self.start).json
+
+        self.assertEqual((data['messages'], data['deleted']), ([], []))
+        self.assertGreater(int(data['cursor']), self.start)
+
+    def test_stale_cursor_resets(self):
+        data = self.delta(id_at(datetime.utcnow() - timedelta(days=30))).json
+
+        self.assertTrue(data['reset'])
+
+    def test_requires_login(self):
+        self.assertEqual(self.client.get(f"/api/timeline/since?cursor={self.start}").status_code, 401)
+
+    def test_prune(self):
+        db.session.add_all([
+            MessageDeletion(id=id_at(datetime.utcnow() - timedelta(days=30)),
+                            message_id=1, user_id=self.u2.id),
+            MessageDeletion(message_id=2, user_id=self.u2.id),
+        ])
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['prune-deletions'])
+
+        self.assertIn("Pruned 1", result.output)
+        self.assertEqual([d.message_id for d in MessageDeletion.query.all()], [2])
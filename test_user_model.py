@@ -14,6 +14,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 from app import app
+from testing import reset_db
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -30,8 +31,7 @@ class UserModelTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
         with app.app_context():
-            db.drop_all()
-            db.create_all()
+            reset_db()
 
             u1 = User.signup('TestUser1', 'TestUser1@gmail.com', 'TestPassword1', None)
             u1_id = 1000
@@ -57,7 +57,6 @@ class UserModelTestCase(TestCase):
     def tearDown(self):
         res = super().tearDown()
         db.session.rollback()
-        db.drop_all()
         return res
 
 
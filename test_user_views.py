@@ -4,9 +4,11 @@
 #    FLASK_ENV=production python -m unittest test_user_views.py
 
 import os
+from datetime import datetime
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Likes, Follows
+from models import db, connect_db, Message, User, Likes, Follows, AccountDeletion
+from models import MessageDeletion
 from bs4 import BeautifulSoup
 
 # BEFORE we import our app, let's set an environmental variable
@@ -17,6 +19,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 # Now we can import app
 from app import app, CURR_USER_KEY
+from testing import reset_db
+from deletion import purge_user
 
 app.app_context().push()
 
@@ -41,8 +45,7 @@ class UserViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
-        db.drop_all()
-        db.create_all()
+        reset_db()
 
         self.client = app.test_client()
 
@@ -68,7 +71,6 @@ class UserViewTestCase(TestCase):
     def tearDown(self):
         resp = super().tearDown()
         db.session.rollback()
-        db.drop_all()
         return resp
 
 
@@ -290,3 +292,83 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertNotIn("@test_user_2", str(resp.data))
             self.assertIn("Access unauthorized", str(resp.data))
+
+
+    def test_delete_user(self):
+        self.setup_followers()
+        self.setup_likes()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post("/users/delete", follow_redirects=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Your account has been deleted", str(resp.data))
+
+            self.assertIsNone(User.query.get(self.u1_id))
+            self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(), 0)
+            self.assertEqual(Likes.query.filter_by(user_id=self.u1_id).count(), 0)
+            self.assertEqual(Follows.query.filter(
+                (Follows.user_following_id == self.u1_id) |
+                (Follows.user_being_followed_id == self.u1_id)).count(), 0)
+
+            progress = AccountDeletion.query.get(self.u1_id)
+            self.assertEqual(progress.status, "done")
+            self.assertEqual(progress.messages_deleted, 2)
+            self.assertEqual(progress.likes_deleted, 1)
+            self.assertEqual(progress.follows_deleted, 3)
+            self.assertEqual(MessageDeletion.query.filter_by(user_id=self.u1_id).count(), 2)
+
+
+    def test_failed_deletion_resumed(self):
+        self.setup_likes()
+        user = User.query.get(self.u1_id)
+        user.deleted_at = datetime.utcnow()
+        db.session.add(AccountDeletion(user_id=self.u1_id, username=user.username))
+        db.session.commit()
+
+        # tombstones can't be written, so the purge can't finish; reset_db()
+        # creates the table again for the next test
+        MessageDeletion.__table__.drop(db.engine)
+
+        progress = purge_user(self.u1_id)
+        self.assertEqual(progress.status, "failed")
+        self.assertIn("message_deletions", progress.error)
+        self.assertIsNotNone(db.session.get(User, self.u1_id))
+
+        result = app.test_cli_runner().invoke(args=['resume-deletions'])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("1 still failing", result.output)
+
+    def test_resume_deletions(self):
+        self.setup_likes()
+        user = User.query.get(self.u1_id)
+        user.deleted_at = datetime.utcnow()
+        # as if the process died mid-purge
+        db.session.add(AccountDeletion(user_id=self.u1_id, username=user.username,
+                                       status="running"))
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=['resume-deletions'])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Resumed 1 account deletions, 0 still failing", result.output)
+        self.assertIsNone(User.query.get(self.u1_id))
+        self.assertEqual(AccountDeletion.query.get(self.u1_id).status, "done")
+
+
+    def test_admin_deletions_requires_admin(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/admin/deletions", follow_redirects=True)
+            self.assertIn("Access unauthorized", str(resp.data))
+
+            User.query.get(self.u1_id).is_admin = True
+            db.session.commit()
+
+            resp = c.get("/admin/deletions")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Account deletions", str(resp.data))
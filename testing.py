@@ -0,0 +1,19 @@
+"""Shared set-up for the test modules."""
+
+from models import db
+
+
+def reset_db():
+    """Create any missing tables, then empty every table.
+
+    The test modules share one database and, under pytest, one process, so
+    they clear rows between tests rather than dropping tables that other
+    modules' tests expect to exist. The session is discarded first, so no
+    objects from an earlier test linger in its identity map.
+    """
+
+    db.session.remove()
+    db.create_all()
+    for table in reversed(db.metadata.sorted_tables):
+        db.session.execute(table.delete())
+    db.session.commit()
@@ -0,0 +1,170 @@
+"""Per-author rings of recent message IDs, merged into home timelines.
+
+An alternative read path for homepage(), enabled with
+TIMELINE_READ_PATH = 'cache'. Each author's newest TIMELINE_CACHE_SIZE
+message IDs are kept newest-first (IDs are time-ordered snowflakes, see
+snowflake.py); a home timeline is a k-way heap merge of the rings of
+everyone the reader follows, and the winning messages are loaded in one
+query by primary key (see read_models).
+
+The cache is per process. messages_add/messages_destroy keep the local
+rings exact, and TIMELINE_CACHE_TTL bounds how stale a ring can be
+relative to writes handled by other workers.
+"""
+
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, Message
+from read_models import cards_by_ids
+
+
+class MemoryBackend:
+    """Rings in an LRU-ordered dict."""
+
+    def __init__(self, max_authors):
+        self.max_authors = max_authors
+        self._lock = threading.Lock()
+        self._rings = OrderedDict()
+
+    def get(self, author_id, ttl):
+        """The ring for `author_id`, or None if missing or expired."""
+
+        with self._lock:
+            entry = self._rings.get(author_id)
+            if entry is None:
+                return None
+            loaded_at, ring = entry
+            if time.monotonic() - loaded_at > ttl:
+                del self._rings[author_id]
+                return None
+            self._rings.move_to_end(author_id)
+            return ring
+
+    def set(self, author_id, ring):
+        with self._lock:
+            self._rings[author_id] = (time.monotonic(), ring)
+            self._rings.move_to_end(author_id)
+            while len(self._rings) > self.max_authors:
+                self._rings.popitem(last=False)
+
+    def update(self, author_id, fn):
+        """Replace the cached ring with `fn(ring)`, if there is one.
+
+        `fn` may return None to drop the ring.
+        """
+
+        with self._lock:
+            entry = self._rings.get(author_id)
+            if entry is None:
+                return
+            ring = fn(entry[1])
+            if ring is None:
+                del self._rings[author_id]
+            else:
+                self._rings[author_id] = (entry[0], ring)
+
+    def delete(self, author_id):
+        with self._lock:
+            self._rings.pop(author_id, None)
+
+
+class TimelineCache:
+    """Flask extension holding the per-author rings."""
+
+    def init_app(self, app):
+        self.backend = MemoryBackend(app.config['TIMELINE_CACHE_MAX_AUTHORS'])
+
+    @property
+    def size(self):
+        return current_app.config['TIMELINE_CACHE_SIZE']
+
+    def rings(self, author_ids):
+        """Map each of `author_ids` to its ring, loading misses in one query."""
+
+        ttl = current_app.config['TIMELINE_CACHE_TTL']
+        rings = {}
+        missing = []
+
+        for author_id in author_ids:
+            ring = self.backend.get(author_id, ttl)
+            if ring is None:
+                missing.append(author_id)
+            else:
+                rings[author_id] = ring
+
+        if missing:
+            for author_id, ring in self._load(missing).items():
+                self.backend.set(author_id, ring)
+                rings[author_id] = ring
+
+        return rings
+
+    def _load(self, author_ids):
+        """Newest `size` message IDs for each author."""
+
+        rank = (func.row_number()
+                .over(partition_by=Message.user_id, order_by=Message.id.desc())
+                .label('rank'))
+        ranked = (select(Message.user_id, Message.id, rank)
+                  .where(Message.user_id.in_(author_ids))
+                  .subquery())
+        rows = db.session.execute(
+            select(ranked.c.user_id, ranked.c.id)
+            .where(ranked.c.rank <= self.size)
+            .order_by(ranked.c.user_id, ranked.c.rank))
+
+        rings = {author_id: [] for author_id in author_ids}
+        for row in rows:
+            rings[row.user_id].append(row.id)
+
+        return {author_id: tuple(ring) for author_id, ring in rings.items()}
+
+    def timeline_ids(self, author_ids, limit=100):
+        """IDs of the newest `limit` messages by any of `author_ids`."""
+
+        merged = heapq.merge(*self.rings(author_ids).values(), reverse=True)
+        return list(islice(merged, limit))
+
+    def timeline(self, author_ids, limit=100):
+        """MessageCards for a home timeline, newest first."""
+
+        return cards_by_ids(self.timeline_ids(author_ids, limit))
+
+    def add(self, *messages):
+        """Put newly posted messages into their authors' rings."""
+
+        size = self.size
+        by_author = {}
+        for msg in messages:
+            by_author.setdefault(msg.user_id, []).append(msg.id)
+
+        for author_id, ids in by_author.items():
+            def insert(ring, ids=tuple(ids)):
+                return tuple(sorted(ring + ids, reverse=True)[:size])
+
+            self.backend.update(author_id, insert)
+
+    def remove(self, msg):
+        """Take a deleted message out of its author's ring."""
+
+        size = self.size
+
+        def drop(ring):
+            kept = tuple(msg_id for msg_id in ring if msg_id != msg.id)
+            # a full ring can't know what the next-oldest message is
+            return None if len(ring) == size and len(kept) < size else kept
+
+        self.backend.update(msg.user_id, drop)
+
+    def invalidate(self, author_id):
+        self.backend.delete(author_id)
+
+
+timeline_cache = TimelineCache()